@@ -1,8 +1,19 @@
 import vtk
 import vtk.util.numpy_support as VN
 import numpy as np
+import contextlib
 import os
 
+from src.cache import select_point_array, wrap_image
+from src.instrument import Instrumentation
+from src.isosurface import block_ranges, create_contour_filter
+from src.occupancy import occupied_extent
+from src.prefetch import Prefetcher
+from src.slices import PLANES, color_plane, cut_plane, slice_grid, write_png
+from src.transfer import get_preset
+from src.video import VideoWriter
+from src.writer import AsyncImageWriter
+
 # Use built-in VTK color names
 #   see: https://en.wikipedia.org/wiki/Web_colors
 colors = vtk.vtkNamedColors()
@@ -31,29 +42,305 @@ AIRBURST = (
     'pv_insitu_300x300x300_12806-ts20.vti',
 )
 
+# Iso values of the low and high threshold surfaces
+ISO_LOW = 0.1
+ISO_HIGH = 0.8
+
+# Point data arrays of each timestep
+ATTRIBUTES = ('v02', 'v03', 'prs', 'tev')
+
+# Render modes mapped to the AsteroidVTK method that produces them.
+#   The mode name doubles as the output sub-folder.
+RENDER_MODES = {
+    'iso': 'render_iso',
+    'sliced': 'render_sliced_iso',
+    'volume': 'render_volume',
+}
+
+# Camera presets as (zpos, elevation[, azimuth]), see AsteroidVTK._initialize_camera
+CAMERA_PRESETS = {
+    'front': (0, -30.0),
+    'front_angle': (0.4, 0.0),
+    'side': (1, 0.0),
+}
+
+# Default camera preset of each render mode
+MODE_CAMERAS = {
+    'iso': 'front',
+    'sliced': 'side',
+    'volume': 'front',
+}
+
+# Render window classes that can be selected explicitly, see AsteroidVTK(backend=...)
+#   None uses the vtkRenderWindow factory default for the platform
+RENDER_BACKENDS = {
+    'egl': 'vtkEGLRenderWindow',  # GPU without a display server
+    'osmesa': 'vtkOSOpenGLRenderWindow',  # software rendering, no GPU needed
+}
+
+# Volume mappers, see AsteroidVTK(volume_mapper=...)
+#   auto uses the GPU ray caster on hardware OpenGL and falls back to the CPU one
+#   on software OpenGL (OSMesa/llvmpipe), where GPU ray casting is several times slower
+VOLUME_MAPPERS = {
+    'gpu': 'vtkGPUVolumeRayCastMapper',
+    'smart': 'vtkSmartVolumeMapper',
+    'cpu': 'vtkFixedPointVolumeRayCastMapper',
+}
+
+# Volume sampling per quality: (sample distance along rays in grid spacings,
+#   image sample distance in pixels between cast rays), see AsteroidVTK(volume_quality=...)
+VOLUME_QUALITY = {
+    'draft': (2.0, 2.0),
+    'final': (0.5, 1.0),
+}
+
+# OpenGL renderer strings of software rasterizers
+SOFTWARE_RENDERERS = ('llvmpipe', 'softpipe', 'swrast', 'software rasterizer')
+
+# Scene actors shown by each render mode when the scene is persistent.
+SCENE_ACTORS = {
+    'iso': ('outline', 'iso_low', 'iso_high', 'iso_title'),
+    'sliced': ('outline', 'slice', 'iso_low', 'iso_high', 'iso_title'),
+    'volume': ('outline', 'volume'),
+}
+
+
+def timestep_tag(image):
+    """
+    Timestamp + step tag of an AIRBURST filename.
+
+    :param image: (str)
+        e.g. 'pv_insitu_300x300x300_08415-ts08.vti'
+    :return: (str)
+        e.g. '08415-ts08'
+    """
+    return os.path.basename(image).split('.')[0].split('_')[-1]
+
+
+def timestep_time(image):
+    """
+    Simulation time encoded in an AIRBURST filename.
+
+    :param image: (str)
+        e.g. 'pv_insitu_300x300x300_08415-ts08.vti'
+    :return: (int)
+        e.g. 8415
+    """
+    return int(timestep_tag(image).split('-')[0])
+
+
+def orbit(steps, zpos=0, elevation=-30.0, degrees=360.0, start=0.0):
+    """
+    Camera path around the asteroid: evenly spaced azimuths at a fixed elevation.
+
+    :param steps: (int)
+        viewpoints on the path
+    :param zpos: (float)
+        as in CAMERA_PRESETS
+    :param elevation: (float)
+        as in CAMERA_PRESETS
+    :param degrees: (float)
+        azimuth covered, 360 for a full turntable (the last step stops short of the first)
+    :param start: (float)
+        azimuth of the first viewpoint
+    :return: (list of (str, float, float, float))
+        (name, zpos, elevation, azimuth) per viewpoint, named orbit000, orbit001, ...
+    """
+    step = degrees / steps if degrees % 360 == 0 else degrees / max(steps - 1, 1)
+    return [('orbit{0:03d}'.format(i), zpos, elevation, start + i * step) for i in range(steps)]
+
+
+def output_views(sourcefile, outfolder, mode, cameras=None):
+    """
+    Images that render_all writes for one timestep and mode.
+
+    :param sourcefile: (str)
+        .vti timestep
+    :param outfolder: (str)
+        root output folder, one sub-folder per mode
+    :param mode: (str)
+        key of RENDER_MODES
+    :param cameras: (tuple)
+        keys of CAMERA_PRESETS or (name, zpos, elevation[, azimuth]) viewpoints (see orbit),
+        None for the mode's own camera (MODE_CAMERAS)
+    :return: (list of tuple)
+        (outfile, zpos, elevation[, azimuth]) per image
+    """
+    mode_folder = os.path.join(outfolder, mode)
+    tag = timestep_tag(sourcefile)
+    if cameras is None:
+        outfile = os.path.join(mode_folder, 'output_{0}.png'.format(tag))
+        return [(outfile,) + tuple(CAMERA_PRESETS[MODE_CAMERAS[mode]])]
+    views = []
+    for camera in cameras:
+        name, viewpoint = (camera, CAMERA_PRESETS[camera]) if isinstance(camera, str) else (camera[0], camera[1:])
+        views.append((os.path.join(mode_folder, 'output_{0}_{1}.png'.format(tag, name)),) + tuple(viewpoint))
+    return views
+
+
 class AsteroidVTK(object):
 
-    def __init__(self):
+    def __init__(self, offscreen=False, persistent=False, cache=None, stats=None, stable_range=False,
+                 backend=None, volume_mapper=None, voi=None, stride=1, isosurfaces=None, instrumentation=None,
+                 image_writer=None, size=(800, 800), transfer='airburst', skip_empty=False,
+                 volume_quality=None):
+        """
+        :param offscreen: (bool)
+            headless: render into an offscreen buffer, never create the interactor
+            and render each frame exactly once
+        :param persistent: (bool)
+            build the outline/slice/isosurface/volume pipelines once and reuse them
+            for every timestep; only the loaded data and the ranges change per frame
+        :param cache: (VolumeCache, Prefetcher or ChunkedStore)
+            load timesteps from memory-mapped arrays instead of decoding the .vti each time,
+            from a Prefetcher that decoded them in the background, or from a chunked store
+        :param stats: (StatsIndex)
+            take transfer-function ranges from precomputed statistics instead of
+            reducing the full data array every frame
+        :param stable_range: (bool)
+            use the range of the attribute over the whole series (requires stats),
+            so colors do not jump between frames of an animation
+        :param backend: (str)
+            key of RENDER_BACKENDS, None for the platform default window
+        :param volume_mapper: (str)
+            key of VOLUME_MAPPERS or 'auto', defaults to gpu on screen and auto when offscreen
+        :param voi: (tuple)
+            preview: only render this volume of interest (minX, maxX, minY, maxY, minZ, maxZ)
+        :param stride: (int)
+            preview: keep every stride-th point along each axis (2 or 4 for quick looks)
+        :param isosurfaces: (IsosurfaceCache)
+            reuse isosurface meshes extracted once per (file, attribute, iso value);
+            previews (voi/stride) always contour the loaded data
+        :param instrumentation: (Instrumentation)
+            record wall/cpu time and peak RSS of every load, build, render and save,
+            plus the executions of the reader, filters and mappers
+        :param image_writer: (AsyncImageWriter or VideoWriter)
+            write-behind output: frames are copied from the framebuffer and encoded and
+            written in the background; call flush() before using the images. A VideoWriter
+            streams the frames into videos instead of image files
+        :param size: (tuple)
+            (width, height) of the render window and of every saved frame
+        :param transfer: (str or TransferFunction)
+            volume transfer function: key of transfer.PRESETS, path of a JSON preset, or a preset.
+            One volume property is shared by every frame and mode and only refilled when the
+            preset is edited or the range changes (constant with stable_range or a preset range)
+        :param skip_empty: (bool)
+            empty-space skipping: crop the volume mapper to the blocks that hold values
+            the transfer function makes visible (block min/max computed once per timestep),
+            and skip the volume entirely when nothing is visible
+        :param volume_quality: (str or tuple)
+            key of VOLUME_QUALITY or (sample distance, image sample distance); fixes the
+            volume sampling instead of the mapper defaults, e.g. 'draft' for quick looks
+        """
+        if stable_range and stats is None:
+            # Without the series range every frame would silently use its own
+            raise ValueError('stable_range requires stats, see src.stats.build_index')
         # Create the renderer, the render window, and the interactor.
         #   The renderer draws into the render window
         #   The interactor enables mouse- and keyboard-based interaction
+        self.offscreen = offscreen
         self.renderer = vtk.vtkRenderer()
-        self.window = vtk.vtkRenderWindow()
+        self.window = self._create_window(backend)
+        self.window.SetOffScreenRendering(offscreen)
         self.window.AddRenderer(self.renderer)
-        self.interactor = vtk.vtkRenderWindowInteractor()
-        self.interactor.SetRenderWindow(self.window)
+        self.interactor = None
+        if not offscreen:
+            self.interactor = vtk.vtkRenderWindowInteractor()
+            self.interactor.SetRenderWindow(self.window)
+        if volume_mapper is None:
+            volume_mapper = 'auto' if offscreen else 'gpu'
+        if volume_mapper != 'auto' and volume_mapper not in VOLUME_MAPPERS:
+            raise ValueError('Unknown volume mapper: {0}'.format(volume_mapper))
+        self.volume_mapper = volume_mapper
 
         # Set a background color for the renderer and set the size of the window
         self.renderer.SetBackground(0.5, 0.5, 0.5)  # gray - RGB rescale of [0,255] to [0, 1]
-        self.window.SetSize(800, 800)
+        self.window.SetSize(*size)
+
+        self.instrumentation = instrumentation
+        self.image_writer = image_writer
 
+        # Every pipeline reads from the source, which holds the loaded vtkImageData
+        #   either decoded by the reader or memory-mapped by the cache
         self.reader = vtk.vtkXMLImageDataReader()
+        self._watch(self.reader)
+        self.source = vtk.vtkTrivialProducer()
+        self.cache = cache
+        self.stats = stats
+        self.stable_range = stable_range
+        self.voi = voi
+        self.stride = stride
+        self.isosurfaces = isosurfaces
+        self.transfer = get_preset(transfer)
+        self.volume_property = None
+        self.skip_empty = skip_empty
+        if isinstance(volume_quality, str):
+            if volume_quality not in VOLUME_QUALITY:
+                raise ValueError('Unknown volume quality: {0}'.format(volume_quality))
+            volume_quality = VOLUME_QUALITY[volume_quality]
+        self.volume_quality = volume_quality
+        self._blocks = None
+        self.sourcefile = None
+        self.attribute = None
+
+        # Persistent scene: actor name -> actor, built on first use (see _show_scene)
+        self.persistent = persistent
+        self.scene = None
+
+    def _stage(self, name):
+        """
+        :return: (context manager)
+            times the enclosed block when instrumented
+        """
+        if self.instrumentation is None:
+            return contextlib.nullcontext()
+        return self.instrumentation.stage(name)
+
+    def _watch(self, vtk_object):
+        """Time the executions of a filter or mapper when instrumented."""
+        if self.instrumentation is not None:
+            self.instrumentation.watch(vtk_object)
+
+    @staticmethod
+    def _create_window(backend):
+        """
+        :param backend: (str)
+            key of RENDER_BACKENDS, None for the platform default
+        :return: (vtkRenderWindow)
+        """
+        if backend is None:
+            return vtk.vtkRenderWindow()
+        if backend not in RENDER_BACKENDS:
+            raise ValueError('Unknown render backend: {0}'.format(backend))
+        window_class = getattr(vtk, RENDER_BACKENDS[backend], None)
+        if window_class is None:
+            raise RuntimeError('VTK was built without the {0} backend'.format(backend))
+        return window_class()
+
+    def _create_volume_mapper(self, volume_property):
+        """
+        :param volume_property: (vtkVolumeProperty)
+        :return: (vtkVolumeMapper)
+            mapper selected by self.volume_mapper, resolving 'auto' against the window's OpenGL
+            on first use; the resolved name replaces 'auto' for the following frames
+        """
+        if self.volume_mapper == 'auto':
+            self.window.Initialize()
+            capabilities = self.window.ReportCapabilities().lower()
+            software = any(renderer in capabilities for renderer in SOFTWARE_RENDERERS)
+            gpu = vtk.vtkGPUVolumeRayCastMapper()
+            supported = not software and gpu.IsRenderSupported(self.window, volume_property)
+            self.volume_mapper = 'gpu' if supported else 'cpu'
+            if supported:
+                return gpu
+        return getattr(vtk, VOLUME_MAPPERS[self.volume_mapper])()
 
     def _add_actor_outline(self):
         """Add outline for context of data."""
         # Actor - outline provides context around the data.
         data = vtk.vtkOutlineFilter()
-        data.SetInputConnection(self.reader.GetOutputPort())
+        data.SetInputConnection(self.source.GetOutputPort())
+        self._watch(data)
         data.Update()
         map_outline = vtk.vtkPolyDataMapper()
         map_outline.SetInputConnection(data.GetOutputPort())
@@ -61,6 +348,7 @@ class AsteroidVTK(object):
         outline.SetMapper(map_outline)
         outline.GetProperty().SetColor(colors.GetColor3d("Black"))
         self.renderer.AddActor(outline)
+        return outline
 
     def _add_actor_slice(self, min_value, max_value):
         """
@@ -71,26 +359,20 @@ class AsteroidVTK(object):
         :param max_value: (int)
             maximum value in data array
         """
-        # Define color map
-        # Now create a lookup table that consists of the full hue circle (from HSV)
-        hue_lookup = vtk.vtkLookupTable()
-        hue_lookup.SetTableRange(min_value, max_value)
-        hue_lookup.SetHueRange(.6, .6)
-        hue_lookup.SetSaturationRange(0, 1)
-        hue_lookup.SetValueRange(1, 1)
-        hue_lookup.Build()
+        hue_lookup = self._build_slice_lookup(min_value, max_value)
         xy_colors = vtk.vtkImageMapToColors()
-        xy_colors.SetInputConnection(self.reader.GetOutputPort())
+        self._watch(xy_colors)
+        xy_colors.SetInputConnection(self.source.GetOutputPort())
         xy_colors.SetLookupTable(hue_lookup)
-        xy_colors.Update()
+        # No Update() here: the image actor requests only its display extent,
+        #   so just the displayed plane is colored instead of the whole volume
         xy_slice = vtk.vtkImageActor()
         xy_slice.GetMapper().SetInputConnection(xy_colors.GetOutputPort())
         # Params (minX, maxX, minY, maxY, minZ, maxZ)
-        xy_slice.SetDisplayExtent(0, 300, 0, 300, 150, 150)
+        xy_slice.SetDisplayExtent(self._slice_extent())
 
         transfer_color = vtk.vtkColorTransferFunction()
-        transfer_color.AddRGBPoint(min_value, 1.0, 1.0, 1.0)
-        transfer_color.AddRGBPoint(max_value, 0.0, 0.0, 1.0)
+        self._fill_scalar_bar_colors(transfer_color, min_value, max_value)
         scalar_bar = vtk.vtkScalarBarActor()
         scalar_bar.SetLookupTable(transfer_color)
         scalar_bar.SetTitle("Temporary Title")
@@ -105,16 +387,42 @@ class AsteroidVTK(object):
         # self.renderer.AddActor(scalar_bar)
         return xy_slice, scalar_bar
     
+    @staticmethod
+    def _build_slice_lookup(min_value, max_value):
+        """
+        :return: (vtkLookupTable)
+            single hue (blue) with saturation increasing over [min_value, max_value]
+        """
+        # Define color map
+        # Now create a lookup table that consists of the full hue circle (from HSV)
+        hue_lookup = vtk.vtkLookupTable()
+        hue_lookup.SetTableRange(min_value, max_value)
+        hue_lookup.SetHueRange(.6, .6)
+        hue_lookup.SetSaturationRange(0, 1)
+        hue_lookup.SetValueRange(1, 1)
+        hue_lookup.Build()
+        return hue_lookup
+
+    def _slice_extent(self):
+        """
+        :return: (tuple)
+            display extent of the XY slice, the middle z plane of the loaded data
+            (z=150 for the full 300^3 grid)
+        """
+        x0, x1, y0, y1, z0, z1 = self.source.GetOutputDataObject(0).GetExtent()
+        z = (z0 + z1 + 1) // 2
+        return x0, x1, y0, y1, z, z
+
     def _add_actor_isosurface(self, min_value, max_value):
         """
         Add an iso-surface based on volume thresholds
+
+        :return: (vtkActor, vtkActor, vtkScalarBarActor)
+            low threshold, high threshold and title actors
         """
         # 1. Create the low threshold
-        low = vtk.vtkContourFilter()
-        low.SetInputConnection(self.reader.GetOutputPort())
-        low.SetValue(0, 0.1)
         low_mapper = vtk.vtkPolyDataMapper()
-        low_mapper.SetInputConnection(low.GetOutputPort())
+        self._connect_isosurface(low_mapper, ISO_LOW)
         low_mapper.ScalarVisibilityOff()
         low_actor = vtk.vtkActor()
         low_actor.SetMapper(low_mapper)
@@ -124,11 +432,8 @@ class AsteroidVTK(object):
         low_actor.GetProperty().SetOpacity(0.2)
 
         # 2. Create the high threshold
-        high = vtk.vtkContourFilter()
-        high.SetInputConnection(self.reader.GetOutputPort())
-        high.SetValue(0, 0.8)
         high_mapper = vtk.vtkPolyDataMapper()
-        high_mapper.SetInputConnection(high.GetOutputPort())
+        self._connect_isosurface(high_mapper, ISO_HIGH)
         high_mapper.ScalarVisibilityOff()
         high_actor = vtk.vtkActor()
         high_actor.SetMapper(high_mapper)
@@ -139,8 +444,7 @@ class AsteroidVTK(object):
 
         # Define transfer function range
         transfer_color = vtk.vtkColorTransferFunction()
-        transfer_color.AddRGBPoint(min_value, 1.0, 1.0, 1.0)
-        transfer_color.AddRGBPoint(max_value, 0.0, 0.0, 1.0)
+        self._fill_scalar_bar_colors(transfer_color, min_value, max_value)
 
         title = vtk.vtkScalarBarActor()
         title.SetTitle("Scalar value (" + 'Test' + ")")
@@ -157,48 +461,166 @@ class AsteroidVTK(object):
         self.renderer.AddActor(low_actor)
         self.renderer.AddActor(high_actor)
         self.renderer.AddActor(title)
-        return low_actor, high_actor
+        return low_actor, high_actor, title
+
+    def _use_isosurface_cache(self):
+        # Synthesized timesteps (e.g. interpolated frames) have no file to key the cache on
+        return (self.isosurfaces is not None and self.voi is None and self.stride == 1
+                and os.path.exists(self.sourcefile))
+
+    def _connect_isosurface(self, mapper, value):
+        """
+        Feed a mapper with the isosurface of the loaded data,
+        from the isosurface cache or from a contour filter on the source.
+
+        :param mapper: (vtkPolyDataMapper)
+        :param value: (float)
+            iso value
+        """
+        if self._use_isosurface_cache():
+            image = self.source.GetOutputDataObject(0)
+            mapper.SetInputData(self.isosurfaces.load(self.sourcefile, self.attribute, value, image))
+            return
+        contour = create_contour_filter()
+        self._watch(contour)
+        contour.SetInputConnection(self.source.GetOutputPort())
+        contour.SetValue(0, value)
+        mapper.SetInputConnection(contour.GetOutputPort())
 
     def _add_actor_volume_render(self, min_value, max_value):
         """
         Add a volume render.
         """
-        data_range = max_value - min_value
-        transfer_opacity = vtk.vtkPiecewiseFunction()
-        transfer_opacity.AddPoint(min_value, 0.0)
-        transfer_opacity.AddPoint(min_value + data_range / 2, 0.0000)
-        transfer_opacity.AddPoint(max_value, 0.01)
-
-        # Create transfer mapping scalar value to color
-        transfer_color = vtk.vtkColorTransferFunction()
-        transfer_color.AddRGBPoint(min_value, 0, 0, 0.2)
-        transfer_color.AddRGBPoint(min_value + (data_range / 4) * 1, 0, 1.0, 0)
-        transfer_color.AddRGBPoint(min_value + (data_range / 4) * 2, 0, 0.5, 0)
-        transfer_color.AddRGBPoint(min_value + (data_range / 4) * 3, 1.0, 0, 0.0)
-        transfer_color.AddRGBPoint(min_value + (data_range / 4) * 4, 0.2, 0, 0.0)
-
-        # The property describes how the data will look
-        volume_property = vtk.vtkVolumeProperty()
-        volume_property.SetColor(transfer_color)
-        volume_property.SetScalarOpacity(transfer_opacity)
-        volume_property.ShadeOn()  # on/off shader
-        volume_property.SetInterpolationTypeToLinear()
+        # The property describes how the data will look: transfer functions mapping
+        #   scalar value to opacity and color, shared by every volume of this renderer
+        if self.volume_property is None:
+            self.volume_property = self.transfer.create_property(min_value, max_value)
+        volume_property = self.volume_property
 
         # The mapper / ray cast function know how to render the data
-        volume_mapper = vtk.vtkGPUVolumeRayCastMapper()
+        volume_mapper = self._create_volume_mapper(volume_property)
+        self._watch(volume_mapper)
         volume_mapper.SetBlendModeToComposite()
-        volume_mapper.SetInputConnection(self.reader.GetOutputPort())
+        volume_mapper.SetInputConnection(self.source.GetOutputPort())
 
         volume = vtk.vtkVolume()
         volume.SetMapper(volume_mapper)
         volume.SetProperty(volume_property)
+        self._update_volume(volume, min_value, max_value)
         self.renderer.AddVolume(volume)
         return volume
 
-    def _initialize_camera(self, zpos, elevation):
+    def _update_volume(self, volume, min_value, max_value):
+        """
+        Per frame volume settings: transfer functions, empty-space cropping and sampling.
+
+        :param volume: (vtkVolume)
+        """
+        self.transfer.apply(volume.GetProperty(), min_value, max_value)
+        mapper = volume.GetMapper()
+        if self.skip_empty:
+            bounds = self._occupied_bounds(min_value, max_value)
+            if bounds is None:
+                volume.VisibilityOff()
+                return
+            # Rays only traverse the cropped region, the volume keeps its bounds and camera
+            mapper.CroppingOn()
+            mapper.SetCroppingRegionFlagsToSubVolume()
+            mapper.SetCroppingRegionPlanes(*bounds)
+        if self.volume_quality is not None:
+            sample_distance, image_sample_distance = self.volume_quality
+            spacing = min(self.source.GetOutputDataObject(0).GetSpacing())
+            mapper.SetAutoAdjustSampleDistances(False)
+            mapper.SetSampleDistance(sample_distance * spacing)
+            if hasattr(mapper, 'SetImageSampleDistance'):  # not on the smart mapper
+                mapper.SetImageSampleDistance(image_sample_distance)
+
+    def _occupied_bounds(self, min_value, max_value):
+        """
+        :return: (tuple)
+            world bounds (xmin, xmax, ymin, ymax, zmin, zmax) of the blocks holding values
+            the transfer function makes visible, None if there are none
+        """
+        visible = self.transfer.visible_range(min_value, max_value)
+        if visible is None:
+            return None
+        image = self.source.GetOutputDataObject(0)
+        shape = tuple(reversed(image.GetDimensions()))
+        if self._blocks is None:
+            # Once per loaded timestep, the transfer range may still change per frame
+            with self._stage('occupancy'):
+                if self._use_isosurface_cache():
+                    # The widened ranges the isosurfaces are extracted with, only a block wider
+                    self._blocks = self.isosurfaces.block_ranges(self.sourcefile, self.attribute, image)
+                else:
+                    data = VN.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(shape)
+                    self._blocks = block_ranges(data, widen=False)
+        extent = occupied_extent(self._blocks[0], self._blocks[1], visible[0], visible[1], shape)
+        if extent is None:
+            return None
+        origin, spacing = image.GetOrigin(), image.GetSpacing()
+        return tuple(origin[i // 2] + extent[i] * spacing[i // 2] for i in range(6))
+
+    @staticmethod
+    def _fill_scalar_bar_colors(transfer_color, min_value, max_value):
+        """White to blue color bar over [min_value, max_value]."""
+        transfer_color.RemoveAllPoints()
+        transfer_color.AddRGBPoint(min_value, 1.0, 1.0, 1.0)
+        transfer_color.AddRGBPoint(max_value, 0.0, 0.0, 1.0)
+
+    def _build_scene(self):
+        """
+        Build every pipeline once, connected to the source, with all actors hidden.
+
+        :return: (dict)
+            actor name -> actor
+        """
+        scene = dict()
+        scene['outline'] = self._add_actor_outline()
+        scene['slice'], scene['slice_bar'] = self._add_actor_slice(0.0, 1.0)
+        scene['iso_low'], scene['iso_high'], scene['iso_title'] = self._add_actor_isosurface(0.0, 1.0)
+        scene['volume'] = self._add_actor_volume_render(0.0, 1.0)
+        for actor in scene.values():
+            actor.VisibilityOff()
+        return scene
+
+    def _show_scene(self, mode, min_value, max_value):
+        """
+        Persistent mode: update the ranges of the existing pipelines and
+        show only the actors used by the render mode.
+
+        :param mode: (str)
+            key of SCENE_ACTORS
+        :param min_value: (float)
+            minimum value in data array
+        :param max_value: (float)
+            maximum value in data array
+        """
+        if self.scene is None:
+            self.scene = self._build_scene()
+        elif self._use_isosurface_cache() and mode in ('iso', 'sliced'):
+            # Cached meshes are data, not a pipeline: swap in this timestep's meshes
+            self._connect_isosurface(self.scene['iso_low'].GetMapper(), ISO_LOW)
+            self._connect_isosurface(self.scene['iso_high'].GetMapper(), ISO_HIGH)
+
+        self.scene['slice'].SetDisplayExtent(self._slice_extent())
+        xy_colors = self.scene['slice'].GetMapper().GetInputAlgorithm()
+        xy_colors.GetLookupTable().SetTableRange(min_value, max_value)
+        self._fill_scalar_bar_colors(self.scene['slice_bar'].GetLookupTable(), min_value, max_value)
+
+        visible = SCENE_ACTORS[mode]
+        for name, actor in self.scene.items():
+            actor.SetVisibility(name in visible)
+        if mode == 'volume':
+            self._update_volume(self.scene['volume'], min_value, max_value)
+
+    def _initialize_camera(self, zpos, elevation, azimuth=0.0):
         """
         Initialize the camera and view, as well as interaction.
 
+        :param azimuth: (float)
+            rotation about the view up vector in degrees, see orbit()
+
         :return camera: (vtkOpenGLCamera)
 
         @use
@@ -219,7 +641,7 @@ class AsteroidVTK(object):
         camera.SetPosition(0.5, 0.5, zpos)
         camera.SetFocalPoint(0, 0, 0)
         camera.ComputeViewPlaneNormal()
-        camera.Azimuth(0)
+        camera.Azimuth(azimuth)
         camera.Elevation(elevation)
 
         # An initial camera view is created.  The Dolly() method moves
@@ -228,7 +650,9 @@ class AsteroidVTK(object):
 
         # Calling Render() directly on a vtkRenderer is strictly forbidden.
         # Only calling Render() on the vtkRenderWindow is a valid call.
-        self.window.Render()
+        #   Headless skips this render: ResetCamera() updates the mappers for their bounds
+        if not self.offscreen:
+            self.window.Render()
         self.renderer.ResetCamera()
         camera.Dolly(1.5)
 
@@ -245,112 +669,348 @@ class AsteroidVTK(object):
         return camera
 
     def _initialize_interactor(self):
+        if self.interactor is None:
+            raise RuntimeError('Headless AsteroidVTK has no interactor')
         self.interactor.Initialize()
         self.window.Render()
         self.interactor.Start()
 
     def _load_data(self, sourcefile, attribute):
+        if self.instrumentation is not None:
+            self.instrumentation.context.update(frame=timestep_tag(sourcefile), mode=None)
+
         # Read Data
-        self.reader.SetFileName(sourcefile)
-        self.reader.Update()
+        with self._stage('load'):
+            preview = self.voi is not None or self.stride > 1
+            if preview and hasattr(self.cache, 'load_region'):
+                # Chunked stores read only the chunks of the preview
+                image = self.cache.load_region(sourcefile, attribute, self.voi, self.stride)
+            elif self.cache is not None:
+                image = self.cache.load(sourcefile, attribute)
+            else:
+                # Only the rendered array is decoded, and for a preview only the rows of its VOI
+                self.reader.SetFileName(sourcefile)
+                select_point_array(self.reader, attribute)
+                if self.voi is not None:
+                    self.reader.UpdateExtent(self.voi)
+                else:
+                    self.reader.UpdateWholeExtent()
+                image = self.reader.GetOutput()
+            if preview and not hasattr(self.cache, 'load_region'):
+                image = self._extract_preview(image, attribute)
+        return self._set_image(image, sourcefile, attribute)
+
+    def _set_image(self, image, sourcefile, attribute):
+        """
+        Hand a loaded timestep to every pipeline.
+
+        :param image: (vtkImageData)
+        :return: (np.ndarray)
+            the attribute's data array
+        """
+        self.source.SetOutput(image)
+        self._blocks = None
+        self.sourcefile = sourcefile
+        self.attribute = attribute
 
         # Pull the data array we want to use (convert to numpy array)
-        self.reader.GetOutput().GetPointData().SetActiveAttribute(attribute, 0)
-        data = VN.vtk_to_numpy(self.reader.GetOutput().GetPointData().GetScalars(attribute))
+        image.GetPointData().SetActiveAttribute(attribute, 0)
+        data = VN.vtk_to_numpy(image.GetPointData().GetScalars(attribute))
         return data
 
+    def _extract_preview(self, image, attribute):
+        """
+        Cut the volume of interest and/or downsample by the stride.
+            With the cache the array is memory-mapped, so only the touched planes are read.
+
+        :param image: (vtkImageData)
+            full resolution timestep, or the part of it the reader read for the VOI
+        :return: (vtkImageData)
+            preview image keeping the world coordinates of the full grid
+        """
+        extent = image.GetExtent()
+        data = VN.vtk_to_numpy(image.GetPointData().GetArray(attribute))
+        data = data.reshape(tuple(reversed(image.GetDimensions())) + data.shape[1:])
+        x0, x1, y0, y1, z0, z1 = self.voi or extent
+        # Indices into the array are relative to the first point of its extent
+        ex, ey, ez = extent[0], extent[2], extent[4]
+        step = self.stride
+        preview = np.ascontiguousarray(data[z0 - ez:z1 - ez + 1:step, y0 - ey:y1 - ey + 1:step, x0 - ex:x1 - ex + 1:step])
+
+        spacing = image.GetSpacing()
+        origin = [o + i * d for o, i, d in zip(image.GetOrigin(), (x0, y0, z0), spacing)]
+        return wrap_image(preview, attribute, origin, [d * step for d in spacing])
+
+    def _data_range(self, sourcefile, attribute, data):
+        """
+        :return: (float, float)
+            min and max used for lookup tables and transfer functions
+        """
+        if self.stats is not None:
+            if self.stable_range:
+                return self.stats.global_range(attribute)
+            entry = self.stats.get(sourcefile, attribute)
+            if entry is not None:
+                return entry['min'], entry['max']
+        with self._stage('range'):
+            return np.amin(data), np.amax(data)
+
     def _reset(self, camera, actors=()):
         for actor in actors:
-            self.renderer.RemoveActor(actor)
+            self.renderer.RemoveViewProp(actor)
+        if self.offscreen:
+            return camera
         self.window.Render()
         self.renderer.ResetCamera()
         camera.Dolly(1.5)
         return camera
 
-    def _save_image(self, outfile):
+    def _capture_image(self):
+        """
+        :return: (vtkImageData)
+            copy of the window's framebuffer
+        """
         image = vtk.vtkWindowToImageFilter()
         image.SetInput(self.window)
+        if self.offscreen:
+            # The frame was just rendered by _initialize_camera, read it back as is
+            image.ShouldRerenderOff()
+        image.Update()
+        return image.GetOutput()
+
+    def _save_image(self, outfile):
+        image = self._capture_image()
+        if self.image_writer is not None:
+            # Copy the framebuffer out of VTK, the writer thread owns the copy
+            width, height, _ = image.GetDimensions()
+            pixels = VN.vtk_to_numpy(image.GetPointData().GetScalars())
+            self.image_writer.submit(pixels.reshape(height, width, -1).copy(), outfile)
+            return
         writer = vtk.vtkPNGWriter()
-        writer.SetInputConnection(image.GetOutputPort())
+        writer.SetInputData(image)
         writer.SetFileName(outfile)
         writer.Write()
 
+    def flush(self):
+        """Wait until every frame handed to the image writer is written."""
+        if self.image_writer is not None:
+            self.image_writer.flush()
+
+    def _add_actors(self, mode, min_value, max_value):
+        """
+        Add the actors used by a render mode.
+
+        :param mode: (str)
+            key of RENDER_MODES
+        :return: (list)
+            actors to remove once the frame is saved
+        """
+        if self.persistent:
+            with self._stage('scene'):
+                self._show_scene(mode, min_value, max_value)
+            return []
+        with self._stage('outline'):
+            actors = [self._add_actor_outline()]
+        if mode == 'sliced':
+            with self._stage('slice'):
+                actors.extend(self._add_actor_slice(min_value, max_value))
+        if mode in ('iso', 'sliced'):
+            with self._stage('isosurface'):
+                actors.extend(self._add_actor_isosurface(min_value, max_value))
+        if mode == 'volume':
+            with self._stage('volume'):
+                actors.append(self._add_actor_volume_render(min_value, max_value))
+        return actors
+
+    def _render_views(self, mode, min_value, max_value, views):
+        """
+        Build the scene of a render mode once and save an image per view:
+        between views only the camera moves.
+
+        :param mode: (str)
+            key of RENDER_MODES
+        :param views: (list of tuple)
+            (outfile, zpos, elevation[, azimuth]) per image, see output_views
+        """
+        if not views:
+            return
+        if self.instrumentation is not None:
+            self.instrumentation.context['mode'] = mode
+        actors = self._add_actors(mode, min_value, max_value)
+        for outfile, *viewpoint in views:
+            with self._stage('render'):
+                camera = self._initialize_camera(*viewpoint)
+            with self._stage('save'):
+                self._save_image(outfile)
+        self._reset(camera, actors)
+
     def render_iso(self, sourcefile, outfile, attribute, zpos=0, elevation=-30.0):
         data = self._load_data(sourcefile, attribute)
-        min_value = np.amin(data)
-        max_value = np.amax(data)
-        self._add_actor_outline()
-        iso_low, iso_high = self._add_actor_isosurface(min_value, max_value)
-        camera = self._initialize_camera(zpos=zpos, elevation=elevation)
-        self._save_image(outfile)
-        self._reset(camera, [iso_low, iso_high])
+        min_value, max_value = self._data_range(sourcefile, attribute, data)
+        self._render_views('iso', min_value, max_value, [(outfile, zpos, elevation)])
 
     def render_sliced_iso(self, sourcefile, outfile, attribute, zpos=1, elevation=0.0):
         data = self._load_data(sourcefile, attribute)
-        min_value = np.amin(data)
-        max_value = np.amax(data)
-        self._add_actor_outline()
-        xy_slice, scalar_bar = self._add_actor_slice(min_value, max_value)
-        iso_low, iso_high = self._add_actor_isosurface(min_value, max_value)
-        camera = self._initialize_camera(zpos=zpos, elevation=elevation)
-        self._save_image(outfile)
-        self._reset(camera, [xy_slice, scalar_bar, iso_low, iso_high])
+        min_value, max_value = self._data_range(sourcefile, attribute, data)
+        self._render_views('sliced', min_value, max_value, [(outfile, zpos, elevation)])
 
     def render_volume(self, sourcefile, outfile, attribute, zpos=0, elevation=-30.0):
         data = self._load_data(sourcefile, attribute)
-        min_value = np.amin(data)
-        max_value = np.amax(data)
-        self._add_actor_outline()
-        volume = self._add_actor_volume_render(min_value, max_value)
-        camera = self._initialize_camera(zpos=zpos, elevation=elevation)
+        min_value, max_value = self._data_range(sourcefile, attribute, data)
         # self._initialize_interactor()
-        self._save_image(outfile)
-        self._reset(camera, [volume])
+        self._render_views('volume', min_value, max_value, [(outfile, zpos, elevation)])
+
+    def _load_volume(self, sourcefile, attribute):
+        """
+        :return: (np.ndarray, np.ndarray, float, float)
+            (z, y, x) volume, slice lookup table colors and the range they span
+        """
+        data = self._load_data(sourcefile, attribute)
+        min_value, max_value = self._data_range(sourcefile, attribute, data)
+        x0, x1, y0, y1, z0, z1 = self.source.GetOutputDataObject(0).GetExtent()
+        data = data.reshape((z1 - z0 + 1, y1 - y0 + 1, x1 - x0 + 1))
+        table = VN.vtk_to_numpy(self._build_slice_lookup(min_value, max_value).GetTable())
+        return data, table, min_value, max_value
+
+    def _write_pixels(self, pixels, outfile):
+        """Write a (rows, columns, 3) image, through the image writer if there is one."""
+        with self._stage('save'):
+            if self.image_writer is not None:
+                self.image_writer.submit(pixels, outfile)
+            else:
+                write_png(pixels, outfile)
+
+    def render_slice_preview(self, sourcefile, outfile, attribute, index=None, plane='xy'):
+        """
+        Fast path for a slice: color one plane straight from the numpy array
+        with the slice lookup table, without running the 3D pipeline.
+
+        :param sourcefile: (str)
+            .vti timestep
+        :param outfile: (str)
+            PNG image, one pixel per grid point
+        :param attribute: (str)
+            data array to render
+        :param index: (int)
+            plane index of the loaded data along the plane's normal, defaults to the middle plane
+        :param plane: (str)
+            key of PLANES: 'xy', 'xz' or 'yz'
+        """
+        data, table, min_value, max_value = self._load_volume(sourcefile, attribute)
+        self._write_pixels(color_plane(cut_plane(data, plane, index), table, min_value, max_value), outfile)
+
+    def render_slice_grid(self, sourcefile, outfile, attribute, planes=(('xy', None), ('xz', None), ('yz', None)),
+                          columns=None):
+        """
+        Several colored planes of one timestep tiled into one image.
+
+        :param planes: (list of (str, int))
+            (plane, index) per tile, index None for the middle plane
+        :param columns: (int)
+            tiles per row, defaults to all in one row
+        """
+        data, table, min_value, max_value = self._load_volume(sourcefile, attribute)
+        images = [color_plane(cut_plane(data, plane, index), table, min_value, max_value) for plane, index in planes]
+        self._write_pixels(slice_grid(images, columns), outfile)
+
+    def render_slice_sweep(self, sourcefile, outfolder, attribute, plane='xy', step=1):
+        """
+        Every step-th plane of a timestep, for slice-sweep movies.
+
+        Images are written to <outfolder>/sweep_<plane>/sweep_<tag>-<index>.png;
+        with a VideoWriter as image writer the sweeps of every timestep go into
+        one <outfolder>/sweep_<plane>/sweep.avi.
+
+        :param plane: (str)
+            key of PLANES
+        :param step: (int)
+            planes between frames
+        :return: (list of str)
+            written images
+        """
+        data, table, min_value, max_value = self._load_volume(sourcefile, attribute)
+        sweep_folder = os.path.join(outfolder, 'sweep_' + plane)
+        os.makedirs(sweep_folder, exist_ok=True)
+        tag = timestep_tag(sourcefile)
+        outfiles = []
+        for index in range(0, data.shape[PLANES[plane]], step):
+            outfile = os.path.join(sweep_folder, 'sweep_{0}-{1:04d}.png'.format(tag, index))
+            self._write_pixels(color_plane(cut_plane(data, plane, index), table, min_value, max_value), outfile)
+            outfiles.append(outfile)
+        return outfiles
+
+    def render_all(self, sourcefile, outfolder, attribute, modes=tuple(RENDER_MODES), cameras=None):
+        """
+        Read and decode a timestep once and render every requested mode from it.
+
+        Images are written to <outfolder>/<mode>/output_<tag>.png, or
+        output_<tag>_<camera>.png when camera presets or viewpoints are given.
+        The scene of each mode is built once for all of its cameras, e.g. a
+        turntable: render_all(sourcefile, outfolder, attribute, cameras=orbit(36))
+
+        :param sourcefile: (str)
+            .vti timestep
+        :param outfolder: (str)
+            root output folder, one sub-folder per mode
+        :param attribute: (str)
+            data array to render
+        :param modes: (tuple)
+            keys of RENDER_MODES
+        :param cameras: (tuple)
+            keys of CAMERA_PRESETS or (name, zpos, elevation[, azimuth]) viewpoints
+            applied to every mode, defaults to the mode's own camera (MODE_CAMERAS)
+        :return: (list of str)
+            written images
+        """
+        data = self._load_data(sourcefile, attribute)
+        min_value, max_value = self._data_range(sourcefile, attribute, data)
+
+        outfiles = []
+        for mode in modes:
+            os.makedirs(os.path.join(outfolder, mode), exist_ok=True)
+            views = output_views(sourcefile, outfolder, mode, cameras)
+            self._render_views(mode, min_value, max_value, views)
+            outfiles.extend(view[0] for view in views)
+        return outfiles
 
 
 # from src.airburst import run; run()
-def run(sample=True, iso=False, sliced=False, volume=False):
+def run(sample=True, iso=False, sliced=False, volume=False, timing=False, write_behind=False,
+        video=None, fps=10, size=(800, 800)):
     attribute = 'v03'
-    ast = AsteroidVTK()
     root_folder = 'D:/Downloads/Asteroid Ensemble - Airburst/'
+    instrumentation = Instrumentation() if timing else None
+    image_writer = AsyncImageWriter() if write_behind else None
+    if video:
+        # One video per mode (output/<mode>/output.avi) instead of a PNG per frame
+        image_writer = VideoWriter(fps=fps, codec=video)
+    # Timestep N+1 is decoded in the background while N renders
+    prefetcher = Prefetcher([os.path.join(root_folder, image) for image in AIRBURST], attribute)
+    ast = AsteroidVTK(cache=prefetcher, instrumentation=instrumentation, image_writer=image_writer, size=size)
 
     if sample:
         image = AIRBURST[8]
-        tag = image.split('.')[0].split('_')[-1]  # timestamp + step
+        tag = timestep_tag(image)
         sourcefile = os.path.join(root_folder, image)
         outfilename = 'sample_{0}.png'.format(tag)
         outfile = os.path.join('{0}output/'.format(root_folder), outfilename)
         ast.render_volume(sourcefile, outfile, attribute)
 
-    # ISO_RENDER
-    if iso:
-        total_images = len(AIRBURST)
-        for i, image in enumerate(AIRBURST):
-            print('Processing iso: {0} of {1}'.format(i, total_images))
-            tag = image.split('.')[0].split('_')[-1]  # timestamp + step
-            sourcefile = os.path.join(root_folder, image)
-            outfilename = 'output_{0}.png'.format(tag)
-            outfile = os.path.join('{0}output/iso/'.format(root_folder), outfilename)
-            ast.render_iso(sourcefile, outfile, attribute)
-
-    # SLICED ISO RENDER
-    if sliced:
-        total_images = len(AIRBURST)
-        for i, image in enumerate(AIRBURST):
-            print('Processing sliced iso: {0} of {1}'.format(i, total_images))
-            tag = image.split('.')[0].split('_')[-1]  # timestamp + step
-            sourcefile = os.path.join(root_folder, image)
-            outfilename = 'output_{0}.png'.format(tag)
-            outfile = os.path.join('{0}output/sliced/'.format(root_folder), outfilename)
-            ast.render_sliced_iso(sourcefile, outfile, attribute)
-
-    # VOLUME
-    if volume:
+    # ISO_RENDER, SLICED ISO RENDER, VOLUME
+    #   Each timestep is read once and rendered in every requested mode
+    modes = [mode for mode, wanted in (('iso', iso), ('sliced', sliced), ('volume', volume)) if wanted]
+    if modes:
         total_images = len(AIRBURST)
-        for i, image in enumerate(AIRBURST):
-            print('Processing volume render: {0} of {1}'.format(i, total_images))
-            tag = image.split('.')[0].split('_')[-1]  # timestamp + step
-            sourcefile = os.path.join(root_folder, image)
-            outfilename = 'output_{0}.png'.format(tag)
-            outfile = os.path.join('{0}output/volume/'.format(root_folder), outfilename)
-            ast.render_volume(sourcefile, outfile, attribute)
+        for i, sourcefile in enumerate(prefetcher):
+            print('Processing {0}: {1} of {2}'.format(' + '.join(modes), i, total_images))
+            ast.render_all(sourcefile, '{0}output/'.format(root_folder), attribute, modes)
+
+    # Every frame (or video) is on disk before run() returns
+    if image_writer is not None:
+        image_writer.close()
+
+    # TIMING REPORT
+    if timing:
+        instrumentation.write_report('{0}output/timing.csv'.format(root_folder))
+        instrumentation.write_report('{0}output/timing.json'.format(root_folder))
+        instrumentation.print_summary()
@@ -0,0 +1,219 @@
+import csv
+import multiprocessing
+import os
+
+import numpy as np
+import vtk.util.numpy_support as VN
+
+from src.airburst import AIRBURST, ISO_HIGH, ISO_LOW, timestep_time
+from src.cache import VolumeCache, read_vti
+from src.stats import JsonIndex
+
+# Attributes whose maximum is tracked over time
+MAX_ATTRIBUTES = ('prs', 'tev')
+
+# z planes reduced at once, bounds the temporaries to a slab of the volume
+CHUNK_PLANES = 16
+
+# CSV columns in order, the metrics of compute_metrics
+COLUMNS = (
+    'timestep', 'time', 'volume_low', 'volume_high',
+    'high_centroid_x', 'high_centroid_y', 'high_centroid_z',
+    'high_min_x', 'high_max_x', 'high_min_y', 'high_max_y', 'high_min_z', 'high_max_z',
+) + tuple('{0}_max'.format(attribute) for attribute in MAX_ATTRIBUTES)
+
+
+def compute_metrics(arrays, origin, spacing, attribute='v03', low=ISO_LOW, high=ISO_HIGH,
+                    chunk_planes=CHUNK_PLANES):
+    """
+    Feature metrics of one timestep in a single chunked pass.
+
+    Volumes count the grid points at or above a threshold times the volume of a
+    grid cell. The high region is the set of points at or above the high
+    threshold: its centroid and extent are in world coordinates, None if empty.
+
+    :param arrays: (dict)
+        attribute -> (z, y, x) array, e.g. memory-mapped from the VolumeCache
+    :param origin: (tuple)
+        world position of point (0, 0, 0)
+    :param spacing: (tuple)
+        distance between points along x, y, z
+    :param attribute: (str)
+        thresholded data array
+    :param low: (float)
+        low threshold, as the low isosurface
+    :param high: (float)
+        high threshold, as the high isosurface
+    :param chunk_planes: (int)
+        z planes reduced per step
+    :return: (dict)
+        volume_low, volume_high, high_centroid_*, high_min_*/high_max_* and <name>_max of MAX_ATTRIBUTES
+    """
+    data = arrays[attribute]
+    depth, height, width = data.shape[:3]
+    counts_low = 0
+    # Points of the high region per z plane, y row and x column: the centroid and
+    # extent follow from these projections without keeping a full-size mask
+    counts = [np.zeros(depth, np.int64), np.zeros(height, np.int64), np.zeros(width, np.int64)]
+    maxima = dict.fromkeys(MAX_ATTRIBUTES, -np.inf)
+    for z0 in range(0, depth, chunk_planes):
+        slab = np.asarray(data[z0:z0 + chunk_planes])
+        counts_low += int(np.count_nonzero(slab >= low))
+        mask = slab >= high
+        counts[0][z0:z0 + len(slab)] = mask.sum(axis=(1, 2))
+        counts[1] += mask.sum(axis=(0, 2))
+        counts[2] += mask.sum(axis=(0, 1))
+        for name in MAX_ATTRIBUTES:
+            if name in arrays:
+                maxima[name] = max(maxima[name], float(np.max(arrays[name][z0:z0 + chunk_planes])))
+
+    cell = float(np.prod(spacing))
+    counts_high = int(counts[0].sum())
+    metrics = {'volume_low': counts_low * cell, 'volume_high': counts_high * cell}
+    # counts are ordered z, y, x; origin and spacing x, y, z
+    for axis, axis_counts in zip('zyx', counts):
+        i = 'xyz'.index(axis)
+        coordinates = origin[i] + np.arange(len(axis_counts)) * spacing[i]
+        inside = np.flatnonzero(axis_counts)
+        if counts_high:
+            metrics['high_centroid_' + axis] = float(axis_counts @ coordinates) / counts_high
+            metrics['high_min_' + axis] = float(coordinates[inside[0]])
+            metrics['high_max_' + axis] = float(coordinates[inside[-1]])
+        else:
+            metrics['high_centroid_' + axis] = metrics['high_min_' + axis] = metrics['high_max_' + axis] = None
+    for name, value in maxima.items():
+        metrics[name + '_max'] = value if np.isfinite(value) else None
+    return metrics
+
+
+def _read_volume(sourcefile, attributes, cache=None):
+    """
+    :return: (dict, tuple, tuple)
+        attribute -> (z, y, x) array, origin and spacing, from a single decode
+    """
+    if cache is not None:
+        header = cache.header(sourcefile)
+        arrays = {attribute: cache.load_array(sourcefile, attribute) for attribute in attributes}
+        return arrays, header['origin'], header['spacing']
+    image = read_vti(sourcefile)
+    shape = tuple(reversed(image.GetDimensions()))
+    arrays = {attribute: VN.vtk_to_numpy(image.GetPointData().GetArray(attribute)).reshape(shape)
+              for attribute in attributes}
+    return arrays, image.GetOrigin(), image.GetSpacing()
+
+
+def analyze_timestep(sourcefile, attribute='v03', low=ISO_LOW, high=ISO_HIGH, cache=None):
+    """
+    :param sourcefile: (str)
+        .vti timestep
+    :param cache: (VolumeCache or ChunkedStore)
+        read the arrays from the cache instead of the .vti
+    :return: (dict)
+        metrics of compute_metrics plus timestep and time
+    """
+    arrays, origin, spacing = _read_volume(sourcefile, (attribute,) + MAX_ATTRIBUTES, cache)
+    metrics = compute_metrics(arrays, origin, spacing, attribute, low, high)
+    metrics.update(timestep=os.path.basename(sourcefile), time=timestep_time(sourcefile))
+    return metrics
+
+
+# Each worker process reads through its own VolumeCache (created by _init_worker).
+_worker_cache = None
+
+
+def _init_worker(cache_folder):
+    global _worker_cache
+    _worker_cache = VolumeCache(cache_folder) if cache_folder else None
+
+
+def _analyze(arguments):
+    sourcefile, attribute, low, high = arguments
+    return sourcefile, analyze_timestep(sourcefile, attribute, low, high, _worker_cache)
+
+
+class AnalyticsIndex(JsonIndex):
+    """
+    Per timestep metrics, stored as JSON alongside the data like the StatsIndex.
+
+        {timestep: {'source_size': int, 'source_mtime': float, 'parameters': {...}, 'metrics': {...}}}
+
+    Entries whose source file changed, or that were computed with other
+    thresholds, are treated as missing.
+    """
+
+    def get(self, sourcefile, parameters):
+        """
+        :return: (dict)
+            metrics of the timestep, None if not indexed or stale
+        """
+        entry = self._valid_entry(sourcefile)
+        if entry is None or entry['parameters'] != parameters:
+            return None
+        return entry['metrics']
+
+    def add(self, sourcefile, parameters, metrics):
+        self._set_entry(sourcefile, parameters=parameters, metrics=metrics)
+
+
+def write_csv(rows, path):
+    """
+    :param rows: (list of dict)
+        metrics per timestep
+    :param path: (str)
+        CSV file, one row per timestep in time order
+    """
+    partial = path + '.partial'
+    with open(partial, 'w', newline='') as handle:
+        writer = csv.DictWriter(handle, COLUMNS)
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda row: row['time']))
+    os.replace(partial, path)
+
+
+# from src.analytics import run_analytics; run_analytics('D:/Downloads/Asteroid Ensemble - Airburst/')
+def run_analytics(root_folder, images=AIRBURST, attribute='v03', low=ISO_LOW, high=ISO_HIGH,
+                  cache_folder=None, processes=1):
+    """
+    Compute the metrics of every timestep that is missing or stale in
+    <root_folder>/analytics.json and write <root_folder>/analytics.csv.
+
+    :param root_folder: (str)
+        folder holding the .vti timesteps
+    :param images: (tuple)
+        timestep filenames relative to root_folder
+    :param attribute: (str)
+        thresholded data array
+    :param low: (float)
+        low threshold
+    :param high: (float)
+        high threshold
+    :param cache_folder: (str)
+        binary volume cache (see VolumeCache), None to read .vti directly
+    :param processes: (int)
+        timesteps analyzed in parallel, 1 to analyze them in this process
+    :return: (list of dict)
+        metrics per timestep, in time order
+    """
+    index = AnalyticsIndex(os.path.join(root_folder, 'analytics.json'))
+    parameters = {'attribute': attribute, 'low': low, 'high': high}
+    sourcefiles = [os.path.join(root_folder, image) for image in images]
+    pending = [sourcefile for sourcefile in sourcefiles if index.get(sourcefile, parameters) is None]
+    print('Analyzing {0} of {1} timesteps'.format(len(pending), len(sourcefiles)))
+
+    tasks = [(sourcefile, attribute, low, high) for sourcefile in pending]
+    if processes > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(cache_folder,)) as pool:
+            results = pool.imap_unordered(_analyze, tasks)
+            for sourcefile, metrics in results:
+                index.add(sourcefile, parameters, metrics)
+                index.save()
+    else:
+        _init_worker(cache_folder)
+        for task in tasks:
+            sourcefile, metrics = _analyze(task)
+            index.add(sourcefile, parameters, metrics)
+            index.save()
+
+    rows = [index.get(sourcefile, parameters) for sourcefile in sourcefiles]
+    write_csv(rows, os.path.join(root_folder, 'analytics.csv'))
+    return sorted(rows, key=lambda row: row['time'])
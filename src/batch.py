@@ -0,0 +1,202 @@
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+from collections import namedtuple
+
+from src.airburst import AIRBURST, RENDER_MODES, AsteroidVTK, output_views, timestep_tag
+from src.cache import VolumeCache
+
+# A single unit of work: render one timestep in one mode.
+RenderJob = namedtuple('RenderJob', ['sourcefile', 'outfile', 'attribute', 'mode'])
+
+# One timestep/attribute: loaded once, then rendered into every target (see config.RenderPlan)
+LoadJob = namedtuple('LoadJob', ['sourcefile', 'attribute', 'targets'])
+
+# Modes and cameras rendered into one output folder
+RenderTarget = namedtuple('RenderTarget', ['outfolder', 'modes', 'cameras'])
+
+# Each worker process owns one offscreen AsteroidVTK (created by _init_worker).
+_worker_ast = None
+
+
+def _create_renderer(cache_folder):
+    cache = VolumeCache(cache_folder) if cache_folder else None
+    return AsteroidVTK(offscreen=True, persistent=True, cache=cache)
+
+
+def _init_worker(create_renderer, args):
+    """
+    :param create_renderer: (function)
+        module level function returning the worker's AsteroidVTK, e.g. _create_renderer
+    :param args: (tuple)
+        its arguments
+    """
+    global _worker_ast
+    _worker_ast = create_renderer(*args)
+
+
+def _render_targets(job):
+    """
+    Images are rendered into <outfolder>/.partial_<tag>_<uuid>/, private to this
+    render, and moved into place once every mode and camera of the target is complete.
+
+    :param job: (LoadJob)
+    """
+    for target in job.targets:
+        partial = os.path.join(target.outfolder, '.partial_{0}_{1}'.format(timestep_tag(job.sourcefile),
+                                                                           uuid.uuid4().hex))
+        rendered = _worker_ast.render_all(job.sourcefile, partial, job.attribute, target.modes, target.cameras)
+        for outfile in rendered:
+            final = os.path.join(target.outfolder, os.path.relpath(outfile, partial))
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            os.replace(outfile, final)
+        shutil.rmtree(partial)
+
+
+def _render_job(job):
+    """
+    Render one job in a worker process.
+
+    Images are written to temporary files and moved into place once complete,
+    so a crash never leaves a truncated PNG that would look up to date on rerun.
+
+    :param job: (RenderJob or LoadJob)
+    :return: (RenderJob or LoadJob, float)
+        the job and its wall time in seconds
+    """
+    start = time.time()
+    if not os.path.exists(job.sourcefile):
+        # VTK only logs a missing file and would render an empty image
+        raise IOError('Missing timestep: {0}'.format(job.sourcefile))
+    if isinstance(job, LoadJob):
+        _render_targets(job)
+        return job, time.time() - start
+    out_dir = os.path.dirname(job.outfile)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    # Unique per render: a job taken back from an expired lease may render twice at once
+    partial = '{0}.{1}.partial'.format(job.outfile, uuid.uuid4().hex)
+    render = getattr(_worker_ast, RENDER_MODES[job.mode])
+    render(job.sourcefile, partial, job.attribute)
+    os.replace(partial, job.outfile)
+    return job, time.time() - start
+
+
+def outfiles(job):
+    """
+    :param job: (RenderJob or LoadJob)
+    :return: (list of str)
+        images written by the job
+    """
+    if isinstance(job, RenderJob):
+        return [job.outfile]
+    return [view[0] for target in job.targets for mode in target.modes
+            for view in output_views(job.sourcefile, target.outfolder, mode, target.cameras)]
+
+
+def is_up_to_date(job):
+    """
+    :param job: (RenderJob or LoadJob)
+    :return: (bool)
+        True if every output exists and is newer than its source file
+    """
+    if not os.path.exists(job.sourcefile):
+        return False
+    source_time = os.path.getmtime(job.sourcefile)
+    return all(os.path.exists(outfile) and os.path.getmtime(outfile) >= source_time for outfile in outfiles(job))
+
+
+def _job_name(job):
+    if isinstance(job, RenderJob):
+        return '{0} {1}'.format(job.mode, os.path.basename(job.sourcefile))
+    return '{0} {1}'.format(os.path.basename(job.sourcefile), job.attribute)
+
+
+def run_jobs(jobs, processes=None, force=False, create_renderer=_create_renderer, args=(None,)):
+    """
+    Render jobs that are not up to date across a pool of worker processes.
+
+    :param jobs: (list of RenderJob or LoadJob)
+    :param processes: (int)
+        number of workers, defaults to the number of CPUs
+    :param force: (bool)
+        re-render outputs that are already up to date
+    :param create_renderer: (function)
+        module level function creating the AsteroidVTK of each worker (see _init_worker)
+    :param args: (tuple)
+        its arguments
+    :return: (list of (RenderJob or LoadJob, float))
+        rendered jobs and their wall time in seconds
+    """
+    pending = [job for job in jobs if force or not is_up_to_date(job)]
+    print('Skipping {0} up to date of {1} jobs'.format(len(jobs) - len(pending), len(jobs)))
+    if not pending:
+        return []
+
+    results = []
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(create_renderer, args)) as pool:
+        for i, (job, elapsed) in enumerate(pool.imap_unordered(_render_job, pending)):
+            results.append((job, elapsed))
+            print('Rendered {0}: {1} of {2} ({3:.2f}s)'.format(_job_name(job), i + 1, len(pending), elapsed))
+    return results
+
+
+def build_jobs(root_folder, attribute='v03', modes=tuple(RENDER_MODES), images=AIRBURST):
+    """
+    Expand (timestep x render-mode) into render jobs.
+
+    Outputs follow run(): <root_folder>/output/<mode>/output_<tag>.png
+
+    :param root_folder: (str)
+        folder holding the .vti timesteps
+    :param attribute: (str)
+        data array to render
+    :param modes: (tuple)
+        keys of RENDER_MODES
+    :param images: (tuple)
+        timestep filenames relative to root_folder
+    :return: (list of RenderJob)
+    """
+    jobs = []
+    for mode in modes:
+        if mode not in RENDER_MODES:
+            raise ValueError('Unknown render mode: {0}'.format(mode))
+        for image in images:
+            sourcefile = os.path.join(root_folder, image)
+            outfilename = 'output_{0}.png'.format(timestep_tag(image))
+            outfile = os.path.join(root_folder, 'output', mode, outfilename)
+            jobs.append(RenderJob(sourcefile, outfile, attribute, mode))
+    return jobs
+
+
+# from src.batch import run_batch; run_batch('D:/Downloads/Asteroid Ensemble - Airburst/')
+def run_batch(root_folder, attribute='v03', modes=tuple(RENDER_MODES), images=AIRBURST,
+              processes=None, force=False, cache_folder=None):
+    """
+    Render the timestep sweep across a pool of worker processes.
+
+    :param root_folder: (str)
+        folder holding the .vti timesteps
+    :param attribute: (str)
+        data array to render
+    :param modes: (tuple)
+        keys of RENDER_MODES
+    :param images: (tuple)
+        timestep filenames relative to root_folder
+    :param processes: (int)
+        number of workers, defaults to the number of CPUs
+    :param force: (bool)
+        re-render outputs that are already up to date
+    :param cache_folder: (str)
+        binary volume cache shared by the workers (see VolumeCache), None to read .vti directly
+    :return: (list of (RenderJob, float))
+        rendered jobs and their wall time in seconds
+    """
+    start = time.time()
+    results = run_jobs(build_jobs(root_folder, attribute, modes, images), processes, force,
+                       _create_renderer, (cache_folder,))
+    if results:
+        print('Batch finished in {0:.2f}s'.format(time.time() - start))
+    return results
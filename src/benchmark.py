@@ -0,0 +1,203 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import vtk
+import vtk.util.numpy_support as VN
+
+from src.airburst import ATTRIBUTES, CAMERA_PRESETS, MODE_CAMERAS, RENDER_MODES, AsteroidVTK
+
+SIZES = (64, 128, 200, 300)
+
+# Stages of one render_* call, in pipeline order
+STAGES = ('load', 'range', 'build', 'pipeline', 'render', 'capture', 'encode', 'reset')
+
+
+def synthetic_volume(size, seed=0):
+    """
+    vtkImageData shaped like an AIRBURST timestep: size^3 float32 points with
+    the v02, v03, prs and tev arrays. v03 is a rippled blob in [0, 1], so the
+    0.1 and 0.8 isosurfaces exist and have realistic complexity.
+
+    :param size: (int)
+        points per axis
+    :return: (vtkImageData)
+    """
+    rng = np.random.RandomState(seed)
+    axis = np.linspace(-1.0, 1.0, size, dtype=np.float32)
+    z, y, x = np.meshgrid(axis, axis, axis, indexing='ij')
+    radius = np.sqrt(x * x + y * y + z * z)
+    ripple = 0.05 * np.sin(12 * x) * np.sin(9 * y) * np.sin(7 * z)
+    blob = np.clip(1.2 - 1.5 * radius + ripple, 0.0, 1.0)
+
+    image = vtk.vtkImageData()
+    image.SetDimensions(size, size, size)
+    image.SetSpacing(1.0 / size, 1.0 / size, 1.0 / size)
+    for i, attribute in enumerate(ATTRIBUTES):
+        if attribute == 'v03':
+            data = blob
+        else:
+            data = (blob + rng.normal(0.0, 0.01, blob.shape).astype(np.float32)) * (1.0 + i)
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        array = VN.numpy_to_vtk(data.ravel(), deep=1)
+        array.SetName(attribute)
+        image.GetPointData().AddArray(array)
+    return image
+
+
+def write_synthetic(folder, size, seed=0):
+    """
+    :return: (str)
+        .vti file of a synthetic volume, named like an AIRBURST timestep
+    """
+    sourcefile = os.path.join(folder, 'pv_insitu_{0}x{0}x{0}_00000-ts00.vti'.format(size))
+    writer = vtk.vtkXMLImageDataWriter()
+    writer.SetInputData(synthetic_volume(size, seed))
+    writer.SetFileName(sourcefile)
+    writer.Write()
+    return sourcefile
+
+
+def _timed(timings, stage, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+
+def time_render(ast, mode, sourcefile, outfile, attribute='v03'):
+    """
+    Time each stage of one render, following render_iso/render_sliced_iso/render_volume.
+
+    :param ast: (AsteroidVTK)
+        offscreen instance
+    :param mode: (str)
+        key of RENDER_MODES
+    :return: (dict)
+        stage -> seconds
+    """
+    timings = dict()
+    viewpoint = CAMERA_PRESETS[MODE_CAMERAS[mode]]
+    # Same file every repeat: make the reader decode it again, like a new timestep
+    ast.reader.Modified()
+    data = _timed(timings, 'load', ast._load_data, sourcefile, attribute)
+    min_value, max_value = _timed(timings, 'range', ast._data_range, sourcefile, attribute, data)
+    actors = _timed(timings, 'build', ast._add_actors, mode, min_value, max_value)
+
+    def update_pipelines():
+        # Contouring and color mapping, which would otherwise run inside the first render
+        props = ast.renderer.GetViewProps()
+        for i in range(props.GetNumberOfItems()):
+            prop = props.GetItemAsObject(i)
+            if prop.GetVisibility() and hasattr(prop, 'GetMapper') and prop.GetMapper() is not None:
+                prop.GetMapper().Update()
+
+    _timed(timings, 'pipeline', update_pipelines)
+    camera = _timed(timings, 'render', ast._initialize_camera, *viewpoint)
+    image = _timed(timings, 'capture', ast._capture_image)
+
+    def encode():
+        writer = vtk.vtkPNGWriter()
+        writer.SetInputData(image)
+        writer.SetFileName(outfile)
+        writer.Write()
+
+    _timed(timings, 'encode', encode)
+    _timed(timings, 'reset', ast._reset, camera, actors)
+    return timings
+
+
+# from src.benchmark import run_benchmark; run_benchmark('bench.json')
+def run_benchmark(outfile=None, sizes=SIZES, modes=tuple(RENDER_MODES), repeat=3, **ast_options):
+    """
+    Benchmark every render stage offscreen on synthetic volumes.
+
+    :param outfile: (str)
+        JSON results file, not written if None
+    :param sizes: (tuple)
+        volume sizes (points per axis)
+    :param modes: (tuple)
+        keys of RENDER_MODES
+    :param repeat: (int)
+        renders per (size, mode); the median of each stage is reported
+    :param ast_options:
+        extra AsteroidVTK arguments, e.g. persistent=True, volume_mapper='cpu'
+    :return: (dict)
+        {'meta': {...}, 'results': [{'size', 'mode', 'stage', 'seconds', 'samples'}, ...]}
+    """
+    folder = tempfile.mkdtemp(prefix='asteroid_benchmark_')
+    results = []
+    try:
+        for size in sizes:
+            sourcefile = write_synthetic(folder, size)
+            ast = AsteroidVTK(offscreen=True, **ast_options)
+            for mode in modes:
+                samples = [time_render(ast, mode, sourcefile, os.path.join(folder, 'frame.png'))
+                           for _ in range(repeat)]
+                for stage in STAGES:
+                    seconds = [sample[stage] for sample in samples]
+                    results.append({'size': size, 'mode': mode, 'stage': stage,
+                                    'seconds': statistics.median(seconds), 'samples': seconds})
+                total = sum(statistics.median(sample[stage] for sample in samples) for stage in STAGES)
+                print('Benchmark {0}^3 {1}: {2:.3f}s'.format(size, mode, total))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'vtk': vtk.vtkVersion.GetVTKVersion(),
+            'numpy': np.__version__,
+            'repeat': repeat,
+            'options': {key: str(value) for key, value in ast_options.items()},
+        },
+        'results': results,
+    }
+    if outfile:
+        with open(outfile, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    return report
+
+
+def compare(baseline, current, tolerance=1.2, min_seconds=0.005):
+    """
+    Report stages that got slower between two benchmark runs.
+
+    :param baseline: (str or dict)
+        JSON results file or report of the reference run
+    :param current: (str or dict)
+        JSON results file or report of the new run
+    :param tolerance: (float)
+        slowdown ratio counted as a regression
+    :param min_seconds: (float)
+        ignore stages faster than this in both runs (timer noise)
+    :return: (list of dict)
+        regressions with size, mode, stage, baseline, current and ratio
+    """
+    reports = []
+    for report in (baseline, current):
+        if isinstance(report, str):
+            with open(report) as handle:
+                report = json.load(handle)
+        reports.append({(r['size'], r['mode'], r['stage']): r['seconds'] for r in report['results']})
+    before, after = reports
+
+    regressions = []
+    for key in sorted(set(before) & set(after)):
+        if max(before[key], after[key]) < min_seconds:
+            continue
+        ratio = after[key] / max(before[key], 1e-9)
+        if ratio > tolerance:
+            size, mode, stage = key
+            regressions.append({'size': size, 'mode': mode, 'stage': stage,
+                                'baseline': before[key], 'current': after[key], 'ratio': ratio})
+            print('Regression {0}^3 {1} {2}: {3:.3f}s -> {4:.3f}s ({5:.2f}x)'.format(
+                size, mode, stage, before[key], after[key], ratio))
+    return regressions
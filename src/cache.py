@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import vtk
+import vtk.util.numpy_support as VN
+
+HEADER = 'header.json'
+
+
+def entry_name(sourcefile):
+    """
+    :param sourcefile: (str)
+        .vti timestep
+    :return: (str)
+        cache entry name, unique per source path: every run of the ensemble uses
+        the same timestep names, so the name alone would mix up their entries
+    """
+    stem = os.path.splitext(os.path.basename(sourcefile))[0]
+    digest = hashlib.sha1(os.path.abspath(sourcefile).encode()).hexdigest()[:12]
+    return '{0}-{1}'.format(stem, digest)
+
+
+class VolumeCache(object):
+    """
+    Binary cache of .vti timesteps.
+
+    On first use every point data array of a timestep (v02, v03, prs, tev) is
+    decoded once and stored as a raw .npy file next to a JSON header:
+
+        <cache_folder>/<timestep>-<path hash>/header.json
+        <cache_folder>/<timestep>-<path hash>/<attribute>.npy
+
+    Later loads memory-map the array and wrap it in vtkImageData without a copy.
+    An entry is rebuilt when the size or mtime of its source file changes.
+    """
+
+    def __init__(self, cache_folder):
+        """
+        :param cache_folder: (str)
+            folder holding one sub-folder per cached timestep
+        """
+        self.cache_folder = cache_folder
+        self.reader = vtk.vtkXMLImageDataReader()
+
+    def _entry(self, sourcefile):
+        return os.path.join(self.cache_folder, entry_name(sourcefile))
+
+    def _read_header(self, sourcefile):
+        """
+        :return: (dict)
+            header of a valid cache entry, None if missing or stale
+        """
+        path = os.path.join(self._entry(sourcefile), HEADER)
+        if not os.path.exists(path):
+            return None
+        with open(path) as handle:
+            header = json.load(handle)
+        stat = os.stat(sourcefile)
+        if header['source_size'] != stat.st_size or header['source_mtime'] != stat.st_mtime:
+            return None
+        return header
+
+    def convert(self, sourcefile):
+        """
+        Decode a .vti file and store all of its point data arrays.
+
+        Files are written under a temporary name and renamed into place, header last,
+        so concurrent or interrupted conversions never leave a partial entry.
+
+        :param sourcefile: (str)
+            .vti timestep
+        :return: (dict)
+            header of the new cache entry
+        """
+        stat = os.stat(sourcefile)
+        self.reader.SetFileName(sourcefile)
+        self.reader.Update()
+        image = self.reader.GetOutput()
+        point_data = image.GetPointData()
+
+        entry = self._entry(sourcefile)
+        os.makedirs(entry, exist_ok=True)
+        dimensions = image.GetDimensions()
+        header = {
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'dimensions': dimensions,
+            'origin': image.GetOrigin(),
+            'spacing': image.GetSpacing(),
+            'arrays': {},
+        }
+        for index in range(point_data.GetNumberOfArrays()):
+            array = point_data.GetArray(index)
+            name = array.GetName()
+            # Point data is x-fastest, store it as (z, y, x[, components])
+            data = VN.vtk_to_numpy(array)
+            shape = tuple(reversed(dimensions)) + data.shape[1:]
+            self._write(os.path.join(entry, name + '.npy'), lambda handle: np.save(handle, data.reshape(shape)))
+            header['arrays'][name] = {'dtype': data.dtype.str, 'shape': shape}
+        self._write(os.path.join(entry, HEADER), lambda handle: handle.write(json.dumps(header).encode()))
+        return header
+
+    @staticmethod
+    def _write(path, write):
+        partial = '{0}.{1}.partial'.format(path, os.getpid())
+        with open(partial, 'wb') as handle:
+            write(handle)
+        os.replace(partial, path)
+
+    def header(self, sourcefile):
+        """
+        :param sourcefile: (str)
+            .vti timestep
+        :return: (dict)
+            header of the cache entry, converting the file if needed
+        """
+        header = self._read_header(sourcefile)
+        if header is None:
+            header = self.convert(sourcefile)
+        return header
+
+    def load_array(self, sourcefile, attribute):
+        """
+        :param sourcefile: (str)
+            .vti timestep
+        :param attribute: (str)
+            data array to load
+        :return: (np.memmap)
+            read-only (z, y, x) array
+        """
+        header = self.header(sourcefile)
+        if attribute not in header['arrays']:
+            raise KeyError('{0} has no array {1}'.format(sourcefile, attribute))
+        return np.load(os.path.join(self._entry(sourcefile), attribute + '.npy'), mmap_mode='r')
+
+    def load(self, sourcefile, attribute):
+        """
+        :param sourcefile: (str)
+            .vti timestep
+        :param attribute: (str)
+            data array to load
+        :return: (vtkImageData)
+            image whose active scalars wrap the memory-mapped array
+        """
+        data = self.load_array(sourcefile, attribute)
+        header = self._read_header(sourcefile)
+        return wrap_image(data, attribute, header['origin'], header['spacing'])
+
+
+def read_vti(sourcefile, attribute=None):
+    """
+    :param sourcefile: (str)
+        .vti timestep
+    :param attribute: (str)
+        only decode this point data array, None for all of them
+    :return: (vtkImageData)
+        image owned by the caller
+    """
+    reader = vtk.vtkXMLImageDataReader()
+    reader.SetFileName(sourcefile)
+    select_point_array(reader, attribute)
+    reader.Update()
+    return reader.GetOutput()
+
+
+def select_point_array(reader, attribute=None):
+    """
+    Decode only one point data array of the reader's file.
+
+    :param reader: (vtkXMLImageDataReader)
+        reader whose file name is set
+    :param attribute: (str)
+        data array to decode, None for all of them
+    """
+    reader.UpdateInformation()
+    for index in range(reader.GetNumberOfPointArrays()):
+        name = reader.GetPointArrayName(index)
+        reader.SetPointArrayStatus(name, int(attribute is None or name == attribute))
+
+
+def wrap_image(data, attribute, origin=(0.0, 0.0, 0.0), spacing=(1.0, 1.0, 1.0)):
+    """
+    Wrap a (z, y, x[, components]) array in vtkImageData without copying.
+
+    :param data: (np.ndarray)
+        C-contiguous volume
+    :param attribute: (str)
+        name of the scalar array
+    :return: (vtkImageData)
+    """
+    flat = data.reshape((-1,) + data.shape[3:])
+    array = VN.numpy_to_vtk(flat)
+    array._numpy_reference = flat  # keep the mapped buffer alive with the vtk array
+    array.SetName(attribute)
+    image = vtk.vtkImageData()
+    image.SetDimensions(data.shape[2], data.shape[1], data.shape[0])
+    image.SetOrigin(origin)
+    image.SetSpacing(spacing)
+    image.GetPointData().SetScalars(array)
+    return image
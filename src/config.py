@@ -0,0 +1,328 @@
+import glob
+import json
+import multiprocessing
+import os
+import re
+import time
+from collections import namedtuple, OrderedDict
+
+import vtk
+
+from src.airburst import CAMERA_PRESETS, RENDER_MODES, AsteroidVTK, orbit
+from src.batch import LoadJob, RenderTarget, is_up_to_date, outfiles, run_jobs
+from src.cache import VolumeCache
+from src.isosurface import IsosurfaceCache
+from src.stats import StatsIndex
+from src.transfer import get_preset
+from src.video import VIDEO_CODECS, VideoWriter
+
+# Render settings of a whole config, passed to every AsteroidVTK (see _create_renderer)
+SETTINGS = {
+    'processes': None,  # worker processes for image sinks, defaults to the number of CPUs
+    'cache_folder': None,  # VolumeCache shared by the workers
+    'isosurface_folder': None,  # IsosurfaceCache shared by the workers
+    'stats': None,  # stats.json of build_index, for precomputed ranges
+    'stable_range': False,
+    'transfer': 'airburst',  # volume transfer function, key of transfer.PRESETS or a JSON preset file
+    'skip_empty': False,  # empty-space skipping of volume renders
+    'volume_quality': None,  # key of VOLUME_QUALITY or [sample distance, image sample distance]
+    'size': [800, 800],
+    'volume_mapper': None,
+    'backend': None,
+}
+
+# Rough seconds per 300^3 timestep, used by the dry run without a benchmark report:
+#   load, and (scene build, each camera view) per mode
+DEFAULT_COSTS = {'load': 2.0, 'iso': (1.2, 0.3), 'sliced': (1.7, 0.3), 'volume': (3.0, 1.0)}
+
+# Benchmark stages repeated for every camera view, the others run once per scene
+VIEW_STAGES = ('render', 'capture', 'encode')
+DEFAULT_POINTS = 300 ** 3
+
+# A video sink: its load jobs are rendered in timestep order into one VideoWriter
+VideoJob = namedtuple('VideoJob', ['dataset', 'sink', 'jobs'])
+
+
+def load_config(path):
+    """
+    :param path: (str)
+        .json, .toml (Python 3.11+) or .yaml/.yml (requires PyYAML) render config
+    :return: (dict)
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.toml':
+        import tomllib
+        with open(path, 'rb') as handle:
+            return tomllib.load(handle)
+    if extension in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('Reading {0} requires PyYAML'.format(path))
+        with open(path) as handle:
+            return yaml.safe_load(handle)
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def _dataset_files(dataset):
+    root = dataset.get('root', '')
+    patterns = dataset.get('files', '*.vti')
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    sourcefiles = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.join(root, pattern)))
+        # Listed files that do not exist yet (e.g. still to be ingested) are planned anyway
+        if not matches and not glob.has_magic(pattern):
+            matches = [os.path.join(root, pattern)]
+        sourcefiles.extend(match for match in matches if match not in sourcefiles)
+    return sourcefiles
+
+
+def _camera_name(camera):
+    return camera if isinstance(camera, str) else camera[0]
+
+
+def _validate(dataset, modes, cameras, presets, sink):
+    for mode in modes:
+        if mode not in RENDER_MODES:
+            raise ValueError('Unknown render mode in {0}: {1}'.format(dataset, mode))
+    for name in cameras or ():
+        if isinstance(name, str) and name not in presets:
+            raise ValueError('Unknown camera preset in {0}: {1}'.format(dataset, name))
+    if sink['type'] not in ('png', 'video'):
+        raise ValueError('Unknown sink in {0}: {1}'.format(dataset, sink['type']))
+    if sink['type'] == 'video' and sink.get('codec', 'mjpeg') not in VIDEO_CODECS:
+        raise ValueError('Unknown video codec in {0}: {1}'.format(dataset, sink['codec']))
+
+
+class RenderPlan(object):
+    """
+    A render config expanded into jobs.
+
+    Every (timestep, attribute) becomes one LoadJob however many datasets,
+    modes and cameras render it, so it is read once; its modes render from one
+    persistent scene, so iso and sliced share their isosurfaces. Image jobs run
+    in parallel, each video sink runs its jobs in timestep order.
+    """
+
+    def __init__(self, config):
+        """
+        :param config: (dict)
+            {'settings': {...}, 'cameras': {name: [zpos, elevation, azimuth]},
+             'defaults': {...}, 'datasets': [{...}, ...]}, see input/airburst.json
+        """
+        self.settings = dict(SETTINGS, **config.get('settings', {}))
+        # Presets of this config only, its camera names are resolved to viewpoints here
+        self.cameras = dict(CAMERA_PRESETS, **{name: tuple(preset)
+                                                for name, preset in config.get('cameras', {}).items()})
+        get_preset(self.settings['transfer'])  # fail before any job runs
+        if self.settings['stable_range'] and not self.settings['stats']:
+            raise ValueError('stable_range requires stats')
+
+        self.jobs = []
+        self.videos = []
+        self.requested = {'loads': 0, 'contours': 0, 'images': 0}
+        jobs = OrderedDict()
+        defaults = config.get('defaults', {})
+        for index, dataset in enumerate(config['datasets']):
+            dataset = dict(defaults, **dataset)
+            name = dataset.get('name', 'dataset {0}'.format(index))
+            attributes = dataset.get('attributes', ['v03'])
+            modes = tuple(dataset.get('modes', RENDER_MODES))
+            cameras = tuple(dataset.get('cameras') or ())
+            sink = dataset.get('sink', {'type': 'png'})
+            sink = {'type': sink} if isinstance(sink, str) else dict(sink)
+            _validate(name, modes, cameras, self.cameras, sink)
+            cameras = tuple((camera,) + self.cameras[camera] if isinstance(camera, str) else tuple(camera)
+                            for camera in cameras)
+            if 'orbit' in dataset:
+                # e.g. {"steps": 36, "elevation": -30.0}, see airburst.orbit
+                cameras += tuple(orbit(**dataset['orbit']))
+            cameras = cameras or None
+
+            output = dataset.get('output', os.path.join(dataset.get('root', ''), 'output'))
+            sourcefiles = _dataset_files(dataset)
+            video_jobs = []
+            for attribute in attributes:
+                # Several attributes would write the same image names, give each a folder
+                outfolder = os.path.join(output, attribute) if len(attributes) > 1 else output
+                target = RenderTarget(outfolder, modes, cameras)
+                for sourcefile in sourcefiles:
+                    self.requested['loads'] += len(modes)
+                    self.requested['contours'] += 2 * sum(mode in ('iso', 'sliced') for mode in modes)
+                    self.requested['images'] += len(modes) * len(cameras or (None,))
+                    if sink['type'] == 'video':
+                        video_jobs.append(LoadJob(sourcefile, attribute, (target,)))
+                        continue
+                    key = (sourcefile, attribute)
+                    targets = jobs[key].targets if key in jobs else ()
+                    if target not in targets:
+                        jobs[key] = LoadJob(sourcefile, attribute, targets + (target,))
+            if video_jobs:
+                self.videos.append(VideoJob(name, sink, video_jobs))
+        self.jobs = list(jobs.values())
+
+    def all_jobs(self):
+        return self.jobs + [job for video in self.videos for job in video.jobs]
+
+    def estimate_cost(self, benchmark=None):
+        """
+        Estimated seconds of every job: the costs of the closest benchmarked size,
+        scaled by the number of points of its timestep.
+
+        :param benchmark: (str or dict)
+            report of src.benchmark.run_benchmark measured on the render machine,
+            defaults to DEFAULT_COSTS
+        :return: (dict)
+            LoadJob -> seconds
+        """
+        sizes = {DEFAULT_POINTS: DEFAULT_COSTS}
+        if benchmark is not None:
+            sizes = _benchmark_costs(benchmark)
+        estimates = dict()
+        for job in self.all_jobs():
+            job_points = _timestep_points(job.sourcefile)
+            points = min(sizes, key=lambda size: abs(size - job_points))
+            costs, scale = sizes[points], job_points / float(points)
+            seconds = costs['load']
+            for target in job.targets:
+                views = len(target.cameras or (None,))
+                seconds += sum(costs[mode][0] + costs[mode][1] * views for mode in target.modes)
+            estimates[job] = seconds * scale
+        return estimates
+
+    def print_plan(self, benchmark=None, force=False):
+        """Print the expanded jobs, what they share and their estimated cost (the dry run)."""
+        estimates = self.estimate_cost(benchmark)
+        processes = self.settings['processes'] or multiprocessing.cpu_count()
+        for job in self.jobs:
+            state = 'up to date' if not force and is_up_to_date(job) else '{0:.1f}s'.format(estimates[job])
+            for target in job.targets:
+                print('image {0} {1} -> {2} {3}{4} ({5})'.format(
+                    os.path.basename(job.sourcefile), job.attribute, target.outfolder, '+'.join(target.modes),
+                    ' x ' + '+'.join(_camera_name(camera) for camera in target.cameras) if target.cameras else '',
+                    state))
+        for video in self.videos:
+            print('video {0}: {1} timesteps, {2} {3}'.format(
+                video.dataset, len(video.jobs), video.sink.get('codec', 'mjpeg'), video.sink.get('fps', 10)))
+
+        pending = [job for job in self.jobs if force or not is_up_to_date(job)]
+        image_seconds = sum(estimates[job] for job in pending)
+        video_seconds = sum(estimates[job] for video in self.videos for job in video.jobs)
+        contours = sum(2 * any(mode in ('iso', 'sliced') for target in job.targets for mode in target.modes)
+                       for job in self.all_jobs())
+        images = sum(len(outfiles(job)) for job in self.all_jobs())
+        print('Loads: {0} (requested {1})'.format(len(self.all_jobs()), self.requested['loads']))
+        print('Isosurfaces: {0} (requested {1})'.format(contours, self.requested['contours']))
+        print('Images: {0}, {1} image jobs pending of {2}, {3} videos'.format(
+            images, len(pending), len(self.jobs), len(self.videos)))
+        print('Estimated cost: {0:.1f}s cpu, {1:.1f}s wall on {2} processes'.format(
+            image_seconds + video_seconds, image_seconds / processes + video_seconds, processes))
+
+
+def _benchmark_costs(benchmark):
+    """
+    :return: (dict)
+        number of points -> costs as in DEFAULT_COSTS, per benchmarked size
+    """
+    if isinstance(benchmark, str):
+        with open(benchmark) as handle:
+            benchmark = json.load(handle)
+    loads, modes = {}, {}
+    for result in benchmark['results']:
+        points = result['size'] ** 3
+        if result['stage'] == 'load':
+            loads.setdefault(points, []).append(result['seconds'])
+            continue
+        mode = modes.setdefault(points, {}).setdefault(result['mode'], [0.0, 0.0])
+        mode[result['stage'] in VIEW_STAGES] += result['seconds']
+
+    sizes = dict()
+    for points, samples in loads.items():
+        costs = dict(DEFAULT_COSTS, load=sum(samples) / len(samples))
+        costs.update((mode, tuple(seconds)) for mode, seconds in modes.get(points, {}).items())
+        sizes[points] = costs
+    return sizes
+
+
+def _timestep_points(sourcefile):
+    """
+    :return: (int)
+        number of points, read from the .vti header, else from a 300x300x300 filename
+    """
+    if os.path.exists(sourcefile):
+        reader = vtk.vtkXMLImageDataReader()
+        reader.SetFileName(sourcefile)
+        reader.UpdateInformation()
+        extent = reader.GetOutputInformation(0).Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+        return (extent[1] - extent[0] + 1) * (extent[3] - extent[2] + 1) * (extent[5] - extent[4] + 1)
+    match = re.search(r'(\d+)x(\d+)x(\d+)', os.path.basename(sourcefile))
+    if match:
+        return int(match.group(1)) * int(match.group(2)) * int(match.group(3))
+    return DEFAULT_POINTS
+
+
+def _create_renderer(settings, image_writer=None):
+    cache = VolumeCache(settings['cache_folder']) if settings['cache_folder'] else None
+    isosurfaces = IsosurfaceCache(settings['isosurface_folder']) if settings['isosurface_folder'] else None
+    stats = StatsIndex(settings['stats']) if settings['stats'] else None
+    return AsteroidVTK(offscreen=True, persistent=True, cache=cache, stats=stats,
+                       stable_range=settings['stable_range'], backend=settings['backend'],
+                       volume_mapper=settings['volume_mapper'], isosurfaces=isosurfaces,
+                       image_writer=image_writer, size=tuple(settings['size']),
+                       transfer=settings['transfer'], skip_empty=settings['skip_empty'],
+                       volume_quality=settings['volume_quality'])
+
+
+def run_plan(plan, force=False):
+    """
+    Render the image jobs across a pool of worker processes, then every video.
+
+    :param plan: (RenderPlan)
+    :param force: (bool)
+        re-render images that are already up to date
+    :return: (list of (LoadJob, float))
+        rendered image jobs and their wall time in seconds
+    """
+    start = time.time()
+    results = run_jobs(plan.jobs, plan.settings['processes'], force, _create_renderer, (plan.settings,))
+
+    # A video is a sequential stream: its timesteps render in order in this process
+    for video in plan.videos:
+        image_writer = VideoWriter(fps=video.sink.get('fps', 10), codec=video.sink.get('codec', 'mjpeg'),
+                                   quality=video.sink.get('quality', 90))
+        ast = _create_renderer(plan.settings, image_writer)
+        try:
+            for i, job in enumerate(video.jobs):
+                print('Rendering video {0}: {1} of {2}'.format(video.dataset, i + 1, len(video.jobs)))
+                for target in job.targets:
+                    ast.render_all(job.sourcefile, target.outfolder, job.attribute, target.modes, target.cameras)
+        finally:
+            image_writer.close()
+    print('Jobs finished in {0:.2f}s'.format(time.time() - start))
+    return results
+
+
+# from src.config import run_config; run_config('input/airburst.json', dry_run=True)
+def run_config(path, dry_run=False, force=False, benchmark=None):
+    """
+    Render everything a config file describes.
+
+    :param path: (str)
+        .json, .toml or .yaml render config, see input/airburst.json
+    :param dry_run: (bool)
+        only print the expanded plan and its estimated cost
+    :param force: (bool)
+        re-render images that are already up to date
+    :param benchmark: (str)
+        benchmark report (src.benchmark.run_benchmark) to estimate the cost with
+    :return: (RenderPlan)
+    """
+    plan = RenderPlan(load_config(path))
+    if dry_run:
+        plan.print_plan(benchmark, force)
+    else:
+        run_plan(plan, force)
+    return plan
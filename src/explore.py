@@ -0,0 +1,352 @@
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import vtk
+import vtk.util.numpy_support as VN
+
+from src.airburst import AIRBURST, CAMERA_PRESETS, ISO_HIGH, ISO_LOW, MODE_CAMERAS, RENDER_MODES, AsteroidVTK
+from src.cache import VolumeCache, read_vti, wrap_image
+from src.isosurface import create_contour_filter
+
+# A loaded timestep: full resolution and level-of-detail images, and the data range
+Frame = namedtuple('Frame', ['image', 'lod', 'min', 'max'])
+
+# Keys handled by the Explorer; the trackball camera style handles the rest
+KEYS = {
+    'Right': 'next timestep',
+    'Left': 'previous timestep',
+    'Home': 'first timestep',
+    'End': 'last timestep',
+    'Up': 'next render mode',
+    'Down': 'previous render mode',
+}
+
+# Scene actors drawn from the level-of-detail image while the camera moves
+LOD_ACTORS = ('iso_low', 'iso_high', 'volume')
+
+
+def downsample(image, attribute, stride):
+    """
+    :param image: (vtkImageData)
+        full resolution timestep
+    :param stride: (int)
+        keep every stride-th point along each axis
+    :return: (vtkImageData)
+        level-of-detail image keeping the world coordinates of the full grid
+    """
+    dimensions = image.GetDimensions()
+    data = VN.vtk_to_numpy(image.GetPointData().GetArray(attribute))
+    data = data.reshape(tuple(reversed(dimensions)) + data.shape[1:])
+    lod = np.ascontiguousarray(data[::stride, ::stride, ::stride])
+    return wrap_image(lod, attribute, image.GetOrigin(), [d * stride for d in image.GetSpacing()])
+
+
+class FrameLoader(object):
+    """
+    Timesteps kept ready for switching: the frames closest to the requested
+    timestep stay loaded, and its neighbours are loaded on a background thread,
+    so stepping forward or back does not reread files.
+    """
+
+    def __init__(self, sourcefiles, attribute, cache=None, stride=4, keep=3):
+        """
+        :param sourcefiles: (list of str)
+            .vti timesteps in time order
+        :param attribute: (str)
+            data array to load
+        :param cache: (VolumeCache or ChunkedStore)
+            load from the cache instead of decoding the .vti
+        :param stride: (int)
+            downsampling of the level-of-detail images
+        :param keep: (int)
+            frames kept loaded, at least the current one and its two neighbours
+        """
+        self.sourcefiles = list(sourcefiles)
+        self.attribute = attribute
+        self.cache = cache
+        self.stride = stride
+        self.keep = max(3, keep)
+        self._frames = dict()  # index -> Frame
+        self._current = 0  # last requested index, frames farthest from it are dropped first
+        self._loading = dict()  # index -> Future
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(1)
+
+    def __len__(self):
+        return len(self.sourcefiles)
+
+    def _load(self, index):
+        sourcefile = self.sourcefiles[index]
+        if self.cache is not None:
+            image = self.cache.load(sourcefile, self.attribute)
+        else:
+            image = read_vti(sourcefile, self.attribute)
+        data = VN.vtk_to_numpy(image.GetPointData().GetArray(self.attribute))
+        return Frame(image, downsample(image, self.attribute, self.stride), float(np.amin(data)), float(np.amax(data)))
+
+    def _store(self, index, frame):
+        # Caller holds the lock
+        self._frames[index] = frame
+        while len(self._frames) > self.keep:
+            del self._frames[max(self._frames, key=lambda i: abs(i - self._current))]
+
+    def _finished(self, index, future):
+        with self._lock:
+            self._loading.pop(index, None)
+            if future.exception() is None:
+                self._store(index, future.result())
+
+    def _submit(self, index):
+        """
+        Caller holds the lock, and adds the callback with _watch once it is released.
+
+        :return: (Future)
+            the new load, None if the frame is loaded or loading already
+        """
+        if index in self._frames or index in self._loading:
+            return None
+        future = self._pool.submit(self._load, index)
+        self._loading[index] = future
+        return future
+
+    def _watch(self, index, future):
+        # A load that already finished runs its callback right away in this thread,
+        #   which takes the lock: never called while holding it
+        if future is not None:
+            future.add_done_callback(lambda done: self._finished(index, done))
+
+    def get(self, index):
+        """
+        :param index: (int)
+            position in sourcefiles
+        :return: (Frame)
+            the timestep, waiting if it is not loaded yet; its neighbours start loading
+        """
+        with self._lock:
+            self._current = index
+            frame = self._frames.get(index)
+            if frame is None:
+                started = self._submit(index)
+                future = self._loading[index]
+        if frame is None:
+            self._watch(index, started)
+            frame = future.result()
+            with self._lock:
+                self._store(index, frame)
+        with self._lock:
+            neighbours = [(neighbour, self._submit(neighbour)) for neighbour in (index + 1, index - 1)
+                          if 0 <= neighbour < len(self.sourcefiles)]
+        for neighbour, started in neighbours:
+            self._watch(neighbour, started)
+        return frame
+
+    def loaded(self):
+        """:return: (list of int) indices of the frames ready to show"""
+        with self._lock:
+            return sorted(self._frames)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+class Explorer(object):
+    """
+    Interactive exploration of a series in one persistent AsteroidVTK scene.
+
+    While the camera moves, the isosurfaces and the volume are drawn from a
+    downsampled copy of the timestep; when the motion stops they are drawn at
+    full resolution again. The interactor's desired update rate applies during
+    the motion, so volume mappers that auto-adjust their sampling coarsen too.
+    KEYS step through the timesteps and render modes, keeping the camera.
+
+    Offscreen windows get a vtkGenericRenderWindowInteractor. Nothing polls it,
+    so synthetic events (SetEventInformation, SetKeySym, InvokeEvent) drive the
+    same handlers as a user would.
+    """
+
+    def __init__(self, ast, sourcefiles, attribute, mode='volume', cache=None, stride=4, keep=3,
+                 interactive_rate=15.0, still_rate=0.0001):
+        """
+        :param ast: (AsteroidVTK)
+            persistent renderer to explore in
+        :param sourcefiles: (list of str)
+            .vti timesteps in time order
+        :param attribute: (str)
+            data array to show
+        :param mode: (str)
+            key of RENDER_MODES shown first
+        :param cache: (VolumeCache or ChunkedStore)
+            load timesteps from the cache, see FrameLoader
+        :param stride: (int)
+            downsampling of the level-of-detail actors
+        :param keep: (int)
+            timesteps kept loaded, see FrameLoader
+        :param interactive_rate: (float)
+            frames per second the window aims for during camera motion
+        :param still_rate: (float)
+            frames per second once the motion stops, low for full quality
+        """
+        if not ast.persistent:
+            raise ValueError('Exploring needs a persistent AsteroidVTK')
+        if mode not in RENDER_MODES:
+            raise ValueError('Unknown render mode: {0}'.format(mode))
+        self.ast = ast
+        self.attribute = attribute
+        self.modes = list(RENDER_MODES)
+        self.mode = mode
+        self.frames = FrameLoader(sourcefiles, attribute, cache, stride, keep)
+        self.index = None
+        self.interacting = False
+        self.lod_source = vtk.vtkTrivialProducer()
+        self.lod_scene = None
+        self._replaced = []
+
+        self.interactor = ast.interactor or vtk.vtkGenericRenderWindowInteractor()
+        self.interactor.SetRenderWindow(ast.window)
+        self.interactor.SetInteractorStyle(vtk.vtkInteractorStyleTrackballCamera())
+        self.interactor.SetDesiredUpdateRate(interactive_rate)
+        self.interactor.SetStillUpdateRate(still_rate)
+        style = self.interactor.GetInteractorStyle()
+        style.AddObserver('StartInteractionEvent', self._start_motion)
+        style.AddObserver('EndInteractionEvent', self._end_motion)
+        self.interactor.AddObserver('KeyPressEvent', self._key_press)
+
+    def _build_lod_scene(self):
+        """
+        :return: (dict)
+            actor name of LOD_ACTORS -> hidden copy fed by the level-of-detail image,
+            sharing the properties (and transfer functions) of the full resolution actor
+        """
+        ast = self.ast
+        scene = dict()
+        for name, value in (('iso_low', ISO_LOW), ('iso_high', ISO_HIGH)):
+            contour = create_contour_filter()
+            contour.SetInputConnection(self.lod_source.GetOutputPort())
+            contour.SetValue(0, value)
+            mapper = vtk.vtkPolyDataMapper()
+            mapper.SetInputConnection(contour.GetOutputPort())
+            mapper.ScalarVisibilityOff()
+            actor = vtk.vtkActor()
+            actor.SetMapper(mapper)
+            actor.SetProperty(ast.scene[name].GetProperty())
+            scene[name] = actor
+
+        volume_property = ast.scene['volume'].GetProperty()
+        volume_mapper = ast._create_volume_mapper(volume_property)
+        volume_mapper.SetBlendModeToComposite()
+        volume_mapper.SetInputConnection(self.lod_source.GetOutputPort())
+        volume = vtk.vtkVolume()
+        volume.SetMapper(volume_mapper)
+        volume.SetProperty(volume_property)
+        scene['volume'] = volume
+
+        for prop in scene.values():
+            prop.VisibilityOff()
+            ast.renderer.AddViewProp(prop)
+        return scene
+
+    def show(self, index, mode=None):
+        """
+        Show a timestep at full resolution, keeping the camera once it is set.
+
+        :param index: (int)
+            position in the series, clamped to its ends
+        :param mode: (str)
+            key of RENDER_MODES, None to keep the current one
+        """
+        index = max(0, min(index, len(self.frames) - 1))
+        mode = mode or self.mode
+        if index == self.index and mode == self.mode:
+            return
+        self.mode = mode
+        frame = self.frames.get(index)
+        sourcefile = self.frames.sourcefiles[index]
+        ast = self.ast
+        data = ast._set_image(frame.image, sourcefile, self.attribute)
+        if ast.stats is None:
+            min_value, max_value = frame.min, frame.max
+        else:
+            min_value, max_value = ast._data_range(sourcefile, self.attribute, data)
+        self._end_motion()
+        ast._show_scene(self.mode, min_value, max_value)
+        self.lod_source.SetOutput(frame.lod)
+        if self.lod_scene is None:
+            self.lod_scene = self._build_lod_scene()
+
+        first = self.index is None
+        self.index = index
+        if first:
+            ast._initialize_camera(*CAMERA_PRESETS[MODE_CAMERAS[self.mode]])
+        else:
+            ast.window.Render()
+
+    def _start_motion(self, caller=None, event=None):
+        """Camera motion starts: draw the level-of-detail actors instead."""
+        if self.interacting or self.lod_scene is None:
+            return
+        self.interacting = True
+        self._replaced = [name for name in LOD_ACTORS if self.ast.scene[name].GetVisibility()]
+        for name in self._replaced:
+            self.ast.scene[name].VisibilityOff()
+            self.lod_scene[name].VisibilityOn()
+
+    def _end_motion(self, caller=None, event=None):
+        """
+        Camera motion stopped: back to full resolution. The interactor style
+        renders right after this event, at the still update rate.
+        """
+        if not self.interacting:
+            return
+        self.interacting = False
+        for name in self._replaced:
+            self.lod_scene[name].VisibilityOff()
+            self.ast.scene[name].VisibilityOn()
+        self._replaced = []
+
+    def _key_press(self, caller, event):
+        key = caller.GetKeySym()
+        if key == 'Right':
+            self.show(self.index + 1)
+        elif key == 'Left':
+            self.show(self.index - 1)
+        elif key == 'Home':
+            self.show(0)
+        elif key == 'End':
+            self.show(len(self.frames) - 1)
+        elif key in ('Up', 'Down'):
+            step = 1 if key == 'Up' else -1
+            self.show(self.index, self.modes[(self.modes.index(self.mode) + step) % len(self.modes)])
+
+    def start(self, index=0):
+        """Show a timestep and hand control to the interactor until the window closes."""
+        self.show(index)
+        for key, action in KEYS.items():
+            print('{0:>6}: {1}'.format(key, action))
+        self.interactor.Initialize()
+        self.interactor.Start()
+
+    def close(self):
+        self.frames.close()
+
+
+# from src.explore import explore; explore('D:/Downloads/Asteroid Ensemble - Airburst/')
+def explore(root_folder, attribute='v03', images=AIRBURST, mode='volume', cache_folder=None, stride=4,
+            **ast_options):
+    """
+    Open an interactive window on a series, see Explorer.
+
+    :param cache_folder: (str)
+        binary volume cache (see VolumeCache), None to read .vti directly
+    :param ast_options: (dict)
+        extra AsteroidVTK arguments, e.g. stats=index, stable_range=True
+    """
+    cache = VolumeCache(cache_folder) if cache_folder else None
+    ast = AsteroidVTK(persistent=True, **ast_options)
+    explorer = Explorer(ast, [os.path.join(root_folder, image) for image in images], attribute, mode, cache, stride)
+    try:
+        explorer.start()
+    finally:
+        explorer.close()
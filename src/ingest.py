@@ -0,0 +1,143 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from urllib.request import Request, urlopen
+
+from src.airburst import RENDER_MODES, AsteroidVTK
+
+LANL_URL = 'http://oceans11.lanl.gov/deepwaterimpact/yA31/300x300x300-FourScalars_resolution/'
+
+# Links to .vti files in an Apache style directory listing
+LISTING_PATTERN = re.compile(r'href="([^"?#]+\.vti)"', re.IGNORECASE)
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+def list_timesteps(url=LANL_URL):
+    """
+    .vti files of a directory listing, without duplicates and in listing order.
+
+    :param url: (str)
+        directory listing
+    :return: (list of str)
+        filenames relative to url
+    """
+    with urlopen(url) as response:
+        listing = response.read().decode('utf-8')
+    return list(dict.fromkeys(LISTING_PATTERN.findall(listing)))
+
+
+def remote_size(url):
+    """
+    :return: (int)
+        Content-Length of a HEAD request, None if the server does not report it
+    """
+    with urlopen(Request(url, method='HEAD')) as response:
+        length = response.headers.get('Content-Length')
+    return int(length) if length is not None else None
+
+
+def download(url, localfile, chunk_size=CHUNK_SIZE):
+    """
+    Stream a file to disk in chunks, resuming an interrupted download.
+
+    Data goes to <localfile>.partial, which continues from its current size with an
+    HTTP Range request, and is renamed once the size matches the server's. A file
+    that already exists with the expected size is not downloaded again.
+
+    :param url: (str)
+        remote file
+    :param localfile: (str)
+        destination path
+    :param chunk_size: (int)
+        bytes held in memory at a time
+    :return: (str)
+        localfile
+    """
+    expected = remote_size(url)
+    if os.path.exists(localfile) and (expected is None or os.path.getsize(localfile) == expected):
+        return localfile
+
+    partial = localfile + '.partial'
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    if expected is not None and offset > expected:
+        offset = 0
+    if expected is not None and offset == expected:
+        # Complete but never renamed (interrupted before os.replace): a Range request
+        #   starting at the end would be answered 416 by range-capable servers
+        os.replace(partial, localfile)
+        return localfile
+    request = Request(url)
+    if offset:
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+
+    with urlopen(request) as response:
+        # A server without range support answers 200 with the whole file
+        mode = 'ab' if offset and response.status == 206 else 'wb'
+        with open(partial, mode) as handle:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                handle.write(chunk)
+
+    size = os.path.getsize(partial)
+    if expected is not None and size != expected:
+        raise IOError('Incomplete download of {0}: {1} of {2} bytes'.format(url, size, expected))
+    os.replace(partial, localfile)
+    return localfile
+
+
+def ingest(folder, url=LANL_URL, filenames=None, max_workers=2):
+    """
+    Download the timesteps of a listing, yielding each local file in listing order
+    as soon as it is complete while the following ones keep downloading.
+
+    :param folder: (str)
+        destination folder
+    :param url: (str)
+        directory listing
+    :param filenames: (list of str)
+        files relative to url, defaults to every .vti of the listing
+    :param max_workers: (int)
+        concurrent downloads
+    :return: (generator of str)
+        local files
+    """
+    if filenames is None:
+        filenames = list_timesteps(url)
+    os.makedirs(folder, exist_ok=True)
+    with ThreadPoolExecutor(max_workers) as pool:
+        futures = [pool.submit(download, urljoin(url, filename), os.path.join(folder, os.path.basename(filename)))
+                   for filename in filenames]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+# from src.ingest import render_remote; render_remote('D:/Downloads/Asteroid Ensemble - Airburst/')
+def render_remote(folder, url=LANL_URL, attribute='v03', modes=tuple(RENDER_MODES), max_workers=2):
+    """
+    Download a timestep listing and render each timestep while the next downloads.
+
+    :param folder: (str)
+        download folder, images go to <folder>/output/<mode>/
+    :param url: (str)
+        directory listing
+    :param attribute: (str)
+        data array to render
+    :param modes: (tuple)
+        keys of RENDER_MODES
+    :param max_workers: (int)
+        concurrent downloads
+    """
+    ast = AsteroidVTK()
+    filenames = list_timesteps(url)
+    total_images = len(filenames)
+    for i, sourcefile in enumerate(ingest(folder, url, filenames, max_workers)):
+        print('Processing {0}: {1} of {2}'.format(os.path.basename(sourcefile), i, total_images))
+        ast.render_all(sourcefile, os.path.join(folder, 'output'), attribute, modes)
@@ -0,0 +1,147 @@
+import contextlib
+import csv
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss():
+    """
+    :return: (float)
+        peak resident set size of this process in MB, None where unsupported
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+class Instrumentation(object):
+    """
+    Per-stage timing of AsteroidVTK.
+
+    Every stage produces a record
+        {'frame', 'mode', 'stage', 'wall', 'cpu', 'peak_rss'}
+    with wall/cpu time in seconds and peak RSS in MB. Records are kept for the
+    report and passed to every observer as they happen, e.g. for live logging:
+
+        Instrumentation(observers=[print])
+
+    frame and mode come from context, which AsteroidVTK updates as it loads
+    timesteps and renders modes.
+    """
+
+    def __init__(self, observers=()):
+        """
+        :param observers: (list of callable)
+            called with each record
+        """
+        self.observers = list(observers)
+        self.records = []
+        self.context = {'frame': None, 'mode': None}
+        self._started = dict()
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def record(self, stage, wall, cpu):
+        record = dict(self.context, stage=stage, wall=wall, cpu=cpu, peak_rss=peak_rss())
+        self.records.append(record)
+        for observer in self.observers:
+            observer(record)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the enclosed block as one stage."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def watch(self, vtk_object, name=None):
+        """
+        Time every execution of a VTK filter or mapper through its StartEvent/EndEvent.
+
+        :param vtk_object: (vtkAlgorithm)
+        :param name: (str)
+            stage name, defaults to 'vtk:<class name>'
+        """
+        name = name or 'vtk:' + vtk_object.GetClassName()
+
+        def start(caller, event):
+            self._started[id(caller)] = (time.perf_counter(), time.process_time())
+
+        def end(caller, event):
+            if id(caller) in self._started:
+                wall, cpu = self._started.pop(id(caller))
+                self.record(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+        vtk_object.AddObserver('StartEvent', start)
+        vtk_object.AddObserver('EndEvent', end)
+
+    def frame_table(self):
+        """
+        :return: (list of dict)
+            one row per (frame, mode) with the total wall time of each stage
+        """
+        rows = dict()
+        for record in self.records:
+            key = (record['frame'], record['mode'])
+            row = rows.setdefault(key, {'frame': record['frame'], 'mode': record['mode']})
+            row[record['stage']] = row.get(record['stage'], 0.0) + record['wall']
+            row['peak_rss'] = record['peak_rss']
+        return list(rows.values())
+
+    def summary(self):
+        """
+        :return: (dict)
+            stage -> count, total/mean/max wall time and total cpu time
+        """
+        summary = dict()
+        for record in self.records:
+            stage = summary.setdefault(record['stage'], {'count': 0, 'wall': 0.0, 'max_wall': 0.0, 'cpu': 0.0})
+            stage['count'] += 1
+            stage['wall'] += record['wall']
+            stage['cpu'] += record['cpu']
+            stage['max_wall'] = max(stage['max_wall'], record['wall'])
+        for stage in summary.values():
+            stage['mean_wall'] = stage['wall'] / stage['count']
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        # vtk: stages run nested inside the AsteroidVTK stages, keep them out of the total
+        total = sum(stage['wall'] for name, stage in summary.items() if not name.startswith('vtk:')) or 1.0
+        for name, stage in sorted(summary.items(), key=lambda item: -item[1]['wall']):
+            print('{0:<28} {1:>5}x {2:>9.3f}s wall {3:>9.3f}s cpu {4:>5.1f}%'.format(
+                name, stage['count'], stage['wall'], stage['cpu'], 100.0 * stage['wall'] / total))
+        peak = peak_rss()
+        if peak is not None:
+            print('Peak RSS: {0:.1f} MB'.format(peak))
+
+    def write_report(self, path):
+        """
+        Write the per-frame timing table: CSV for a .csv path, otherwise JSON
+        with the frames, the summary and every raw record.
+
+        :param path: (str)
+        """
+        frames = self.frame_table()
+        if path.endswith('.csv'):
+            columns = ['frame', 'mode']
+            for row in frames:
+                columns.extend(key for key in row if key not in columns)
+            with open(path, 'w', newline='') as handle:
+                writer = csv.DictWriter(handle, columns)
+                writer.writeheader()
+                writer.writerows(frames)
+            return
+        with open(path, 'w') as handle:
+            json.dump({'frames': frames, 'summary': self.summary(), 'records': self.records}, handle, indent=2)
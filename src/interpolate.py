@@ -0,0 +1,163 @@
+import os
+
+import numpy as np
+import vtk.util.numpy_support as VN
+
+from src.airburst import AIRBURST, RENDER_MODES, AsteroidVTK, timestep_time
+from src.cache import read_vti, wrap_image
+
+CHUNK_SIZE = 1 << 20  # points per chunk
+
+
+def lerp(a, b, weight, out, chunk_size=CHUNK_SIZE):
+    """
+    out = a + weight * (b - a), computed in chunks so the only temporary is one chunk.
+
+    :param a: (np.ndarray)
+        volume at weight 0
+    :param b: (np.ndarray)
+        volume at weight 1, same shape as a
+    :param weight: (float)
+        position between a and b, in [0, 1]
+    :param out: (np.ndarray)
+        C-contiguous output, same shape as a
+    :return: (np.ndarray)
+        out
+    """
+    a_flat, b_flat, out_flat = a.reshape(-1), b.reshape(-1), out.reshape(-1)
+    for start in range(0, out_flat.size, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        np.subtract(b_flat[chunk], a_flat[chunk], out=out_flat[chunk])
+        out_flat[chunk] *= weight
+        out_flat[chunk] += a_flat[chunk]
+    return out
+
+
+class TemporalInterpolator(object):
+    """
+    Synthesize volumes between unevenly spaced timesteps, weighted by the simulation
+    time in their filenames (see timestep_time).
+
+    frames(step) names frames at a constant simulated-time step; load() builds the
+    volume of a frame from its two neighbouring timesteps. It has the load() interface
+    of VolumeCache, so it plugs into AsteroidVTK(cache=...):
+
+        interpolator = TemporalInterpolator(sourcefiles, 'v03')
+        ast = AsteroidVTK(cache=interpolator)
+        for frame in interpolator.frames(step=100):
+            ast.render_all(frame, outfolder, 'v03')
+
+    Peak memory is the two neighbouring volumes plus the output volume.
+    """
+
+    def __init__(self, sourcefiles, attribute, cache=None, chunk_size=CHUNK_SIZE):
+        """
+        :param sourcefiles: (list of str)
+            .vti timesteps
+        :param attribute: (str)
+            data array to interpolate
+        :param cache: (VolumeCache)
+            read memory-mapped arrays instead of decoding the .vti
+        :param chunk_size: (int)
+            points interpolated per vectorized operation
+        """
+        self.sourcefiles = sorted(sourcefiles, key=timestep_time)
+        self.times = np.array([timestep_time(sourcefile) for sourcefile in self.sourcefiles], dtype=np.float64)
+        self.attribute = attribute
+        self.cache = cache
+        self.chunk_size = chunk_size
+
+        self._frames = dict()  # frame name -> simulation time
+        self._neighbours = dict()  # timestep index -> (data, origin, spacing), at most two
+        self._out = None
+
+    def frames(self, step):
+        """
+        :param step: (float)
+            simulation time between frames
+        :return: (list of str)
+            frame names, usable as sourcefile with AsteroidVTK(cache=self)
+        """
+        folder = os.path.dirname(self.sourcefiles[0])
+        names = []
+        for index, time in enumerate(np.arange(self.times[0], self.times[-1] + step / 2.0, step)):
+            time = min(time, self.times[-1])
+            name = os.path.join(folder, 'interpolated_{0:05d}-f{1:04d}.vti'.format(int(round(time)), index))
+            self._frames[name] = time
+            names.append(name)
+        return names
+
+    def _timestep(self, index):
+        """
+        :return: (np.ndarray, tuple, tuple)
+            (z, y, x) data, origin and spacing of a timestep, keeping only the last two read
+        """
+        if index not in self._neighbours:
+            for stale in [key for key in self._neighbours if abs(key - index) > 1]:
+                del self._neighbours[stale]
+            sourcefile = self.sourcefiles[index]
+            if self.cache is not None:
+                header = self.cache.header(sourcefile)
+                data = self.cache.load_array(sourcefile, self.attribute)
+                self._neighbours[index] = (data, header['origin'], header['spacing'])
+            else:
+                image = read_vti(sourcefile, self.attribute)
+                dimensions = image.GetDimensions()
+                # vtk_to_numpy keeps the VTK array alive through the buffer it wraps
+                data = VN.vtk_to_numpy(image.GetPointData().GetArray(self.attribute))
+                data = data.reshape(tuple(reversed(dimensions)))
+                self._neighbours[index] = (data, image.GetOrigin(), image.GetSpacing())
+        return self._neighbours[index]
+
+    def load(self, sourcefile, attribute):
+        """
+        :param sourcefile: (str)
+            frame name from frames()
+        :param attribute: (str)
+            must be the interpolated attribute
+        :return: (vtkImageData)
+        """
+        if attribute != self.attribute:
+            raise ValueError('Interpolating {0}, not {1}'.format(self.attribute, attribute))
+        time = self._frames[sourcefile]
+        upper = min(max(int(np.searchsorted(self.times, time, side='right')), 1), len(self.times) - 1)
+        lower = upper - 1
+        weight = (time - self.times[lower]) / (self.times[upper] - self.times[lower])
+        a, origin, spacing = self._timestep(lower)
+        b = self._timestep(upper)[0]
+
+        # Reuse the output buffer: the previous frame has been rendered by the time the next one loads
+        dtype = np.result_type(a, np.float32)
+        if self._out is None or self._out.shape != a.shape or self._out.dtype != dtype:
+            self._out = np.empty(a.shape, dtype=dtype)
+        lerp(a, b, weight, self._out, self.chunk_size)
+        return wrap_image(self._out, attribute, origin, spacing)
+
+
+# from src.interpolate import render_interpolated; render_interpolated('D:/Downloads/Asteroid Ensemble - Airburst/')
+def render_interpolated(root_folder, attribute='v03', step=100.0, modes=tuple(RENDER_MODES),
+                        images=AIRBURST, cache=None, **ast_options):
+    """
+    Render a constant simulated-time animation of the series.
+
+    :param root_folder: (str)
+        folder holding the .vti timesteps, images go to <root_folder>/output/interpolated/<mode>/
+    :param attribute: (str)
+        data array to interpolate and render
+    :param step: (float)
+        simulation time between frames
+    :param modes: (tuple)
+        keys of RENDER_MODES
+    :param cache: (VolumeCache)
+        read memory-mapped arrays instead of decoding the .vti
+    :param ast_options:
+        extra AsteroidVTK arguments, e.g. stats=index, stable_range=True
+    """
+    interpolator = TemporalInterpolator([os.path.join(root_folder, image) for image in images], attribute, cache)
+    ast = AsteroidVTK(cache=interpolator, **ast_options)
+    outfolder = os.path.join(root_folder, 'output', 'interpolated')
+    frames = interpolator.frames(step)
+    for i, frame in enumerate(frames):
+        print('Processing interpolated frame: {0} of {1}'.format(i, len(frames)))
+        ast.render_all(frame, outfolder, attribute, modes)
+    ast.flush()
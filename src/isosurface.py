@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import vtk
+import vtk.util.numpy_support as VN
+
+from src.cache import entry_name, wrap_image
+
+# Contour algorithms for image data, fastest first
+CONTOUR_FILTERS = ('vtkFlyingEdges3D', 'vtkSynchronizedTemplates3D', 'vtkContourFilter')
+
+BLOCK_SIZE = 16
+
+# Size and mtime of the source file an isosurface cache entry was extracted from
+SOURCE = 'source.json'
+
+
+def create_contour_filter():
+    """
+    :return: (vtkAlgorithm)
+        fastest isosurface algorithm available in this VTK build
+    """
+    for name in CONTOUR_FILTERS:
+        contour_class = getattr(vtk, name, None)
+        if contour_class is not None:
+            return contour_class()
+
+
+def block_ranges(data, block_size=BLOCK_SIZE, widen=True):
+    """
+    Min/max index of a volume, one entry per block of block_size^3 points, reduced
+    one slab of block_size z planes at a time so the temporaries stay small.
+
+    Cells on a block border also use the first point of the next block, so by default
+    every block range is widened with its neighbours: a block whose range does not
+    contain an iso value is guaranteed to hold none of that isosurface.
+
+    :param data: (np.ndarray)
+        (z, y, x) volume, e.g. memory-mapped from the VolumeCache
+    :param block_size: (int)
+        points along each edge of a block, the last blocks may be smaller
+    :param widen: (bool)
+        include the first points of the next block along each axis
+    :return: (np.ndarray, np.ndarray)
+        (bz, by, bx) block minimum and maximum
+    """
+    depth, height, width = data.shape[:3]
+    rows, columns = np.arange(0, height, block_size), np.arange(0, width, block_size)
+    shape = (len(range(0, depth, block_size)), len(rows), len(columns))
+    block_min, block_max = np.empty(shape, data.dtype), np.empty(shape, data.dtype)
+    for k, z0 in enumerate(range(0, depth, block_size)):
+        slab = np.asarray(data[z0:z0 + block_size])
+        for out, reduce in ((block_min, np.minimum), (block_max, np.maximum)):
+            plane = reduce.reduce(slab, axis=0)
+            out[k] = reduce.reduceat(reduce.reduceat(plane, rows, axis=0), columns, axis=1)
+    if not widen:
+        return block_min, block_max
+    for axis in range(3):
+        lower = [slice(None)] * 3
+        upper = [slice(None)] * 3
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        block_min[tuple(lower)] = np.minimum(block_min[tuple(lower)], block_min[tuple(upper)])
+        block_max[tuple(lower)] = np.maximum(block_max[tuple(lower)], block_max[tuple(upper)])
+    return block_min, block_max
+
+
+def active_slabs(block_min, block_max, value, block_size=BLOCK_SIZE):
+    """
+    Point extents covering every block that can contain the iso value.
+
+    Consecutive active z-blocks are merged into one slab, cropped in x/y to their
+    active blocks, so slabs never share cells and the pieces join without seams.
+
+    :return: (list of tuple)
+        (minX, maxX, minY, maxY, minZ, maxZ) per slab, in block-relative point indices
+    """
+    active = (block_min <= value) & (block_max >= value)
+    slabs = []
+    z_blocks = np.flatnonzero(active.any(axis=(1, 2)))
+    if not len(z_blocks):
+        return slabs
+    runs = np.split(z_blocks, np.flatnonzero(np.diff(z_blocks) > 1) + 1)
+    for run in runs:
+        footprint = active[run[0]:run[-1] + 1].any(axis=0)
+        y_blocks = np.flatnonzero(footprint.any(axis=1))
+        x_blocks = np.flatnonzero(footprint.any(axis=0))
+        slabs.append((x_blocks[0] * block_size, (x_blocks[-1] + 1) * block_size,
+                       y_blocks[0] * block_size, (y_blocks[-1] + 1) * block_size,
+                       run[0] * block_size, (run[-1] + 1) * block_size))
+    return slabs
+
+
+def extract_isosurface(image, attribute, value, ranges=None):
+    """
+    Isosurface of an image, contouring only the slabs whose blocks can contain the value.
+
+    :param image: (vtkImageData)
+        image holding the attribute as point data
+    :param attribute: (str)
+        data array to contour
+    :param value: (float)
+        iso value
+    :param ranges: (np.ndarray, np.ndarray)
+        precomputed block_ranges() of the attribute
+    :return: (vtkPolyData)
+    """
+    dimensions = image.GetDimensions()
+    data = VN.vtk_to_numpy(image.GetPointData().GetArray(attribute)).reshape(tuple(reversed(dimensions)))
+    if ranges is None:
+        ranges = block_ranges(data)
+
+    append = vtk.vtkAppendPolyData()
+    spacing = image.GetSpacing()
+    for x0, x1, y0, y1, z0, z1 in active_slabs(ranges[0], ranges[1], value):
+        slab = np.ascontiguousarray(data[z0:z1 + 1, y0:y1 + 1, x0:x1 + 1])
+        origin = [o + i * d for o, i, d in zip(image.GetOrigin(), (x0, y0, z0), spacing)]
+        contour = create_contour_filter()
+        contour.SetInputData(wrap_image(slab, attribute, origin, spacing))
+        contour.SetValue(0, value)
+        contour.Update()
+        append.AddInputData(contour.GetOutput())
+    if not append.GetNumberOfInputConnections(0):
+        return vtk.vtkPolyData()
+    append.Update()
+    return append.GetOutput()
+
+
+class IsosurfaceCache(object):
+    """
+    Extracted isosurfaces stored on disk, keyed by (file, attribute, iso value):
+
+        <cache_folder>/<timestep>-<path hash>/source.json
+        <cache_folder>/<timestep>-<path hash>/<attribute>_<value>.vtp
+        <cache_folder>/<timestep>-<path hash>/<attribute>_blocks.npz
+
+    Meshes are binary appended XML polydata. An entry is emptied and extracted
+    again when the size or mtime of its source file changes, as in VolumeCache.
+    """
+
+    def __init__(self, cache_folder):
+        """
+        :param cache_folder: (str)
+            folder holding one sub-folder per timestep
+        """
+        self.cache_folder = cache_folder
+
+    def _entry(self, sourcefile):
+        """
+        :return: (str)
+            entry folder of the source file, emptied if the file changed since it was filled
+        """
+        entry = os.path.join(self.cache_folder, entry_name(sourcefile))
+        stat = os.stat(sourcefile)
+        source = {'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+        path = os.path.join(entry, SOURCE)
+        if os.path.exists(path):
+            with open(path) as handle:
+                if json.load(handle) == source:
+                    return entry
+            shutil.rmtree(entry, ignore_errors=True)
+        os.makedirs(entry, exist_ok=True)
+        partial = '{0}.{1}.partial'.format(path, os.getpid())
+        with open(partial, 'w') as handle:
+            json.dump(source, handle)
+        os.replace(partial, path)
+        return entry
+
+    def block_ranges(self, sourcefile, attribute, image):
+        """
+        :return: (np.ndarray, np.ndarray)
+            block min/max index of the attribute, computed on first use
+        """
+        path = os.path.join(self._entry(sourcefile), '{0}_blocks.npz'.format(attribute))
+        if os.path.exists(path):
+            with np.load(path) as blocks:
+                return blocks['min'], blocks['max']
+        dimensions = image.GetDimensions()
+        data = VN.vtk_to_numpy(image.GetPointData().GetArray(attribute)).reshape(tuple(reversed(dimensions)))
+        block_min, block_max = block_ranges(data)
+        partial = '{0}.{1}.partial'.format(path, os.getpid())
+        with open(partial, 'wb') as handle:
+            np.savez(handle, min=block_min, max=block_max)
+        os.replace(partial, path)
+        return block_min, block_max
+
+    def load(self, sourcefile, attribute, value, image):
+        """
+        :param sourcefile: (str)
+            .vti timestep the image was loaded from
+        :param attribute: (str)
+            data array to contour
+        :param value: (float)
+            iso value
+        :param image: (vtkImageData)
+            loaded timestep, only used when the mesh is not cached yet
+        :return: (vtkPolyData)
+        """
+        path = os.path.join(self._entry(sourcefile), '{0}_{1}.vtp'.format(attribute, value))
+        if os.path.exists(path):
+            reader = vtk.vtkXMLPolyDataReader()
+            reader.SetFileName(path)
+            reader.Update()
+            return reader.GetOutput()
+
+        mesh = extract_isosurface(image, attribute, value, self.block_ranges(sourcefile, attribute, image))
+        partial = '{0}.{1}.partial'.format(path, os.getpid())
+        writer = vtk.vtkXMLPolyDataWriter()
+        writer.SetInputData(mesh)
+        writer.SetDataModeToAppended()
+        writer.EncodeAppendedDataOff()
+        writer.SetFileName(partial)
+        writer.Write()
+        os.replace(partial, path)
+        return mesh
@@ -1,27 +1,18 @@
+import os
 import vtk
 import numpy as np
 import vtk.util.numpy_support as VN
 from vtk.util.misc import vtkGetDataRoot
-from urllib.request import urlopen
 from vtk import vtkCamera
-import re
-urlString = 'http://oceans11.lanl.gov/deepwaterimpact/yA31/300x300x300-FourScalars_resolution/'
-urlpath = urlopen(urlString)
-string = urlpath.read().decode('utf-8')
+from src.ingest import LANL_URL, ingest
+urlString = LANL_URL
 
-pattern = re.compile('[a-z0-9_]*.vti"')  # the pattern actually creates duplicates in the list
-
-filelist = pattern.findall(string)
 daryName = 'v02'  # 'v03' 'prs' 'tev'
 fileCounter = 1
-for filename in filelist:
-    filename = filename[:-1]
+# Timesteps are streamed to Output/ and each one is rendered while the next downloads
+for localfile in ingest('Output/', urlString):
+    filename = os.path.basename(localfile)
     print(filename)
-    remotefile = (urlString + filename)
-    localfile = open('Output/TempFile', 'wb')
-    localfile.write(remotefile.read())
-    localfile.close()
-    remotefile.close()
 # This example shows how to run direct volume rendering, setting the transfer function and show the color bar
 
 # the data used in this example can be download from
@@ -48,7 +39,7 @@ for filename in filelist:
     renWin.SetSize(800, 600)
 # Create the reader for the data
     reader = vtk.vtkXMLImageDataReader()
-    reader.SetFileName('Output/TempFile')
+    reader.SetFileName(localfile)
     reader.Update()
 
 # specify the data array in the file to process
@@ -0,0 +1,30 @@
+import numpy as np
+
+from src.isosurface import BLOCK_SIZE
+
+
+def occupied_extent(minima, maxima, low, high, shape, block_size=BLOCK_SIZE, margin=1):
+    """
+    Bounding box of the blocks holding any value in the open interval (low, high).
+
+    :param minima: (np.ndarray)
+        block minima of isosurface.block_ranges, widened or not
+    :param maxima: (np.ndarray)
+        block maxima of isosurface.block_ranges
+    :param low: (float)
+        values at or below are fully transparent
+    :param high: (float)
+        values at or above are fully transparent
+    :param shape: (tuple)
+        (z, y, x) points of the volume
+    :param margin: (int)
+        points added around the blocks, for samples interpolated across their faces
+    :return: (tuple)
+        VTK extent (minX, maxX, minY, maxY, minZ, maxZ), None if every block is transparent
+    """
+    occupied = np.argwhere((maxima > low) & (minima < high))
+    if not len(occupied):
+        return None
+    first = np.maximum(occupied.min(axis=0) * block_size - margin, 0)
+    last = np.minimum((occupied.max(axis=0) + 1) * block_size - 1 + margin, np.array(shape[:3]) - 1)
+    return tuple(int(value) for axis in (2, 1, 0) for value in (first[axis], last[axis]))
@@ -0,0 +1,133 @@
+import collections
+import threading
+
+import numpy as np
+
+from src.cache import read_vti, wrap_image
+
+
+class Prefetcher(object):
+    """
+    Decode upcoming timesteps on a background thread while the current one renders.
+
+    Iterating yields the timesteps in order, each one already decoded. While a
+    timestep is current, load() returns its image without touching the disk, so
+    the Prefetcher can be handed to AsteroidVTK in place of a VolumeCache:
+
+        prefetcher = Prefetcher(sourcefiles, 'v03')
+        ast = AsteroidVTK(cache=prefetcher)
+        for sourcefile in prefetcher:
+            ast.render_all(sourcefile, outfolder, 'v03')
+
+    VTK releases the GIL while decoding, so the reads overlap with rendering.
+    """
+
+    def __init__(self, sourcefiles, attribute=None, lookahead=2, max_bytes=None, cache=None):
+        """
+        :param sourcefiles: (list of str)
+            .vti timesteps in render order
+        :param attribute: (str)
+            only decode this data array, None for all of them
+        :param lookahead: (int)
+            decoded timesteps kept ready ahead of the current one
+        :param max_bytes: (int)
+            stop reading ahead once the ready timesteps use this much memory;
+            the timestep in flight may exceed it, the current one is not counted
+        :param cache: (VolumeCache)
+            read memory-mapped arrays (requires attribute) instead of the .vti
+        """
+        if cache is not None and attribute is None:
+            raise ValueError('Prefetching from the cache needs an attribute')
+        self.sourcefiles = list(sourcefiles)
+        self.attribute = attribute
+        self.lookahead = max(1, lookahead)
+        self.max_bytes = max_bytes
+        self.cache = cache
+        self.current = (None, None)
+
+        self._condition = threading.Condition()
+        self._ready = collections.deque()
+        self._bytes = 0
+        self._error = None
+        self._stopped = False
+
+    def _read(self, sourcefile):
+        """
+        :return: (vtkImageData)
+            image owned by the caller
+        """
+        if self.cache is not None:
+            # Copy out of the memory map so the render never waits on page faults
+            data = np.array(self.cache.load_array(sourcefile, self.attribute))
+            header = self.cache.header(sourcefile)
+            return wrap_image(data, self.attribute, header['origin'], header['spacing'])
+
+        return read_vti(sourcefile, self.attribute)
+
+    def _is_full(self):
+        if not self._ready:
+            return False
+        if len(self._ready) >= self.lookahead:
+            return True
+        return self.max_bytes is not None and self._bytes >= self.max_bytes
+
+    def _produce(self):
+        try:
+            for sourcefile in self.sourcefiles:
+                with self._condition:
+                    while self._is_full() and not self._stopped:
+                        self._condition.wait()
+                    if self._stopped:
+                        return
+                image = self._read(sourcefile)
+                size = image.GetActualMemorySize() * 1024
+                with self._condition:
+                    self._ready.append((sourcefile, image, size))
+                    self._bytes += size
+                    self._condition.notify_all()
+        except Exception as error:
+            with self._condition:
+                self._error = error
+                self._condition.notify_all()
+
+    def __iter__(self):
+        self._ready.clear()
+        self._bytes = 0
+        self._error = None
+        self._stopped = False
+        thread = threading.Thread(target=self._produce, daemon=True)
+        thread.start()
+        try:
+            for _ in self.sourcefiles:
+                with self._condition:
+                    while not self._ready and self._error is None:
+                        self._condition.wait()
+                    if not self._ready:
+                        raise self._error
+                    sourcefile, image, size = self._ready.popleft()
+                    self._bytes -= size
+                    self._condition.notify_all()
+                self.current = (sourcefile, image)
+                yield sourcefile
+        finally:
+            with self._condition:
+                self._stopped = True
+                self._condition.notify_all()
+            thread.join()
+            self.current = (None, None)
+
+    def load(self, sourcefile, attribute):
+        """
+        :param sourcefile: (str)
+            .vti timestep
+        :param attribute: (str)
+            data array to render
+        :return: (vtkImageData)
+            the prefetched image of the current timestep, otherwise read now
+        """
+        current, image = self.current
+        if current == sourcefile and (self.attribute is None or self.attribute == attribute):
+            return image
+        if self.cache is not None:
+            return self.cache.load(sourcefile, attribute)
+        return read_vti(sourcefile, attribute)
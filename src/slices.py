@@ -0,0 +1,84 @@
+import numpy as np
+
+from src.writer import encode_png
+
+# Axis of the (z, y, x) volume that each plane cuts across
+PLANES = {'xy': 0, 'xz': 1, 'yz': 2}
+
+
+def cut_plane(data, plane='xy', index=None):
+    """
+    :param data: (np.ndarray)
+        (z, y, x) volume
+    :param plane: (str)
+        key of PLANES
+    :param index: (int)
+        position of the plane along its normal axis, defaults to the middle
+        (z=150 of the 300^3 grid for 'xy', like the 3D slice actor)
+    :return: (np.ndarray)
+        2D view, first row at the bottom: (y, x) for xy, (z, x) for xz, (z, y) for yz
+    """
+    if plane not in PLANES:
+        raise ValueError('Unknown plane: {0}'.format(plane))
+    axis = PLANES[plane]
+    if index is None:
+        index = data.shape[axis] // 2
+    return np.take(data, index, axis=axis)
+
+
+def color_plane(plane, table, min_value, max_value):
+    """
+    Map values to colors in one array operation, the same mapping as vtkLookupTable.GetIndex:
+    len(table) equal bins over [min, max], values outside clamped to the first and last color.
+
+    :param plane: (np.ndarray)
+        2D values
+    :param table: (np.ndarray)
+        (colors, 3 or 4) uint8 table, e.g. of AsteroidVTK._build_slice_lookup
+    :return: (np.ndarray)
+        (rows, columns, 3) uint8 image
+    """
+    scale = len(table) / max(max_value - min_value, np.finfo(np.float32).tiny)
+    index = np.clip((np.asarray(plane, dtype=np.float64) - min_value) * scale, 0, len(table) - 1).astype(np.intp)
+    return np.ascontiguousarray(table[index, :3])
+
+
+def slice_grid(images, columns=None, gap=4, background=128):
+    """
+    Tile images into one, left to right and top to bottom.
+
+    :param images: (list of np.ndarray)
+        (rows, columns, 3) uint8 images, first row at the bottom
+    :param columns: (int)
+        images per row, defaults to all in one row
+    :param gap: (int)
+        pixels between images
+    :param background: (int)
+        gray level of the gaps (128, the gray of the 3D renders)
+    :return: (np.ndarray)
+        (rows, columns, 3) uint8 image, first row at the bottom
+    """
+    columns = columns or len(images)
+    rows = [images[i:i + columns] for i in range(0, len(images), columns)]
+    cell_height = max(image.shape[0] for image in images)
+    cell_width = max(image.shape[1] for image in images)
+    height = len(rows) * cell_height + (len(rows) - 1) * gap
+    width = columns * cell_width + (columns - 1) * gap
+    grid = np.full((height, width, 3), background, dtype=np.uint8)
+    for r, row in enumerate(rows):
+        # Fill top down, images and grid are both stored bottom row first
+        top = height - r * (cell_height + gap)
+        for c, image in enumerate(row):
+            left = c * (cell_width + gap)
+            grid[top - image.shape[0]:top, left:left + image.shape[1]] = image
+    return grid
+
+
+def write_png(pixels, outfile, compression=5):
+    """
+    :param pixels: (np.ndarray)
+        (rows, columns, 3 or 4) uint8 image, first row at the bottom
+    :param outfile: (str)
+    """
+    with open(outfile, 'wb') as handle:
+        handle.write(encode_png(pixels, compression))
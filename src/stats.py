@@ -0,0 +1,163 @@
+import json
+import os
+
+import numpy as np
+import vtk
+import vtk.util.numpy_support as VN
+
+from src.airburst import AIRBURST, ATTRIBUTES
+
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+
+def compute_stats(data, bins=64):
+    """
+    Summary statistics of a data array.
+
+    :param data: (np.ndarray)
+        data array of any shape
+    :param bins: (int)
+        number of histogram bins between min and max
+    :return: (dict)
+        min, max, mean, percentiles and histogram
+    """
+    data = np.asarray(data).ravel()
+    # One partition places the min, the max and the values around every percentile
+    #   rank, interpolated linearly between them like np.percentile
+    positions = np.array(PERCENTILES) / 100.0 * (data.size - 1)
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.minimum(lower + 1, data.size - 1)
+    ordered = np.partition(data, np.unique(np.concatenate(([0, data.size - 1], lower, upper))))
+    min_value, max_value = float(ordered[0]), float(ordered[-1])
+    below, above = ordered[lower].astype(np.float64), ordered[upper].astype(np.float64)
+    percentiles = below + (above - below) * (positions - lower)
+    counts, edges = np.histogram(data, bins=bins, range=(min_value, max_value))
+    return {
+        'min': min_value,
+        'max': max_value,
+        'mean': float(data.mean(dtype=np.float64)),
+        'percentiles': dict(zip(map(str, PERCENTILES), percentiles.tolist())),
+        'histogram': {'counts': counts.tolist(), 'edges': edges.tolist()},
+    }
+
+
+class JsonIndex(object):
+    """
+    Per timestep entries stored as one JSON file alongside the data.
+
+        {timestep: {'source_size': int, 'source_mtime': float, ...}}
+
+    Entries whose source file changed size or mtime are treated as missing.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: (str)
+            JSON index file, loaded if it exists
+        """
+        self.path = path
+        self.entries = dict()
+        if os.path.exists(path):
+            with open(path) as handle:
+                self.entries = json.load(handle)
+
+    def save(self):
+        partial = self.path + '.partial'
+        with open(partial, 'w') as handle:
+            json.dump(self.entries, handle)
+        os.replace(partial, self.path)
+
+    def _valid_entry(self, sourcefile):
+        entry = self.entries.get(os.path.basename(sourcefile))
+        if entry is None or not os.path.exists(sourcefile):
+            return entry
+        stat = os.stat(sourcefile)
+        if entry['source_size'] != stat.st_size or entry['source_mtime'] != stat.st_mtime:
+            return None
+        return entry
+
+    def _set_entry(self, sourcefile, **fields):
+        stat = os.stat(sourcefile)
+        self.entries[os.path.basename(sourcefile)] = dict(source_size=stat.st_size, source_mtime=stat.st_mtime,
+                                                          **fields)
+
+
+class StatsIndex(JsonIndex):
+    """
+    Per (timestep, attribute) statistics, stored as JSON alongside the data.
+
+        {timestep: {'source_size': int, 'source_mtime': float, 'attributes': {attribute: stats}}}
+    """
+
+    def get(self, sourcefile, attribute):
+        """
+        :return: (dict)
+            statistics of the attribute, None if not indexed or stale
+        """
+        entry = self._valid_entry(sourcefile)
+        if entry is None:
+            return None
+        return entry['attributes'].get(attribute)
+
+    def add(self, sourcefile, arrays, bins=64):
+        """
+        Index one timestep.
+
+        :param sourcefile: (str)
+            .vti timestep
+        :param arrays: (dict)
+            attribute -> data array
+        """
+        self._set_entry(sourcefile, attributes={name: compute_stats(data, bins) for name, data in arrays.items()})
+
+    def global_range(self, attribute):
+        """
+        :return: (float, float)
+            min and max of the attribute over every indexed timestep
+        """
+        ranges = [(entry['attributes'][attribute]['min'], entry['attributes'][attribute]['max'])
+                  for entry in self.entries.values() if attribute in entry['attributes']]
+        if not ranges:
+            raise KeyError('No statistics indexed for {0}'.format(attribute))
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+
+def _read_arrays(sourcefile, attributes, cache=None):
+    """
+    :return: (dict)
+        attribute -> data array, from a single decode of the timestep
+    """
+    if cache is not None:
+        return {attribute: cache.load_array(sourcefile, attribute) for attribute in attributes}
+    reader = vtk.vtkXMLImageDataReader()
+    reader.SetFileName(sourcefile)
+    reader.Update()
+    point_data = reader.GetOutput().GetPointData()
+    return {attribute: VN.vtk_to_numpy(point_data.GetArray(attribute)) for attribute in attributes}
+
+
+# from src.stats import build_index; build_index('D:/Downloads/Asteroid Ensemble - Airburst/')
+def build_index(root_folder, images=AIRBURST, attributes=ATTRIBUTES, cache=None, bins=64):
+    """
+    Index every timestep that is missing or stale in <root_folder>/stats.json.
+
+    :param root_folder: (str)
+        folder holding the .vti timesteps
+    :param images: (tuple)
+        timestep filenames relative to root_folder
+    :param attributes: (tuple)
+        data arrays to index
+    :param cache: (VolumeCache)
+        read the arrays from the binary cache instead of the .vti
+    :return: (StatsIndex)
+    """
+    index = StatsIndex(os.path.join(root_folder, 'stats.json'))
+    total_images = len(images)
+    for i, image in enumerate(images):
+        sourcefile = os.path.join(root_folder, image)
+        if all(index.get(sourcefile, attribute) is not None for attribute in attributes):
+            continue
+        print('Indexing statistics: {0} of {1}'.format(i, total_images))
+        index.add(sourcefile, _read_arrays(sourcefile, attributes, cache), bins)
+        index.save()
+    return index
@@ -0,0 +1,268 @@
+import itertools
+import json
+import os
+import zlib
+
+import numpy as np
+import vtk.util.numpy_support as VN
+
+from src.airburst import ATTRIBUTES
+from src.cache import read_vti, wrap_image
+
+STORE_HEADER = 'store.json'
+
+# (t, z, y, x) points per chunk
+CHUNKS = (1, 64, 64, 64)
+
+
+def _write(path, data):
+    partial = '{0}.{1}.partial'.format(path, os.getpid())
+    with open(partial, 'wb') as handle:
+        handle.write(data)
+    os.replace(partial, path)
+
+
+def encode_chunk(data, level=1, shuffle=True):
+    """
+    :param data: (np.ndarray)
+        chunk to compress
+    :param level: (int)
+        zlib level, 1 favours speed
+    :param shuffle: (bool)
+        group the bytes of every value by significance first (as HDF5/Blosc shuffle),
+        which makes float data far more compressible
+    :return: (bytes)
+    """
+    data = np.ascontiguousarray(data)
+    if shuffle and data.dtype.itemsize > 1:
+        data = data.view(np.uint8).reshape(-1, data.dtype.itemsize).T
+    return zlib.compress(np.ascontiguousarray(data).tobytes(), level)
+
+
+def decode_chunk(payload, dtype, shape, shuffle=True):
+    """
+    :return: (np.ndarray)
+        chunk of the given dtype and shape, inverse of encode_chunk
+    """
+    dtype = np.dtype(dtype)
+    data = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+    if shuffle and dtype.itemsize > 1:
+        data = np.ascontiguousarray(data.reshape(dtype.itemsize, -1).T)
+    return data.view(dtype).reshape(shape)
+
+
+class ChunkedStore(object):
+    """
+    A series of timesteps as one chunked, compressed (t, z, y, x[, components])
+    array per attribute, in a folder laid out like a Zarr directory store:
+
+        <folder>/store.json
+        <folder>/<attribute>/<t>.<z>.<y>.<x>     one zlib-compressed chunk
+
+    Reads only decode the chunks they touch: a slice, a volume of interest or
+    the time series of one point. It has the load() interface of VolumeCache,
+    so AsteroidVTK(cache=ChunkedStore(folder)) renders from the store; with
+    AsteroidVTK(voi=..., stride=...) only the chunks of the preview are read.
+    """
+
+    def __init__(self, folder):
+        """
+        :param folder: (str)
+            store written by convert_series
+        """
+        self.folder = folder
+        with open(os.path.join(folder, STORE_HEADER)) as handle:
+            self.header_data = json.load(handle)
+        self.timesteps = self.header_data['timesteps']
+        self.shape = tuple(self.header_data['shape'])
+        self.chunks = tuple(self.header_data['chunks'])
+        self._index = {name: t for t, name in enumerate(self.timesteps)}
+
+    @property
+    def attributes(self):
+        return list(self.header_data['arrays'])
+
+    def index(self, sourcefile):
+        """
+        :param sourcefile: (str)
+            .vti timestep, only its file name is used
+        :return: (int)
+            t index in the store
+        """
+        name = os.path.basename(sourcefile)
+        if name not in self._index:
+            raise KeyError('{0} is not in the store {1}'.format(name, self.folder))
+        return self._index[name]
+
+    def read(self, attribute, t, z=None, y=None, x=None):
+        """
+        Read a region, indexing like numpy: integers drop their axis, slices keep it.
+
+        :param attribute: (str)
+            data array to read
+        :param t, z, y, x: (int or slice)
+            index along each axis, None for all of it
+        :return: (np.ndarray)
+            e.g. read('v03', 8, z=150) is the middle XY plane of timestep 8
+        """
+        array = self.header_data['arrays'][attribute]
+        keys = [slice(None) if key is None else key for key in (t, z, y, x)]
+        bounds, post = [], []
+        for key, size in zip(keys, self.shape):
+            if isinstance(key, slice):
+                start, stop, step = key.indices(size)
+                if step < 0:
+                    raise ValueError('Negative steps are not supported')
+                bounds.append((start, max(start, stop)))
+                post.append(slice(None, None, step))
+            else:
+                index = key + size if key < 0 else key
+                if not 0 <= index < size:
+                    raise IndexError('Index {0} out of range for size {1}'.format(key, size))
+                bounds.append((index, index + 1))
+                post.append(0)
+
+        extra = tuple(array['components'])
+        out = np.empty(tuple(stop - start for start, stop in bounds) + extra, dtype=array['dtype'])
+        ranges = [range(start // chunk, (stop - 1) // chunk + 1) if stop > start else range(0)
+                  for (start, stop), chunk in zip(bounds, self.chunks)]
+        for chunk_index in itertools.product(*ranges):
+            chunk = self._read_chunk(attribute, chunk_index)
+            source, target = [], []
+            for i, (start, stop), size in zip(chunk_index, bounds, self.chunks):
+                low, high = max(start, i * size), min(stop, (i + 1) * size)
+                source.append(slice(low - i * size, high - i * size))
+                target.append(slice(low - start, high - start))
+            out[tuple(target)] = chunk[tuple(source)]
+        return out[tuple(post)]
+
+    def _read_chunk(self, attribute, chunk_index):
+        array = self.header_data['arrays'][attribute]
+        shape = tuple(min(size, total - i * size) for i, size, total in zip(chunk_index, self.chunks, self.shape))
+        path = os.path.join(self.folder, attribute, '.'.join(str(i) for i in chunk_index))
+        with open(path, 'rb') as handle:
+            payload = handle.read()
+        return decode_chunk(payload, array['dtype'], shape + tuple(array['components']), self.header_data['shuffle'])
+
+    def timeseries(self, attribute, z, y, x):
+        """
+        :return: (np.ndarray)
+            values of one point over every timestep
+        """
+        return self.read(attribute, slice(None), z, y, x)
+
+    def header(self, sourcefile):
+        """
+        :return: (dict)
+            dimensions, origin and spacing of a timestep, as VolumeCache.header
+        """
+        self.index(sourcefile)
+        return {
+            'dimensions': list(reversed(self.shape[1:])),
+            'origin': self.header_data['origin'],
+            'spacing': self.header_data['spacing'],
+            'arrays': self.header_data['arrays'],
+        }
+
+    def load_array(self, sourcefile, attribute):
+        """
+        :return: (np.ndarray)
+            (z, y, x) volume of a timestep
+        """
+        return self.read(attribute, self.index(sourcefile))
+
+    def load(self, sourcefile, attribute):
+        """
+        :param sourcefile: (str)
+            .vti timestep converted into the store
+        :param attribute: (str)
+            data array to load
+        :return: (vtkImageData)
+        """
+        return wrap_image(self.load_array(sourcefile, attribute), attribute,
+                          self.header_data['origin'], self.header_data['spacing'])
+
+    def load_region(self, sourcefile, attribute, voi=None, stride=1):
+        """
+        Read only the chunks of a preview, see AsteroidVTK(voi=..., stride=...).
+
+        :param voi: (tuple)
+            (minX, maxX, minY, maxY, minZ, maxZ) point indices, None for the whole grid
+        :param stride: (int)
+            keep every stride-th point along each axis
+        :return: (vtkImageData)
+            preview image keeping the world coordinates of the full grid
+        """
+        depth, height, width = self.shape[1:]
+        x0, x1, y0, y1, z0, z1 = voi or (0, width - 1, 0, height - 1, 0, depth - 1)
+        data = self.read(attribute, self.index(sourcefile), slice(z0, z1 + 1, stride),
+                         slice(y0, y1 + 1, stride), slice(x0, x1 + 1, stride))
+        spacing = self.header_data['spacing']
+        origin = [o + i * d for o, i, d in zip(self.header_data['origin'], (x0, y0, z0), spacing)]
+        return wrap_image(np.ascontiguousarray(data), attribute, origin, [d * stride for d in spacing])
+
+
+# from src.store import convert_series; convert_series(['D:/.../pv_insitu_300x300x300_00000-ts00.vti', ...], 'store/')
+def convert_series(sourcefiles, folder, attributes=ATTRIBUTES, chunks=CHUNKS, level=1, shuffle=True):
+    """
+    Convert .vti timesteps of one grid into a ChunkedStore.
+
+    Each group of chunks[0] timesteps is decoded once for all attributes, so the
+    peak memory is chunks[0] timesteps. Chunks are written under temporary names
+    and store.json last, so an interrupted conversion never looks complete.
+
+    :param sourcefiles: (list of str)
+        .vti timesteps in time order
+    :param folder: (str)
+        store folder
+    :param attributes: (tuple)
+        point data arrays to store
+    :param chunks: (tuple)
+        (t, z, y, x) points per chunk; t > 1 speeds up time series, costs memory here
+    :param level: (int)
+        zlib level
+    :param shuffle: (bool)
+        byte-shuffle values before compressing, see encode_chunk
+    :return: (ChunkedStore)
+    """
+    sourcefiles = list(sourcefiles)
+    header = None
+    for group_start in range(0, len(sourcefiles), chunks[0]):
+        group = sourcefiles[group_start:group_start + chunks[0]]
+        volumes = {attribute: [] for attribute in attributes}
+        for sourcefile in group:
+            image = read_vti(sourcefile)
+            dimensions = image.GetDimensions()
+            if header is None:
+                header = {
+                    'timesteps': [os.path.basename(sourcefile) for sourcefile in sourcefiles],
+                    'shape': [len(sourcefiles)] + list(reversed(dimensions)),
+                    'chunks': list(chunks),
+                    'origin': image.GetOrigin(),
+                    'spacing': image.GetSpacing(),
+                    'codec': 'zlib',
+                    'level': level,
+                    'shuffle': shuffle,
+                    'arrays': {},
+                }
+            elif list(reversed(dimensions)) != header['shape'][1:]:
+                raise ValueError('{0} is not on the grid of the series'.format(sourcefile))
+            for attribute in attributes:
+                data = VN.vtk_to_numpy(image.GetPointData().GetArray(attribute))
+                volumes[attribute].append(data.reshape(tuple(reversed(dimensions)) + data.shape[1:]))
+                header['arrays'][attribute] = {'dtype': data.dtype.str, 'components': list(data.shape[1:])}
+
+        t = group_start // chunks[0]
+        for attribute, volume in volumes.items():
+            os.makedirs(os.path.join(folder, attribute), exist_ok=True)
+            volume = np.stack(volume)
+            for z in range(0, volume.shape[1], chunks[1]):
+                for y in range(0, volume.shape[2], chunks[2]):
+                    for x in range(0, volume.shape[3], chunks[3]):
+                        chunk = volume[:, z:z + chunks[1], y:y + chunks[2], x:x + chunks[3]]
+                        name = '{0}.{1}.{2}.{3}'.format(t, z // chunks[1], y // chunks[2], x // chunks[3])
+                        _write(os.path.join(folder, attribute, name), encode_chunk(chunk, level, shuffle))
+        print('Stored {0} of {1} timesteps'.format(min(group_start + chunks[0], len(sourcefiles)), len(sourcefiles)))
+
+    _write(os.path.join(folder, STORE_HEADER), json.dumps(header, indent=2).encode())
+    return ChunkedStore(folder)
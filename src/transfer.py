@@ -0,0 +1,226 @@
+import glob
+import json
+import os
+
+import numpy as np
+import vtk
+
+
+class TransferFunction(object):
+    """
+    Volume transfer function preset: color and opacity breakpoints at positions
+    relative to the data range (0 = min, 1 = max), so one preset serves every
+    frame; a fixed range (e.g. the global range of the series) pins it instead.
+
+    apply() fills an existing vtkVolumeProperty in place and only when the
+    preset or the range changed. Unchanged functions keep their modification
+    time, so the volume mappers keep the color/opacity tables they baked from
+    them; editing a preset updates the property without rebuilding a pipeline.
+    """
+
+    def __init__(self, name, color, opacity, shade=True, interpolation='linear', range=None):
+        """
+        :param name: (str)
+        :param color: (list of (float, float, float, float))
+            (position, red, green, blue) breakpoints, position in [0, 1]
+        :param opacity: (list of (float, float))
+            (position, opacity) breakpoints, position in [0, 1]
+        :param shade: (bool)
+            shaded (lit) volume
+        :param interpolation: (str)
+            'linear' or 'nearest'
+        :param range: (tuple)
+            fixed (min, max) that positions are relative to, None for the range of each frame
+        """
+        self.name = name
+        self.color = [tuple(point) for point in color]
+        self.opacity = [tuple(point) for point in opacity]
+        self.shade = shade
+        self.interpolation = interpolation
+        self.range = tuple(range) if range is not None else None
+        self.version = 0
+
+    def edit(self, **changes):
+        """
+        Change color, opacity, shade, interpolation or range; properties the
+        preset was applied to pick the change up on their next apply().
+        """
+        for key, value in changes.items():
+            if key not in ('color', 'opacity', 'shade', 'interpolation', 'range'):
+                raise ValueError('Unknown transfer function setting: {0}'.format(key))
+            if key in ('color', 'opacity'):
+                value = [tuple(point) for point in value]
+            elif key == 'range' and value is not None:
+                value = tuple(value)
+            setattr(self, key, value)
+        self.version += 1
+
+    def data_range(self, min_value, max_value):
+        """:return: (float, float) the range the breakpoints are relative to"""
+        return self.range if self.range is not None else (min_value, max_value)
+
+    def fill(self, transfer_color, transfer_opacity, min_value, max_value):
+        """
+        :param transfer_color: (vtkColorTransferFunction)
+        :param transfer_opacity: (vtkPiecewiseFunction)
+        """
+        min_value, max_value = self.data_range(min_value, max_value)
+        data_range = max_value - min_value
+        transfer_opacity.RemoveAllPoints()
+        for position, opacity in self.opacity:
+            transfer_opacity.AddPoint(min_value + position * data_range, opacity)
+        transfer_color.RemoveAllPoints()
+        for position, red, green, blue in self.color:
+            transfer_color.AddRGBPoint(min_value + position * data_range, red, green, blue)
+
+    def visible_range(self, min_value, max_value):
+        """
+        Values the opacity function can map above zero; the opacity outside the
+        breakpoints is clamped to the first and last one, as in VTK.
+
+        :return: (float, float)
+            open interval (low, high), values at or beyond its ends are fully
+            transparent; None if every value is
+        """
+        min_value, max_value = self.data_range(min_value, max_value)
+        points = sorted((min_value + position * (max_value - min_value), opacity)
+                        for position, opacity in self.opacity)
+        visible = [i for i, (_, opacity) in enumerate(points) if opacity > 0]
+        if not visible:
+            return None
+        low = points[visible[0] - 1][0] if visible[0] > 0 else -np.inf
+        high = points[visible[-1] + 1][0] if visible[-1] < len(points) - 1 else np.inf
+        return low, high
+
+    def create_property(self, min_value=0.0, max_value=1.0):
+        """
+        :return: (vtkVolumeProperty)
+            new property with its own color and opacity functions, filled from the preset
+        """
+        volume_property = vtk.vtkVolumeProperty()
+        volume_property.SetColor(vtk.vtkColorTransferFunction())
+        volume_property.SetScalarOpacity(vtk.vtkPiecewiseFunction())
+        self.apply(volume_property, min_value, max_value)
+        return volume_property
+
+    def apply(self, volume_property, min_value, max_value):
+        """
+        Fill a property's color and opacity functions, unless they already hold
+        this version of the preset over this range.
+
+        :param volume_property: (vtkVolumeProperty)
+        :return: (bool)
+            True if the property changed
+        """
+        key = (self.name, self.version) + tuple(self.data_range(float(min_value), float(max_value)))
+        if getattr(volume_property, '_transfer_key', None) == key:
+            return False
+        self.fill(volume_property.GetRGBTransferFunction(), volume_property.GetScalarOpacity(),
+                  min_value, max_value)
+        volume_property.SetShade(self.shade)
+        if self.interpolation == 'nearest':
+            volume_property.SetInterpolationTypeToNearest()
+        else:
+            volume_property.SetInterpolationTypeToLinear()
+        volume_property._transfer_key = key
+        return True
+
+    def bake(self, min_value=0.0, max_value=1.0, size=256):
+        """
+        Sample the preset into a lookup table, e.g. for numpy previews or color bars.
+
+        :param size: (int)
+            table entries over [min, max]
+        :return: (np.ndarray)
+            (size, 4) float32 RGBA table
+        """
+        transfer_color = vtk.vtkColorTransferFunction()
+        transfer_opacity = vtk.vtkPiecewiseFunction()
+        self.fill(transfer_color, transfer_opacity, min_value, max_value)
+        min_value, max_value = self.data_range(min_value, max_value)
+        colors = np.empty(size * 3, dtype=np.float32)
+        transfer_color.GetTable(min_value, max_value, size, colors)
+        opacities = np.empty(size, dtype=np.float32)
+        transfer_opacity.GetTable(min_value, max_value, size, opacities)
+        table = np.empty((size, 4), dtype=np.float32)
+        table[:, :3] = colors.reshape(size, 3)
+        table[:, 3] = opacities
+        return table
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'color': [list(point) for point in self.color],
+            'opacity': [list(point) for point in self.opacity],
+            'shade': self.shade,
+            'interpolation': self.interpolation,
+            'range': list(self.range) if self.range is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, preset):
+        return cls(preset['name'], preset['color'], preset['opacity'], preset.get('shade', True),
+                   preset.get('interpolation', 'linear'), preset.get('range'))
+
+    def save(self, path):
+        """:param path: (str) JSON preset file"""
+        partial = path + '.partial'
+        with open(partial, 'w') as handle:
+            json.dump(self.to_dict(), handle, indent=2)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        """:return: (TransferFunction) preset of a JSON file"""
+        with open(path) as handle:
+            return cls.from_dict(json.load(handle))
+
+
+# Built-in presets, positions relative to the range of each frame
+#   from src.transfer import PRESETS; PRESETS['airburst'].save('input/airburst_transfer.json')
+PRESETS = {
+    # Zero opacity below the mid range ramping up to the max; dark blue, green, red, dark red
+    'airburst': TransferFunction(
+        'airburst',
+        color=[(0.0, 0, 0, 0.2), (0.25, 0, 1.0, 0), (0.5, 0, 0.5, 0), (0.75, 1.0, 0, 0.0), (1.0, 0.2, 0, 0.0)],
+        opacity=[(0.0, 0.0), (0.5, 0.0), (1.0, 0.01)]),
+    # The same colors with the upper quarter more opaque, for thin high-value features
+    'airburst_core': TransferFunction(
+        'airburst_core',
+        color=[(0.0, 0, 0, 0.2), (0.25, 0, 1.0, 0), (0.5, 0, 0.5, 0), (0.75, 1.0, 0, 0.0), (1.0, 0.2, 0, 0.0)],
+        opacity=[(0.0, 0.0), (0.5, 0.0), (0.75, 0.01), (1.0, 0.2)]),
+    # White to blue like the slice and its color bar
+    'saturation': TransferFunction(
+        'saturation',
+        color=[(0.0, 1.0, 1.0, 1.0), (1.0, 0.0, 0.0, 1.0)],
+        opacity=[(0.0, 0.0), (0.1, 0.0), (1.0, 0.05)]),
+}
+
+
+def get_preset(transfer):
+    """
+    :param transfer: (str or TransferFunction)
+        key of PRESETS, path of a JSON preset, or a preset
+    :return: (TransferFunction)
+    """
+    if isinstance(transfer, TransferFunction):
+        return transfer
+    if transfer in PRESETS:
+        return PRESETS[transfer]
+    if transfer.lower().endswith('.json'):
+        return TransferFunction.load(transfer)
+    raise ValueError('Unknown transfer function preset: {0}'.format(transfer))
+
+
+def load_presets(folder):
+    """
+    :param folder: (str)
+        folder of JSON presets (see TransferFunction.save)
+    :return: (dict)
+        name -> TransferFunction, the built-in presets overridden by the files
+    """
+    presets = dict(PRESETS)
+    for path in sorted(glob.glob(os.path.join(folder, '*.json'))):
+        preset = TransferFunction.load(path)
+        presets[preset.name] = preset
+    return presets
@@ -0,0 +1,260 @@
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import vtk
+import vtk.util.numpy_support as VN
+
+# codec -> (file extension, VTK movie writer class name or None for the built-in AVI writer)
+VIDEO_CODECS = {
+    'mjpeg': ('.avi', None),
+    'raw': ('.avi', None),
+    'theora': ('.ogv', 'vtkOggTheoraWriter'),
+    'ffmpeg': ('.avi', 'vtkFFMPEGWriter'),
+}
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+
+
+def stream_name(outfile, extension):
+    """
+    Video that a frame belongs to: the frame name without its timestep tag, e.g.
+    output/iso/output_08415-ts08_side.png -> output/iso/output_side.avi
+
+    :param outfile: (str)
+        image name of the frame, see AsteroidVTK.render_all
+    :param extension: (str)
+        video file extension
+    :return: (str)
+    """
+    folder, name = os.path.split(outfile)
+    parts = os.path.splitext(name)[0].split('_')
+    if len(parts) > 1:
+        del parts[1]
+    return os.path.join(folder, '_'.join(parts) + extension)
+
+
+def _frame_image(pixels):
+    image = vtk.vtkImageData()
+    height, width, components = pixels.shape
+    image.SetDimensions(width, height, 1)
+    image.GetPointData().SetScalars(VN.numpy_to_vtk(pixels.reshape(-1, components)))
+    return image
+
+
+class AviStream(object):
+    """
+    Motion-JPEG or uncompressed (24-bit DIB) AVI written frame by frame.
+
+    Frames go to disk as they arrive; only the index is kept in memory and the
+    headers are completed by close().
+    """
+
+    def __init__(self, path, width, height, fps, codec='mjpeg', quality=90):
+        """
+        :param path: (str)
+            .avi file
+        :param width: (int)
+        :param height: (int)
+        :param fps: (float)
+            frames per second
+        :param codec: (str)
+            'mjpeg' or 'raw'
+        :param quality: (int)
+            JPEG quality, 0 to 100
+        """
+        self.path = path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.codec = codec
+        self.quality = quality
+        self.frames = 0
+        self._index = []
+        self._max_chunk = 0
+        self._handle = open(path + '.partial', 'wb')
+        self._write_headers()
+        self._movi = self._handle.tell() - 4  # index offsets count from the 'movi' fourcc
+
+    def _write_headers(self):
+        if self.codec == 'mjpeg':
+            handler, compression = b'MJPG', b'MJPG'
+        else:
+            handler, compression = b'DIB ', b'\x00\x00\x00\x00'  # BI_RGB
+        row_bytes = (self.width * 3 + 3) & ~3
+        avih = struct.pack('<14I', int(round(1e6 / self.fps)), 0, 0, AVIF_HASINDEX, self.frames, 0, 1,
+                           self._max_chunk, self.width, self.height, 0, 0, 0, 0)
+        strh = struct.pack('<4s4sIHHIIIIIIiI4H', b'vids', handler, 0, 0, 0, 0, 1000, int(round(self.fps * 1000)),
+                           0, self.frames, self._max_chunk, -1, 0, 0, 0, self.width, self.height)
+        strf = struct.pack('<IiiHH4sIiiII', 40, self.width, self.height, 1, 24, compression,
+                           row_bytes * self.height, 0, 0, 0, 0)
+        strl = b'strl' + self._chunk(b'strh', strh) + self._chunk(b'strf', strf)
+        hdrl = b'hdrl' + self._chunk(b'avih', avih) + self._chunk(b'LIST', strl)
+
+        self._handle.seek(0)
+        self._handle.write(b'RIFF' + struct.pack('<I', 0) + b'AVI ')
+        self._handle.write(self._chunk(b'LIST', hdrl))
+        self._handle.write(b'LIST' + struct.pack('<I', 0) + b'movi')
+
+    @staticmethod
+    def _chunk(kind, data):
+        return kind + struct.pack('<I', len(data)) + data + b'\x00' * (len(data) % 2)
+
+    def _encode(self, pixels):
+        if self.codec == 'mjpeg':
+            writer = vtk.vtkJPEGWriter()
+            writer.SetInputData(_frame_image(np.ascontiguousarray(pixels[..., :3])))
+            writer.SetQuality(self.quality)
+            writer.WriteToMemoryOn()
+            writer.Write()
+            return VN.vtk_to_numpy(writer.GetResult()).tobytes()
+        # Bottom-up BGR rows padded to 4 bytes, VTK's framebuffer is already bottom-up
+        row_bytes = (self.width * 3 + 3) & ~3
+        rows = np.zeros((self.height, row_bytes), dtype=np.uint8)
+        rows[:, :self.width * 3] = pixels[..., 2::-1].reshape(self.height, -1)
+        return rows.tobytes()
+
+    def write(self, pixels):
+        """
+        :param pixels: (np.ndarray)
+            (height, width, 3 or 4) uint8 frame, first row at the bottom as in VTK
+        """
+        if pixels.shape[:2] != (self.height, self.width):
+            raise ValueError('Frame of {0}x{1} in a {2}x{3} video: {4}'.format(
+                pixels.shape[1], pixels.shape[0], self.width, self.height, self.path))
+        data = self._encode(pixels)
+        self._index.append(struct.pack('<4sIII', b'00dc', AVIIF_KEYFRAME, self._handle.tell() - self._movi, len(data)))
+        self._handle.write(self._chunk(b'00dc', data))
+        self._max_chunk = max(self._max_chunk, len(data))
+        self.frames += 1
+
+    def close(self):
+        movi_end = self._handle.tell()
+        self._handle.write(self._chunk(b'idx1', b''.join(self._index)))
+        end = self._handle.tell()
+        # Complete the frame count and the RIFF/movi sizes now that they are known
+        self._write_headers()
+        self._handle.seek(4)
+        self._handle.write(struct.pack('<I', end - 8))
+        self._handle.seek(self._movi - 4)
+        self._handle.write(struct.pack('<I', movi_end - self._movi))
+        self._handle.close()
+        os.replace(self.path + '.partial', self.path)
+
+
+class MovieStream(object):
+    """A video written by one of VTK's movie writers (vtkOggTheoraWriter, vtkFFMPEGWriter)."""
+
+    def __init__(self, path, width, height, fps, codec='theora', quality=90):
+        writer_class = getattr(vtk, VIDEO_CODECS[codec][1], None)
+        if writer_class is None:
+            raise ValueError('This VTK build has no {0} writer'.format(codec))
+        self.path = path
+        self.width = width
+        self.height = height
+        self.frames = 0
+        self._image = vtk.vtkImageData()
+        self._image.SetDimensions(width, height, 1)
+        self._image.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 3)
+        self._pixels = VN.vtk_to_numpy(self._image.GetPointData().GetScalars()).reshape(height, width, 3)
+        self._writer = writer_class()
+        self._writer.SetInputData(self._image)
+        self._writer.SetFileName(path)
+        self._writer.SetRate(int(round(fps)))
+        self._writer.SetQuality(min(2, quality * 3 // 100))  # 0 (low) to 2 (high)
+        self._writer.Start()
+
+    def write(self, pixels):
+        if pixels.shape[:2] != (self.height, self.width):
+            raise ValueError('Frame of {0}x{1} in a {2}x{3} video: {4}'.format(
+                pixels.shape[1], pixels.shape[0], self.width, self.height, self.path))
+        self._pixels[...] = pixels[..., :3]
+        self._image.Modified()
+        self._writer.Write()
+        self.frames += 1
+
+    def close(self):
+        self._writer.End()
+
+
+class VideoWriter(object):
+    """
+    Output sink that streams frames into videos instead of writing PNGs.
+
+    It takes the place of an AsyncImageWriter (AsteroidVTK(image_writer=...)):
+    every frame is appended to the video of its frame name without the timestep
+    tag (see stream_name), so render_all(..., modes=('iso', 'volume')) over a
+    sweep produces output/iso/output.avi and output/volume/output.avi. Frames
+    are encoded in order on a background thread; close() completes the files.
+    """
+
+    def __init__(self, fps=10, codec='mjpeg', quality=90, max_pending=8):
+        """
+        :param fps: (float)
+            frames per second of every video
+        :param codec: (str)
+            key of VIDEO_CODECS
+        :param quality: (int)
+            0 to 100, JPEG quality for mjpeg, mapped to the writer's levels otherwise
+        :param max_pending: (int)
+            frames queued before submit() blocks
+        """
+        if codec not in VIDEO_CODECS:
+            raise ValueError('Unknown video codec: {0}'.format(codec))
+        self.fps = fps
+        self.codec = codec
+        self.quality = quality
+        self.streams = dict()  # video path -> AviStream or MovieStream
+        # One thread keeps the frames of each video in order
+        self._pool = ThreadPoolExecutor(1)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def _write(self, pixels, outfile):
+        try:
+            extension, writer_class = VIDEO_CODECS[self.codec]
+            path = stream_name(outfile, extension)
+            if path not in self.streams:
+                height, width = pixels.shape[:2]
+                stream_class = AviStream if writer_class is None else MovieStream
+                self.streams[path] = stream_class(path, width, height, self.fps, self.codec, self.quality)
+            self.streams[path].write(pixels)
+            return path
+        finally:
+            self._slots.release()
+
+    def submit(self, pixels, outfile):
+        """
+        Queue a frame, blocking while max_pending frames are already queued.
+
+        :param pixels: (np.ndarray)
+            (height, width, components) uint8 frame, not modified afterwards
+        :param outfile: (str)
+            image name of the frame, selects its video
+        """
+        self._slots.acquire()
+        self._futures.append(self._pool.submit(self._write, pixels, outfile))
+
+    def flush(self):
+        """
+        Wait until every queued frame is encoded. The videos stay open.
+
+        :return: (list of str)
+            video of each frame since the last flush
+        :raises: the first error of a failed frame
+        """
+        futures, self._futures = self._futures, []
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Encode the queued frames and complete every video."""
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+            for stream in self.streams.values():
+                stream.close()
+            self.streams.clear()
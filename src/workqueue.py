@@ -0,0 +1,343 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import socket
+import threading
+import time
+import traceback
+import uuid
+from collections import namedtuple
+
+from src import batch
+from src.airburst import AIRBURST, RENDER_MODES
+
+STATES = ('pending', 'leased', 'done', 'failed')
+
+# A claimed job: leased/<id>.<worker>.<expires>.json, renewed by renaming to a later expiry
+Lease = namedtuple('Lease', ['id', 'path', 'job', 'attempts', 'expires'])
+
+
+def worker_name():
+    """:return: (str) hostname-pid, safe to use in file names"""
+    return re.sub(r'[^A-Za-z0-9-]', '-', '{0}-{1}'.format(socket.gethostname(), os.getpid()))
+
+
+def _write_json(path, record):
+    # Write next to the destination and move into place, readers never see a partial record
+    partial = '{0}.{1}.partial'.format(path, uuid.uuid4().hex)
+    with open(partial, 'w') as handle:
+        json.dump(record, handle, indent=2)
+    os.replace(partial, path)
+
+
+def _read_json(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+class WorkQueue(object):
+    """
+    Work queue of plain files on a filesystem shared by every node.
+
+    A job is one JSON record that moves between the state folders
+        <folder>/pending/  ->  leased/  ->  done/ or failed/
+    by os.rename, which is atomic, so exactly one worker wins each claim.
+    A lease expires at the time in its file name unless the worker renews it;
+    expired and failed jobs go back to pending until max_attempts is reached.
+    Expiry compares the clocks of the nodes, keep them in sync (NTP).
+    """
+
+    def __init__(self, folder, lease_seconds=300, max_attempts=3):
+        """
+        :param folder: (str)
+            queue folder on the shared filesystem
+        :param lease_seconds: (float)
+            time a worker may hold a job without renewing its lease
+        :param max_attempts: (int)
+            claims of a job before it is moved to failed/
+        """
+        self.folder = folder
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        for state in STATES:
+            os.makedirs(os.path.join(folder, state), exist_ok=True)
+
+    def _path(self, state, name):
+        return os.path.join(self.folder, state, name)
+
+    def _names(self, state):
+        return sorted(name for name in os.listdir(os.path.join(self.folder, state)) if name.endswith('.json'))
+
+    def submit(self, jobs):
+        """
+        Add jobs, skipping any job that is already pending or leased. A job that
+        is done or failed goes back to pending under its id with its attempts
+        reset, e.g. an image rendered again with force or a failed job retried.
+
+        :param jobs: (list of dict)
+            JSON-serializable job descriptions
+        :return: (list of str)
+            ids of the added jobs
+        """
+        ids = {state: dict((name.split('.')[0].split('-')[-1], name.split('.')[0]) for name in self._names(state))
+               for state in STATES}
+        active = set(ids['pending']) | set(ids['leased'])
+        sequence = 1 + max([int(job_id.split('-')[0]) for state in STATES for job_id in ids[state].values()],
+                           default=-1)
+        added = []
+        for job in jobs:
+            digest = hashlib.sha1(json.dumps(job, sort_keys=True).encode()).hexdigest()[:16]
+            if digest in active:
+                continue
+            active.add(digest)
+            finished = [state for state in ('done', 'failed') if digest in ids[state]]
+            if finished:
+                job_id = ids[finished[0]][digest]
+            else:
+                # The sequence number keeps the claim order of the submission
+                job_id = '{0:06d}-{1}'.format(sequence, digest)
+                sequence += 1
+            _write_json(self._path('pending', job_id + '.json'), {'id': job_id, 'job': job, 'attempts': 0, 'errors': []})
+            for state in finished:
+                os.remove(self._path(state, job_id + '.json'))
+            added.append(job_id)
+        return added
+
+    def claim(self, worker):
+        """
+        :param worker: (str)
+            name of the claiming worker, see worker_name()
+        :return: (Lease)
+            the first pending job, None if there is none
+        """
+        for name in self._names('pending'):
+            job_id = name[:-len('.json')]
+            expires = time.time() + self.lease_seconds
+            leased = self._path('leased', '{0}.{1}.{2:.0f}.json'.format(job_id, worker, expires))
+            try:
+                os.rename(self._path('pending', name), leased)
+            except OSError:
+                continue  # claimed by another worker
+            record = _read_json(leased)
+            return Lease(job_id, leased, record['job'], record['attempts'] + 1, expires)
+        return None
+
+    def renew(self, lease):
+        """
+        :param lease: (Lease)
+        :return: (Lease)
+            the lease with a new expiry
+        :raises: OSError if the lease expired and the job was taken back
+        """
+        expires = time.time() + self.lease_seconds
+        job_id, worker = os.path.basename(lease.path).split('.')[:2]
+        path = self._path('leased', '{0}.{1}.{2:.0f}.json'.format(job_id, worker, expires))
+        os.rename(lease.path, path)
+        return lease._replace(path=path, expires=expires)
+
+    def complete(self, lease, result=None):
+        """
+        :param lease: (Lease)
+        :param result: (dict)
+            JSON-serializable report stored in done/<id>.json
+        """
+        record = _read_json(lease.path)
+        record.update(attempts=lease.attempts, result=result, finished=time.time())
+        _write_json(self._path('done', lease.id + '.json'), record)
+        os.remove(lease.path)
+
+    def fail(self, lease, error):
+        """
+        Give a job back: pending again, or failed/ after max_attempts claims.
+
+        :param lease: (Lease)
+        :param error: (str)
+        """
+        self._release(lease.path, lease.attempts, error)
+
+    def _release(self, path, attempts, error):
+        record = _read_json(path)
+        record['attempts'] = attempts
+        record['errors'].append(error)
+        state = 'failed' if attempts >= self.max_attempts else 'pending'
+        _write_json(self._path(state, record['id'] + '.json'), record)
+        os.remove(path)
+
+    def requeue_expired(self):
+        """
+        Take back every job whose lease expired, e.g. because its worker died.
+
+        :return: (list of str)
+            ids of the jobs taken back
+        """
+        expired = []
+        now = time.time()
+        for name in self._names('leased'):
+            job_id, worker, expires = name[:-len('.json')].split('.')
+            if float(expires) > now:
+                continue
+            # Renaming first makes the expiry handled once, and fails the worker's next renew
+            taken = self._path('leased', '{0}.expired-{1}'.format(name, uuid.uuid4().hex))
+            try:
+                os.rename(self._path('leased', name), taken)
+            except OSError:
+                continue
+            attempts = _read_json(taken)['attempts'] + 1
+            self._release(taken, attempts, 'lease of {0} expired'.format(worker))
+            expired.append(job_id)
+        return expired
+
+    def status(self):
+        """:return: (dict) state -> number of jobs"""
+        return {state: len(self._names(state)) for state in STATES}
+
+    def records(self, state):
+        """:return: (list of dict) job records in a state folder"""
+        return [_read_json(self._path(state, name)) for name in self._names(state)]
+
+
+class _Heartbeat(object):
+    """Renew a lease in the background while its job renders."""
+
+    def __init__(self, queue, lease):
+        self.queue = queue
+        self.lease = lease
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3.0):
+            try:
+                self.lease = self.queue.renew(self.lease)
+            except OSError:
+                return  # taken back, complete()/fail() will find the lease gone
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.lease
+
+
+# from src.workqueue import run_worker; run_worker('//cluster/share/airburst_queue')
+def run_worker(queue_folder, cache_folder=None, lease_seconds=300, max_attempts=3, poll=5.0, worker=None):
+    """
+    Claim and render batch jobs until the queue has nothing left to claim or to wait for.
+
+    Start one per node, or several on a node with many cores; every worker owns one
+    offscreen AsteroidVTK like the processes of run_batch.
+
+    :param queue_folder: (str)
+        WorkQueue folder on the shared filesystem
+    :param cache_folder: (str)
+        binary volume cache (see VolumeCache), None to read .vti directly
+    :param lease_seconds: (float)
+        must match the coordinator
+    :param max_attempts: (int)
+        must match the coordinator
+    :param poll: (float)
+        seconds between claims while other workers hold the remaining jobs
+    :param worker: (str)
+        name recorded with the results, defaults to worker_name()
+    :return: (int)
+        jobs rendered by this worker
+    """
+    queue = WorkQueue(queue_folder, lease_seconds, max_attempts)
+    worker = worker or worker_name()
+    batch._init_worker(batch._create_renderer, (cache_folder,))
+    rendered = 0
+    while True:
+        lease = queue.claim(worker)
+        if lease is None:
+            queue.requeue_expired()
+            status = queue.status()
+            if not status['pending'] and not status['leased']:
+                return rendered
+            time.sleep(poll)
+            continue
+
+        heartbeat = _Heartbeat(queue, lease)
+        try:
+            job, elapsed = batch._render_job(batch.RenderJob(**lease.job))
+        except Exception:
+            lease = heartbeat.stop()
+            try:
+                queue.fail(lease, '{0}: {1}'.format(worker, traceback.format_exc()))
+            except OSError:
+                pass  # the lease expired and the job was already taken back
+            continue
+        lease = heartbeat.stop()
+        try:
+            queue.complete(lease, {'worker': worker, 'seconds': elapsed})
+        except OSError:
+            # The job was taken back and will be rendered again, the image is already in place
+            continue
+        rendered += 1
+        print('{0} rendered {1} {2} ({3:.2f}s)'.format(
+            worker, job.mode, os.path.basename(job.sourcefile), elapsed))
+
+
+def submit_batch(queue_folder, root_folder, attribute='v03', modes=tuple(RENDER_MODES), images=AIRBURST,
+                 force=False, lease_seconds=300, max_attempts=3):
+    """
+    Queue the render jobs of a sweep that are not up to date (see run_batch).
+
+    :return: (WorkQueue)
+    """
+    queue = WorkQueue(queue_folder, lease_seconds, max_attempts)
+    jobs = batch.build_jobs(root_folder, attribute, modes, images)
+    pending = [job._asdict() for job in jobs if force or not batch.is_up_to_date(job)]
+    added = queue.submit(pending)
+    print('Queued {0} of {1} jobs ({2} up to date)'.format(len(added), len(jobs), len(jobs) - len(pending)))
+    return queue
+
+
+def coordinate(queue, poll=10.0):
+    """
+    Wait for the workers, taking back the jobs of workers that stopped renewing.
+
+    :param queue: (WorkQueue)
+    :param poll: (float)
+        seconds between checks
+    :return: (dict)
+        final state -> number of jobs
+    """
+    while True:
+        for job_id in queue.requeue_expired():
+            print('Lease expired, requeued {0}'.format(job_id))
+        status = queue.status()
+        print('Queue: {pending} pending, {leased} leased, {done} done, {failed} failed'.format(**status))
+        if not status['pending'] and not status['leased']:
+            for record in queue.records('failed'):
+                print('Failed {0}: {1}'.format(record['id'], record['errors'][-1]))
+            return status
+        time.sleep(poll)
+
+
+# from src.workqueue import run_distributed; run_distributed('D:/Downloads/Asteroid Ensemble - Airburst/', 'queue/')
+def run_distributed(root_folder, queue_folder, attribute='v03', modes=tuple(RENDER_MODES), images=AIRBURST,
+                    local_workers=0, cache_folder=None, force=False, lease_seconds=300, max_attempts=3):
+    """
+    Coordinator: queue the sweep and wait until every job is done or failed.
+
+    Workers on other nodes join with run_worker(queue_folder); local_workers
+    starts that many worker processes on this machine as well.
+
+    :param local_workers: (int)
+        worker processes to start here
+    :return: (dict)
+        final state -> number of jobs
+    """
+    queue = submit_batch(queue_folder, root_folder, attribute, modes, images, force, lease_seconds, max_attempts)
+    processes = [multiprocessing.Process(target=run_worker,
+                                         args=(queue_folder, cache_folder, lease_seconds, max_attempts, 1.0))
+                 for _ in range(local_workers)]
+    for process in processes:
+        process.start()
+    try:
+        return coordinate(queue, poll=min(10.0, lease_seconds / 3.0))
+    finally:
+        for process in processes:
+            process.join()
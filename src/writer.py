@@ -0,0 +1,110 @@
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png(pixels, compression=5):
+    """
+    Encode an image as PNG with zlib, which releases the GIL while compressing.
+
+    :param pixels: (np.ndarray)
+        (height, width, 3 or 4) uint8 image, first row at the bottom as in VTK
+    :param compression: (int)
+        zlib level, 0 (stored, uncompressed) to 9
+    :return: (bytes)
+    """
+    height, width, components = pixels.shape
+    # PNG stores the top row first; every row starts with filter type 0 (none)
+    rows = np.empty((height, 1 + width * components), dtype=np.uint8)
+    rows[:, 0] = 0
+    rows[:, 1:] = pixels[::-1].reshape(height, -1)
+    color_type = {3: 2, 4: 6}[components]
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return b''.join([
+        PNG_SIGNATURE,
+        _png_chunk(b'IHDR', header),
+        _png_chunk(b'IDAT', zlib.compress(rows.tobytes(), compression)),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+class AsyncImageWriter(object):
+    """
+    Write-behind output queue: frames are encoded and written on a thread pool
+    while rendering continues. At most max_pending frames are held in memory;
+    submit() blocks when the queue is full.
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, compression=5, raw=False):
+        """
+        :param max_workers: (int)
+            encoding/writing threads
+        :param max_pending: (int)
+            frames queued or in flight before submit() blocks
+        :param compression: (int)
+            PNG zlib level, 0 for uncompressed
+        :param raw: (bool)
+            skip PNG and write the frame as a .npy array
+        """
+        self.compression = compression
+        self.raw = raw
+        self._pool = ThreadPoolExecutor(max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def _write(self, pixels, outfile):
+        try:
+            if self.raw:
+                outfile = os.path.splitext(outfile)[0] + '.npy'
+                np.save(outfile, pixels)
+            else:
+                with open(outfile, 'wb') as handle:
+                    handle.write(encode_png(pixels, self.compression))
+            return outfile
+        finally:
+            self._slots.release()
+
+    def submit(self, pixels, outfile):
+        """
+        Queue a frame, blocking while max_pending frames are already queued.
+
+        :param pixels: (np.ndarray)
+            (height, width, components) uint8 frame, not modified afterwards
+        :param outfile: (str)
+            destination image
+        """
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(self._write, pixels, outfile)
+        except Exception:
+            # e.g. the pool is shut down: _write never runs to give the slot back
+            self._slots.release()
+            raise
+        self._futures.append(future)
+
+    def flush(self):
+        """
+        Wait until every queued frame is on disk.
+
+        :return: (list of str)
+            files written since the last flush
+        :raises: the first error of a failed write
+        """
+        futures, self._futures = self._futures, []
+        return [future.result() for future in futures]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+import vtk
+
+from src.airburst import AIRBURST
+from src.benchmark import synthetic_volume
+
+
+def write_series(folder, size=24, count=3):
+    """
+    :return: (list of str)
+        synthetic .vti timesteps named like the first count AIRBURST timesteps
+    """
+    os.makedirs(folder, exist_ok=True)
+    sourcefiles = []
+    for i, image in enumerate(AIRBURST[:count]):
+        sourcefile = os.path.join(folder, image)
+        writer = vtk.vtkXMLImageDataWriter()
+        writer.SetInputData(synthetic_volume(size, seed=i))
+        writer.SetFileName(sourcefile)
+        writer.Write()
+        sourcefiles.append(sourcefile)
+    return sourcefiles
+
+
+@pytest.fixture
+def series(tmp_path):
+    """Three synthetic 24^3 timesteps in a temporary folder."""
+    return write_series(str(tmp_path))
@@ -0,0 +1,26 @@
+import os
+
+import numpy as np
+import vtk.util.numpy_support as VN
+
+from src.cache import VolumeCache, read_vti
+from tests.conftest import write_series
+
+
+def test_runs_with_the_same_timestep_names_get_their_own_entries(tmp_path):
+    run_a = write_series(str(tmp_path / 'run_a'), size=16, count=1)[0]
+    run_b = write_series(str(tmp_path / 'run_b'), size=20, count=1)[0]
+    cache = VolumeCache(str(tmp_path / 'cache'))
+    assert cache.load_array(run_a, 'v03').shape == (16, 16, 16)
+    assert cache.load_array(run_b, 'v03').shape == (20, 20, 20)
+    # Both entries stay valid, switching back does not convert again
+    mtime = os.path.getmtime(os.path.join(cache._entry(run_a), 'header.json'))
+    assert cache.load_array(run_a, 'v03').shape == (16, 16, 16)
+    assert os.path.getmtime(os.path.join(cache._entry(run_a), 'header.json')) == mtime
+
+
+def test_cached_array_matches_the_vti(series, tmp_path):
+    cache = VolumeCache(str(tmp_path / 'cache'))
+    image = cache.load(series[1], 'v03')
+    expected = VN.vtk_to_numpy(read_vti(series[1], 'v03').GetPointData().GetArray('v03'))
+    np.testing.assert_array_equal(VN.vtk_to_numpy(image.GetPointData().GetScalars()), expected)
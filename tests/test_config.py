@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+from src.airburst import CAMERA_PRESETS
+from src.batch import is_up_to_date, outfiles
+from src.config import RenderPlan, run_plan
+from tests.conftest import write_series
+
+
+def _config(root, cameras, top):
+    return {
+        'settings': {'processes': 2, 'size': [64, 64]},
+        'cameras': {'top': top},
+        'datasets': [{'root': root, 'modes': ['iso', 'volume'], 'cameras': cameras}],
+    }
+
+
+def test_camera_presets_belong_to_their_plan(series):
+    root = os.path.dirname(series[0])
+    presets = dict(CAMERA_PRESETS)
+    first = RenderPlan(_config(root, ['front', 'top'], [0, 90.0]))
+    second = RenderPlan(_config(root, ['top'], [1, 45.0, 10.0]))
+    assert CAMERA_PRESETS == presets
+    assert first.jobs[0].targets[0].cameras == (('front',) + CAMERA_PRESETS['front'], ('top', 0, 90.0))
+    assert second.jobs[0].targets[0].cameras == (('top', 1, 45.0, 10.0),)
+    with pytest.raises(ValueError):
+        RenderPlan(_config(root, ['bottom'], [0, 90.0]))
+
+
+def test_plan_renders_through_the_batch_runner(series):
+    plan = RenderPlan(_config(os.path.dirname(series[0]), ['front', 'top'], [0, 90.0]))
+    results = run_plan(plan)
+    assert sorted(job.sourcefile for job, _ in results) == sorted(series)
+    for job in plan.jobs:
+        assert len(outfiles(job)) == 4
+        assert is_up_to_date(job)
+    assert run_plan(plan) == []
+    outfolder = plan.jobs[0].targets[0].outfolder
+    assert not [name for name in os.listdir(outfolder) if name.startswith('.partial')]
@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import Future
+
+from src.airburst import AsteroidVTK
+from src.explore import LOD_ACTORS, Explorer, Frame, FrameLoader
+
+
+def test_camera_drag_and_keys(series):
+    ast = AsteroidVTK(offscreen=True, persistent=True, size=(64, 64))
+    explorer = Explorer(ast, series, 'v03', mode='volume', stride=2)
+    try:
+        explorer.show(0)
+        interactor = explorer.interactor
+        lod_visible = []
+        ast.window.AddObserver('EndEvent', lambda caller, event: lod_visible.append(
+            [name for name in LOD_ACTORS if explorer.lod_scene[name].GetVisibility()]))
+
+        interactor.SetEventInformation(32, 32)
+        interactor.InvokeEvent('LeftButtonPressEvent')
+        assert explorer.interacting
+        interactor.SetEventInformation(40, 36)
+        interactor.InvokeEvent('MouseMoveEvent')
+        assert lod_visible[-1] == ['volume'] and not ast.scene['volume'].GetVisibility()
+        interactor.InvokeEvent('LeftButtonReleaseEvent')
+        assert not explorer.interacting
+        assert lod_visible[-1] == [] and ast.scene['volume'].GetVisibility()
+
+        for key, index, mode in (('Right', 1, 'volume'), ('Up', 1, 'iso'), ('End', 2, 'iso'), ('Right', 2, 'iso')):
+            interactor.SetKeySym(key)
+            interactor.InvokeEvent('KeyPressEvent')
+            assert (explorer.index, explorer.mode) == (index, mode)
+        assert ast.scene['iso_low'].GetVisibility() and not ast.scene['volume'].GetVisibility()
+    finally:
+        explorer.close()
+
+
+class _CountingLoader(FrameLoader):
+    def __init__(self, *args, **kwargs):
+        FrameLoader.__init__(self, *args, **kwargs)
+        self.loads = []
+
+    def _load(self, index):
+        self.loads.append(index)
+        return Frame(None, None, 0.0, 1.0)
+
+    def settle(self):
+        # The pool has one thread: the preloads queued so far, and their callbacks, are done
+        self._pool.submit(lambda: None).result()
+
+
+class _ImmediatePool(object):
+    """Runs each load in the calling thread, as if it finished before get() returns."""
+
+    def submit(self, function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def test_finished_loads_do_not_deadlock_get():
+    frames = _CountingLoader(['a.vti', 'b.vti', 'c.vti'], 'v03')
+    frames._pool = _ImmediatePool()
+    thread = threading.Thread(target=lambda: [frames.get(index) for index in (0, 1, 2, 1)], daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert sorted(frames.loads) == [0, 1, 2]
+
+
+def test_stepping_back_and_forth_keeps_the_neighbours():
+    frames = _CountingLoader(['{0}.vti'.format(i) for i in range(8)], 'v03', keep=3)
+    try:
+        for index in (3, 4, 3, 4, 3):
+            frames.get(index)
+            frames.settle()
+            assert {index - 1, index, index + 1} <= set(frames.loaded())
+        # 3 and 4 are read once, only the outer neighbour of each step is read again
+        assert frames.loads == [3, 4, 2, 5, 2, 5, 2]
+    finally:
+        frames.close()
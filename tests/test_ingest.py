@@ -0,0 +1,119 @@
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.ingest import download, ingest, list_timesteps
+from tests.conftest import write_series
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """Static files with Range support like Apache; records every request."""
+
+    truncate = False  # serve half of every file, as a dropped connection would
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path, self.headers.get('Range')))
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            return SimpleHTTPRequestHandler.do_GET(self)
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            if start >= len(data):
+                self.send_error(416)
+                return
+        body = data[start:len(data) // 2 if self.server.truncate else len(data)]
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.server.requests.append((self.command, self.path, None))
+        return SimpleHTTPRequestHandler.do_HEAD(self)
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Serves tmp_path/remote, a listing of three .vti files, each linked twice."""
+    remote = str(tmp_path / 'remote')
+    sourcefiles = write_series(remote, size=12)
+    links = ''.join('<a href="{0}">{0}</a> <a href="{0}">again</a>\n'.format(os.path.basename(sourcefile))
+                    for sourcefile in sourcefiles)
+    with open(os.path.join(remote, 'index.html'), 'w') as handle:
+        handle.write('<html><body>{0}<a href="?C=M;O=A">sort</a></body></html>'.format(links))
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), partial(RangeHandler, directory=remote))
+    httpd.requests = []
+    httpd.truncate = False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = 'http://127.0.0.1:{0}/'.format(httpd.server_address[1])
+    httpd.sourcefiles = sourcefiles
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _read(path):
+    with open(path, 'rb') as handle:
+        return handle.read()
+
+
+def test_listing_is_deduplicated_in_order(server):
+    assert list_timesteps(server.url) == [os.path.basename(sourcefile) for sourcefile in server.sourcefiles]
+
+
+def test_ingest_downloads_every_timestep(server, tmp_path):
+    local = list(ingest(str(tmp_path / 'local'), server.url))
+    assert [os.path.basename(path) for path in local] == list_timesteps(server.url)
+    for path, sourcefile in zip(local, server.sourcefiles):
+        assert _read(path) == _read(sourcefile)
+    # Complete files are not downloaded again, only their size is checked
+    del server.requests[:]
+    list(ingest(str(tmp_path / 'local'), server.url))
+    assert all(command != 'GET' or path == '/' for command, path, _ in server.requests)
+
+
+def test_partial_download_resumes_with_a_range_request(server, tmp_path):
+    sourcefile = server.sourcefiles[0]
+    name = os.path.basename(sourcefile)
+    localfile = str(tmp_path / name)
+    data = _read(sourcefile)
+    with open(localfile + '.partial', 'wb') as handle:
+        handle.write(data[:1000])
+    download(server.url + name, localfile)
+    assert _read(localfile) == data
+    assert not os.path.exists(localfile + '.partial')
+    assert ('GET', '/' + name, 'bytes=1000-') in server.requests
+
+
+def test_complete_partial_is_renamed_without_a_request(server, tmp_path):
+    sourcefile = server.sourcefiles[0]
+    name = os.path.basename(sourcefile)
+    localfile = str(tmp_path / name)
+    with open(localfile + '.partial', 'wb') as handle:
+        handle.write(_read(sourcefile))
+    download(server.url + name, localfile)
+    assert _read(localfile) == _read(sourcefile)
+    assert [command for command, _, _ in server.requests] == ['HEAD']
+
+
+def test_short_download_fails_the_size_check(server, tmp_path):
+    server.truncate = True
+    name = os.path.basename(server.sourcefiles[0])
+    localfile = str(tmp_path / name)
+    with pytest.raises(IOError, match='Incomplete download'):
+        download(server.url + name, localfile)
+    assert not os.path.exists(localfile)
+    # The partial data is kept and the next attempt resumes from it
+    server.truncate = False
+    download(server.url + name, localfile)
+    assert _read(localfile) == _read(server.sourcefiles[0])
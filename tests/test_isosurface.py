@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+from src.airburst import AsteroidVTK
+from src.cache import read_vti
+from src.isosurface import IsosurfaceCache, block_ranges
+from tests.conftest import write_series
+
+
+def _mesh(cache, sourcefile, value=0.5):
+    return cache.load(sourcefile, 'v03', value, read_vti(sourcefile, 'v03'))
+
+
+def test_runs_with_the_same_timestep_names_get_their_own_meshes(tmp_path):
+    run_a = write_series(str(tmp_path / 'run_a'), size=30, count=1)[0]
+    run_b = write_series(str(tmp_path / 'run_b'), size=40, count=1)[0]
+    cache = IsosurfaceCache(str(tmp_path / 'cache'))
+    assert cache._entry(run_a) != cache._entry(run_b)
+    assert _mesh(cache, run_a).GetBounds() != _mesh(cache, run_b).GetBounds()
+    # Reloading either run reads its own mesh back
+    bounds_a = _mesh(cache, run_a).GetBounds()
+    assert _mesh(cache, run_a).GetBounds() == bounds_a
+
+
+def test_rewritten_source_is_extracted_again(tmp_path):
+    sourcefile = write_series(str(tmp_path / 'run'), size=30, count=1)[0]
+    cache = IsosurfaceCache(str(tmp_path / 'cache'))
+    before = _mesh(cache, sourcefile).GetNumberOfPoints()
+    # Same name and an older mtime: ordering alone would keep the stale mesh
+    mtime = os.path.getmtime(sourcefile)
+    write_series(str(tmp_path / 'run'), size=40, count=1)
+    os.utime(sourcefile, (mtime - 60, mtime - 60))
+    after = _mesh(cache, sourcefile)
+    assert after.GetNumberOfPoints() != before
+    block_min, _ = cache.block_ranges(sourcefile, 'v03', None)
+    assert block_min.shape == (3, 3, 3)
+
+
+def test_block_ranges_with_and_without_widening():
+    data = np.random.default_rng(0).random((37, 20, 33), dtype=np.float32)
+    block_min, block_max = block_ranges(data, 16, widen=False)
+    widened_min, widened_max = block_ranges(data, 16)
+    assert block_min.shape == widened_min.shape == (3, 2, 3)
+    for k, j, i in np.ndindex(block_min.shape):
+        block = data[k * 16:(k + 1) * 16, j * 16:(j + 1) * 16, i * 16:(i + 1) * 16]
+        assert block_min[k, j, i] == block.min() and block_max[k, j, i] == block.max()
+        # One more point along each axis: the cells on the block border
+        cells = data[k * 16:(k + 1) * 16 + 1, j * 16:(j + 1) * 16 + 1, i * 16:(i + 1) * 16 + 1]
+        assert widened_min[k, j, i] <= cells.min() and widened_max[k, j, i] >= cells.max()
+
+
+def test_empty_space_skipping_reads_the_block_ranges_of_the_isosurface_cache(series, tmp_path):
+    cache = IsosurfaceCache(str(tmp_path / 'isosurfaces'))
+    ast = AsteroidVTK(offscreen=True, persistent=True, isosurfaces=cache, skip_empty=True, size=(64, 64))
+    direct = AsteroidVTK(offscreen=True, persistent=True, skip_empty=True, size=(64, 64))
+    for renderer in (ast, direct):
+        renderer.render_volume(series[0], str(tmp_path / 'volume.png'), 'v03')
+    assert os.path.exists(os.path.join(cache._entry(series[0]), 'v03_blocks.npz'))
+    np.testing.assert_array_equal(ast._blocks[0], cache.block_ranges(series[0], 'v03', None)[0])
+    # The widened blocks crop at most one block more than the exact ones
+    cached = ast._occupied_bounds(0.0, 1.0)
+    exact = direct._occupied_bounds(0.0, 1.0)
+    assert all(cached[i] <= exact[i] if i % 2 == 0 else cached[i] >= exact[i] for i in range(6))
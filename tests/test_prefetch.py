@@ -0,0 +1,7 @@
+from src.prefetch import Prefetcher
+
+
+def test_load_outside_the_iteration_decodes_only_the_attribute(series):
+    image = Prefetcher(series, 'v03').load(series[1], 'v03')
+    point_data = image.GetPointData()
+    assert [point_data.GetArrayName(i) for i in range(point_data.GetNumberOfArrays())] == ['v03']
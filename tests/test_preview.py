@@ -0,0 +1,38 @@
+import numpy as np
+import vtk.util.numpy_support as VN
+
+from src.airburst import AsteroidVTK
+from src.cache import VolumeCache, read_vti
+
+
+def _volume(image, attribute='v03'):
+    data = VN.vtk_to_numpy(image.GetPointData().GetArray(attribute))
+    return data.reshape(tuple(reversed(image.GetDimensions())))
+
+
+def test_reader_decodes_only_the_rendered_array(series):
+    ast = AsteroidVTK(offscreen=True)
+    ast._load_data(series[0], 'v03')
+    point_data = ast.source.GetOutputDataObject(0).GetPointData()
+    assert [point_data.GetArrayName(i) for i in range(point_data.GetNumberOfArrays())] == ['v03']
+
+
+def test_preview_from_reader_matches_the_full_volume(series, tmp_path):
+    voi = (2, 17, 4, 19, 3, 20)
+    full = _volume(read_vti(series[0], 'v03'))
+    expected = full[3:21:2, 4:20:2, 2:18:2]
+    for cache in (None, VolumeCache(str(tmp_path / 'cache'))):
+        ast = AsteroidVTK(offscreen=True, voi=voi, stride=2, cache=cache)
+        ast._load_data(series[0], 'v03')
+        image = ast.source.GetOutputDataObject(0)
+        np.testing.assert_array_equal(_volume(image), expected)
+        assert image.GetOrigin() == (2 / 24.0, 4 / 24.0, 3 / 24.0)
+        assert image.GetSpacing() == (2 / 24.0, 2 / 24.0, 2 / 24.0)
+
+
+def test_full_load_after_a_preview_reads_the_whole_extent(series):
+    ast = AsteroidVTK(offscreen=True, voi=(0, 7, 0, 7, 0, 7))
+    ast._load_data(series[0], 'v03')
+    ast.voi = None
+    ast._load_data(series[1], 'v03')
+    np.testing.assert_array_equal(_volume(ast.source.GetOutputDataObject(0)), _volume(read_vti(series[1], 'v03')))
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from src.airburst import AsteroidVTK, RENDER_MODES
+
+
+def _prop_count(ast):
+    return ast.renderer.GetViewProps().GetNumberOfItems()
+
+
+def test_persistent_scene_keeps_actor_count(series, tmp_path):
+    ast = AsteroidVTK(offscreen=True, persistent=True, volume_mapper='cpu', size=(64, 64))
+    outfolder = str(tmp_path / 'output')
+    ast.render_all(series[0], outfolder, 'v03')
+    count = _prop_count(ast)
+    # Every scene actor but the slice color bar, which is never shown
+    assert count == len(ast.scene) - 1
+    for sourcefile in series * 2:
+        ast.render_all(sourcefile, outfolder, 'v03')
+        assert _prop_count(ast) == count
+        for mode, method in RENDER_MODES.items():
+            getattr(ast, method)(sourcefile, os.path.join(outfolder, mode + '.png'), 'v03')
+            assert _prop_count(ast) == count
+
+
+@pytest.mark.parametrize('mode', sorted(RENDER_MODES))
+def test_non_persistent_frames_remove_their_actors(series, tmp_path, mode):
+    ast = AsteroidVTK(offscreen=True, persistent=False, volume_mapper='cpu', size=(64, 64))
+    render = getattr(ast, RENDER_MODES[mode])
+    for i, sourcefile in enumerate(series * 2):
+        outfile = str(tmp_path / '{0}_{1}.png'.format(mode, i))
+        render(sourcefile, outfile, 'v03')
+        assert os.path.exists(outfile)
+        assert _prop_count(ast) == 0
+
+
+def test_auto_volume_mapper_is_resolved_once(series, tmp_path):
+    ast = AsteroidVTK(offscreen=True, persistent=False, size=(64, 64))
+    assert ast.volume_mapper == 'auto'
+    ast.render_volume(series[0], str(tmp_path / 'a.png'), 'v03')
+    resolved = ast.volume_mapper
+    assert resolved in ('gpu', 'cpu')
+    ast.window.Initialize = None  # any further resolution would fail
+    ast.render_volume(series[1], str(tmp_path / 'b.png'), 'v03')
+    assert ast.volume_mapper == resolved
+
+
+def test_stable_range_requires_stats():
+    with pytest.raises(ValueError):
+        AsteroidVTK(offscreen=True, stable_range=True)
@@ -0,0 +1,18 @@
+import numpy as np
+import vtk.util.numpy_support as VN
+
+from src.airburst import AsteroidVTK
+from src.slices import color_plane
+
+
+def test_color_plane_matches_the_vtk_lookup_table():
+    min_value, max_value = 0.05, 0.95
+    lookup = AsteroidVTK._build_slice_lookup(min_value, max_value)
+    table = VN.vtk_to_numpy(lookup.GetTable())
+    # Beyond both ends, across every bin and exactly on the range limits
+    values = np.linspace(-0.1, 1.1, 1001).reshape(7, 143)
+    values[0, :2] = min_value, max_value
+    expected = np.array([lookup.GetIndex(value) for value in values.ravel()]).reshape(values.shape)
+    np.testing.assert_array_equal(color_plane(values, table, min_value, max_value), table[expected, :3])
+    np.testing.assert_array_equal(color_plane(values.astype(np.float32), table, min_value, max_value),
+                                  table[expected, :3])
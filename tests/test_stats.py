@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.analytics import AnalyticsIndex
+from src.stats import PERCENTILES, StatsIndex, compute_stats
+from tests.conftest import write_series
+
+
+def test_indexes_reload_and_drop_entries_of_changed_sources(tmp_path):
+    sourcefile = write_series(str(tmp_path), count=1)[0]
+    parameters = {'attribute': 'v03', 'low': 0.1, 'high': 0.8}
+    stats = StatsIndex(str(tmp_path / 'stats.json'))
+    stats.add(sourcefile, {'v03': np.arange(10.0)})
+    stats.save()
+    analytics = AnalyticsIndex(str(tmp_path / 'analytics.json'))
+    analytics.add(sourcefile, parameters, {'volume_low': 1.0})
+    analytics.save()
+
+    stats = StatsIndex(stats.path)
+    analytics = AnalyticsIndex(analytics.path)
+    assert stats.get(sourcefile, 'v03')['max'] == 9.0
+    assert analytics.get(sourcefile, parameters) == {'volume_low': 1.0}
+    assert analytics.get(sourcefile, dict(parameters, high=0.9)) is None
+
+    mtime = os.path.getmtime(sourcefile)
+    os.utime(sourcefile, (mtime + 10, mtime + 10))
+    assert stats.get(sourcefile, 'v03') is None
+    assert analytics.get(sourcefile, parameters) is None
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 1000, 4096])
+def test_compute_stats_matches_numpy(size):
+    data = np.random.default_rng(size).random(size, dtype=np.float32).reshape(-1, 1)
+    stats = compute_stats(data, bins=8)
+    assert stats['min'] == data.min() and stats['max'] == data.max()
+    np.testing.assert_allclose([stats['percentiles'][str(p)] for p in PERCENTILES],
+                               np.percentile(data.astype(np.float64), PERCENTILES), rtol=1e-6)
+    assert sum(stats['histogram']['counts']) == size
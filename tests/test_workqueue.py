@@ -0,0 +1,53 @@
+import os
+
+from src.airburst import AIRBURST
+from src.batch import build_jobs, is_up_to_date
+from src.workqueue import WorkQueue, run_distributed, submit_batch
+from tests.conftest import write_series
+
+MODES = ('iso', 'volume')
+
+
+def test_distributed_sweep_requeues_expired_leases_and_fails_missing_files(tmp_path):
+    root, queue_folder = str(tmp_path / 'data'), str(tmp_path / 'queue')
+    write_series(root, count=3)
+    images = AIRBURST[:4]  # the last timestep is missing
+
+    # A worker that died holding a job: its lease is already expired
+    queue = WorkQueue(queue_folder, lease_seconds=-1)
+    queue.submit([build_jobs(root, 'v03', MODES, images)[0]._asdict()])
+    abandoned = queue.claim('dead-worker')
+
+    status = run_distributed(root, queue_folder, modes=MODES, images=images, local_workers=3, lease_seconds=3)
+    assert status == {'pending': 0, 'leased': 0, 'done': 6, 'failed': 2}
+    queue = WorkQueue(queue_folder)
+    done = {record['id']: record for record in queue.records('done')}
+    assert done[abandoned.id]['attempts'] == 2
+    assert 'lease of dead-worker expired' in done[abandoned.id]['errors'][0]
+    for record in queue.records('failed'):
+        assert record['job']['sourcefile'].endswith(images[3])
+        assert record['attempts'] == 3 and 'Missing timestep' in record['errors'][-1]
+    assert all(is_up_to_date(job) for job in build_jobs(root, 'v03', MODES, images[:3]))
+
+
+def test_finished_jobs_can_be_submitted_again(tmp_path):
+    root, queue_folder = str(tmp_path / 'data'), str(tmp_path / 'queue')
+    missing = write_series(root, count=2)[1]
+    os.rename(missing, missing + '.away')
+    images = AIRBURST[:2]
+    run_distributed(root, queue_folder, modes=('iso',), images=images, local_workers=1, lease_seconds=3)
+    queue = WorkQueue(queue_folder)
+    failed = [record['id'] for record in queue.records('failed')]
+    assert len(failed) == 1 and queue.status()['done'] == 1
+
+    # Only the failed job is out of date, it is retried under its id
+    os.rename(missing + '.away', missing)
+    status = run_distributed(root, queue_folder, modes=('iso',), images=images, local_workers=1, lease_seconds=3)
+    assert status == {'pending': 0, 'leased': 0, 'done': 2, 'failed': 0}
+    assert failed[0] in [record['id'] for record in queue.records('done')]
+    assert max(record['attempts'] for record in queue.records('done')) == 1
+
+    # Forced, every finished job is queued again
+    queue = submit_batch(queue_folder, root, modes=('iso',), images=images, force=True)
+    assert queue.status() == {'pending': 2, 'leased': 0, 'done': 0, 'failed': 0}
+    assert queue.submit([record['job'] for record in queue.records('pending')]) == []
@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+
+from src.writer import AsyncImageWriter
+
+
+def test_rejected_submit_gives_its_slot_back(tmp_path):
+    writer = AsyncImageWriter(max_pending=1)
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(np.zeros((4, 4, 3), np.uint8), str(tmp_path / 'frame.png'))
+    # A kept slot would block the next submit for good
+    assert writer._slots.acquire(blocking=False)